@@ -1,47 +1,128 @@
-import gradio as gr
+import json
+import logging
+import time
+from contextlib import aclosing
+from typing import Dict
 
 from commons.ThinkerInterface import Thinker
+from commons.components.LLMCores import TextGenerationCore
+from commons.components.api.settings.serving_settings import ServingSettings
+from commons.components.api.settings.tracing_settings import TracingSettings
+from commons.components.mechanics.MemoryStores import MemoryStore
+from commons.components.mechanics.Sessions import RunScheduler, SessionStore
+from commons.components.mechanics.Tracing import serve_metrics
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    The function `warm_up` pays the one-off costs of a process before the first submission: it opens
+    the vector database, loads the embedding model and loads the API client library.
+
+    Returns:
+        Dict[str, float]: The seconds spent on each step.
+    """
+    timings: Dict[str, float] = {}
+
+    started_at: float = time.perf_counter()
+    store: MemoryStore = MemoryStore.shared()
+    store.collection()
+    timings["memory_store"] = time.perf_counter() - started_at
+
+    try:
+        timings["embedding_model"] = store.embeddings.warm_up()
+    except Exception as e:
+        # the first submission will try again, e.g. once the model can be downloaded
+        logging.error(f"The embedding model could not be loaded: {e!r}")
+
+    started_at = time.perf_counter()
+    # the shared policies reference the error types of the client library, which loads it
+    TextGenerationCore.shared_scheduler()
+    TextGenerationCore.shared_retry_policy()
+    timings["llm_client"] = time.perf_counter() - started_at
+
+    return timings
 
 
 class Wrapper:
 
-    def __init__(self) -> None:
-        pass
+    def __init__(self, settings: ServingSettings = None) -> None:
+        """
+        The `Wrapper` class serves every user of the process. The `Thinker` of each session is kept in
+        a `SessionStore`, so that users never see nor elaborate each other's suggestions, and the tree
+        runs go through a `RunScheduler`, which caps how many are in progress at once.
+
+        Parameters:
+            settings (ServingSettings): The limits of the server, read from the environment if not given.
+        """
+        self.settings: ServingSettings = settings or ServingSettings()
+        self.sessions: SessionStore = SessionStore(
+            ttl_seconds=self.settings.session_ttl_seconds,
+            max_sessions=self.settings.max_sessions
+        )
+        self.scheduler: RunScheduler = RunScheduler(max_concurrent_runs=self.settings.max_concurrent_runs)
 
-    async def thinker_wrapper_function(self, situation: str, thoughts: str) -> str:
+    async def thinker_wrapper_function(self, situation: str, thoughts: str, session_id: str = "default") -> str:
         """
         This function is an asynchronous function used to encapsulate the use of the Thinker class.
 
         Parameters:
             situation (str): Represents the current situation.
             thoughts (str): Represents the current thoughts.
+            session_id (str): The session of the user, whose `Thinker` the suggestions are kept in.
 
         Returns:
             str: A markdown string representing the process and suggestions.
         """
 
-        self.thinker: Thinker = Thinker(
-            situation=situation,
-            thoughts=thoughts
-        )
+        # the run waits for a slot, and the user sees where they stand in the queue
+        async with aclosing(self.scheduler.queue()) as positions:
+            async for position in positions:
+                yield (
+                    "### ⏳ Waiting for a free slot\n\n"
+                    f"{self.scheduler.running} runs are in progress, you are number {position} in the queue."
+                )
+
+        try:
+            thinker: Thinker = Thinker(
+                situation=situation,
+                thoughts=thoughts
+            )
 
-        progress_log = "### 🧠 Thinking Process\n\n"
+            progress_log = "### 🧠 Thinking Process\n\n"
+            shown_at: float = 0.0
+            shown_length: int = 0
 
-        async for step, data in self.thinker.query_process():
-            progress_log += f"- {step}\n"
+            async for step, data in thinker.query_process():
+                if isinstance(data, str):
+                    # a partial output that is still streaming, shown under the log until it completes.
+                    # It is sent whole each time, so it is only sent again every so often.
+                    if not self.__due(shown_at, len(data) - shown_length):
+                        continue
+                    shown_at, shown_length = time.monotonic(), len(data)
+                    yield progress_log + f"\n```\n{data}\n```\n"
+                    continue
 
-            if data and "Brief" in step and isinstance(data, dict):
-                summary = data.get('summary', 'No summary available')
-                progress_log += f"  > **Summary**: {summary}\n"
+                shown_length = 0
+                progress_log += f"- {step}\n"
 
-            yield progress_log
+                if data and "Brief" in step and isinstance(data, dict):
+                    summary = data.get('summary', 'No summary available')
+                    progress_log += f"  > **Summary**: {summary}\n"
+
+                yield progress_log
+
+        finally:
+            await self.scheduler.release()
+
+        # the suggestions of the session are the ones of its latest run
+        self.sessions.put(session_id, thinker)
 
         # Final formatting of suggestions
         suggestions_md = "\n### 💡 Suggestions\n\n"
         suggestions_md += "| # | Suggestion | Rationale | Success Rate |\n"
         suggestions_md += "|---|---|---|---|\n"
 
-        for i, suggestion in enumerate(self.thinker.the_suggestions):
+        for i, suggestion in enumerate(thinker.the_suggestions):
             move = suggestion.get('move', 'N/A')
             rationale = suggestion.get('rationale', 'N/A')
             success_rate = suggestion.get('success_rate_in_percentage', 'N/A')
@@ -53,40 +134,95 @@ class Wrapper:
         # Tree Structure formatting
         tree_md = "\n### 🌳 Decision Tree\n\n"
         tree_md += "```json\n"
-        import json
-        tree_md += json.dumps(self.thinker.tree_structure, indent=2, ensure_ascii=False)
+        tree_md += json.dumps(thinker.tree_structure, indent=2, ensure_ascii=False)
         tree_md += "\n```\n"
 
         yield progress_log + suggestions_md + tree_md
 
-    async def elaboration_wrapper_function(self, selected_suggestion: int) -> str:
+    async def elaboration_wrapper_function(self, selected_suggestion: int, session_id: str = "default") -> str:
         """
-        The function `elaboration_wrapper_function` takes in a selected suggestion and returns the
-        elaboration generated by the `think_process` method of the `thinker` object.
+        The function `elaboration_wrapper_function` takes in a selected suggestion and streams the
+        elaboration generated by the `think_process` method of the `thinker` of the session.
 
         :param selected_suggestion: The `selected_suggestion` parameter is an integer that represents
         the index of the suggestion that the user has selected. It is used as an input to the
         `think_process` method of the `thinker` object
         :type selected_suggestion: int
-        :return: a string, which is the elaboration generated by the `think_process` method of the
-        `thinker` object.
+        :param session_id: The session of the user, whose latest suggestions are elaborated
+        :type session_id: str
+        :return: the elaboration generated so far by the `think_process` method of the `thinker`
+        object, so that the first tokens show up right away.
         """
-        elaboration: str = await self.thinker.think_process(selected_suggestion=selected_suggestion)
+        thinker: Thinker = self.sessions.get(session_id)
+        if thinker is None:
+            yield "There are no suggestions in this session yet, or it expired. Submit a situation first."
+            return
 
-        return elaboration
+        if not 0 <= selected_suggestion < len(thinker.the_suggestions):
+            yield f"Pick a suggestion between 0 and {len(thinker.the_suggestions) - 1}."
+            return
+
+        shown_at: float = 0.0
+        shown: str = None
+        elaboration: str = None
+        async for elaboration in thinker.think_process(selected_suggestion=selected_suggestion):
+            if self.__due(shown_at, len(elaboration) - len(shown or "")):
+                shown_at, shown = time.monotonic(), elaboration
+                yield elaboration
+
+        # the complete elaboration is always shown
+        if elaboration is not None and elaboration is not shown:
+            yield elaboration
+
+    def __due(self, shown_at: float, grown_by: int) -> bool:
+        """
+        The function `__due` throttles the updates of a streamed output, which are sent whole: the next
+        one is due once `stream_update_interval_seconds` have passed or the output has grown by
+        `stream_update_characters` since the last one.
+        """
+        return (
+            time.monotonic() - shown_at >= self.settings.stream_update_interval_seconds
+            or grown_by >= self.settings.stream_update_characters
+        )
+
+    def close_session(self, session_id: str) -> None:
+        self.sessions.pop(session_id)
 
 
 if __name__ == '__main__':
-    import logging
     import os
 
+    # the UI library is only needed to serve, not by the modules importing `Wrapper`
+    import gradio as gr
+
     logging.basicConfig(level=logging.INFO)
     os.environ['TOKENIZERS_PARALLELISM'] = "false"
 
+    # the first submission only reuses what the warm-up loaded
+    logging.info(f"Warmed up in {warm_up()} seconds")
+
+    tracing_settings: TracingSettings = TracingSettings()
+    if tracing_settings.metrics_port is not None:
+        serve_metrics(port=tracing_settings.metrics_port, host=tracing_settings.metrics_host)
+
     wrapper: Wrapper = Wrapper()
 
-    interface: gr.Interface = gr.Interface(
-        fn=wrapper.thinker_wrapper_function,
+    # the session of a user is the one Gradio gives to their page
+    async def think(situation: str, thoughts: str, request: gr.Request):
+        async for output in wrapper.thinker_wrapper_function(situation, thoughts, session_id=request.session_hash):
+            yield output
+
+    async def elaborate(selected_suggestion: float, request: gr.Request):
+        async for output in wrapper.elaboration_wrapper_function(
+            int(selected_suggestion), session_id=request.session_hash
+        ):
+            yield output
+
+    def close(request: gr.Request) -> None:
+        wrapper.close_session(request.session_hash)
+
+    thinking: gr.Interface = gr.Interface(
+        fn=think,
         inputs=[
             gr.components.Textbox(
                 label="Situation",
@@ -110,4 +246,24 @@ if __name__ == '__main__':
         ]
     )
 
+    elaboration: gr.Interface = gr.Interface(
+        fn=elaborate,
+        inputs=[
+            gr.components.Number(label="Suggestion", value=0, precision=0)
+        ],
+        outputs=[
+            gr.Markdown()
+        ],
+        title="Elaboration",
+        description="Elaborate one of the suggestions of your latest run"
+    )
+
+    interface: gr.TabbedInterface = gr.TabbedInterface([thinking, elaboration], ["Think", "Elaborate"])
+    interface.unload(close)
+    # the handlers waiting in the run queue only stream their position, so many more than the runs in
+    # progress can be served at once
+    interface.queue(
+        default_concurrency_limit=wrapper.settings.queue_concurrency,
+        max_size=wrapper.settings.max_queue_size
+    )
     interface.launch()
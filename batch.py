@@ -0,0 +1,283 @@
+"""
+The command line of the batch mode. It streams situations from a JSONL file, one
+`{"situation": ..., "thoughts": ..., "id": ...}` record per line, through `Thinker.query_process` on a
+bounded pool of workers. The workers share the LLM client, the request scheduler and the memory store
+of the process. Each result is appended to the output JSONL as soon as its run completes, with the
+suggestions, the tree and the run summary. A throughput report is printed at the end, as JSON.
+
+A batch that was interrupted is resumed with `--resume`, which skips the records already in the output,
+or from a line of the input with `--offset`.
+
+Usage:
+    python batch.py --input situations.jsonl --output results.jsonl [--workers 8] [--offset 0] [--limit N]
+                    [--resume] [--deadline-seconds 60] [--max-tokens 50000] [--report-interval 30]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, TextIO, Tuple
+
+from app import warm_up
+from commons.ThinkerInterface import Thinker
+from commons.components.mechanics.MemoryStores import MemoryStore
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+
+    ordered: List[float] = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(share * len(ordered)) - 1))]
+
+
+def completed_indexes(path: str) -> Set[int]:
+    """
+    The function `completed_indexes` reads the records an earlier batch already wrote to the output.
+    The failed ones are not completed, so that they are run again.
+    :return: the input line indexes of the completed records.
+    """
+    completed: Set[int] = set()
+    try:
+        with open(path, encoding="utf-8") as output:
+            for line in output:
+                try:
+                    result: Dict[str, Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a batch that was killed may be truncated
+                    continue
+                if result.get("error") is None and isinstance(result.get("index"), int):
+                    completed.add(result["index"])
+    except FileNotFoundError:
+        pass
+
+    return completed
+
+
+async def records(
+    path: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    completed: Set[int] = frozenset()
+) -> AsyncIterator[Tuple[int, str]]:
+    """
+    The function `records` streams the lines of the input from `offset` on, with their index, so that
+    the input is never loaded at once.
+    """
+    read: int = 0
+    with open(path, encoding="utf-8") as lines:
+        for index, line in enumerate(lines):
+            if index < offset or index in completed or not line.strip():
+                continue
+            if limit is not None and read >= limit:
+                break
+            read += 1
+            yield index, line
+
+
+class BatchRunner:
+
+    def __init__(
+        self,
+        output: TextIO,
+        workers: int = 8,
+        deadline_seconds: float = None,
+        max_tokens: int = None,
+        report_interval: float = 30.0
+    ) -> None:
+        """
+        The initializer of `BatchRunner`.
+
+        :param output: The JSONL file the results are appended to
+        :type output: TextIO
+        :param workers: The runs in progress at the same time
+        :type workers: int
+        :param deadline_seconds: The seconds each run may take, the `budget` of the config if not given
+        :type deadline_seconds: float
+        :param max_tokens: The tokens each run may consume, the `budget` of the config if not given
+        :type max_tokens: int
+        :param report_interval: The seconds between two progress lines in the log
+        :type report_interval: float
+        """
+        self.output: TextIO = output
+        self.workers: int = max(1, workers)
+        self.deadline_seconds: float = deadline_seconds
+        self.max_tokens: int = max_tokens
+        self.report_interval: float = report_interval
+
+        self.latencies: List[float] = []
+        self.succeeded: int = 0
+        self.failed: int = 0
+        self.invalid: int = 0
+        self.llm_calls: int = 0
+        self.retries: int = 0
+        self.tokens: int = 0
+        self.started_at: float = None
+
+    async def run_record(self, index: int, line: str) -> Dict[str, Any]:
+        """
+        The function `run_record` runs the query of one input line end to end.
+        :return: the result line of the record, with an `error` if it is invalid or its run failed.
+        """
+        result: Dict[str, Any] = {"index": index}
+        try:
+            record: Dict[str, Any] = json.loads(line)
+            situation, thoughts = record["situation"], record.get("thoughts", "")
+            if not isinstance(situation, str) or not isinstance(thoughts, str):
+                raise TypeError("situation and thoughts must be strings")
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            self.invalid += 1
+            return {**result, "error": f"Invalid record: {e!r}"}
+
+        result.update(id=record.get("id"), situation=situation, thoughts=thoughts)
+        started_at: float = time.perf_counter()
+        thinker: Thinker = None
+        try:
+            thinker = Thinker(
+                situation=situation,
+                thoughts=thoughts,
+                deadline_seconds=self.deadline_seconds,
+                max_tokens=self.max_tokens
+            )
+            async for _ in thinker.query_process():
+                pass
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Record {index} failed: {e!r}")
+            result["error"] = repr(e)
+        else:
+            self.succeeded += 1
+            self.latencies.append(time.perf_counter() - started_at)
+            result.update(
+                error=None,
+                suggestions=thinker.the_suggestions,
+                tree=thinker.tree_structure
+            )
+
+        result["seconds"] = round(time.perf_counter() - started_at, 3)
+        if thinker is not None and thinker.run_summary:
+            total: Dict[str, Any] = thinker.run_summary["total"]
+            self.llm_calls += total.get("llm_calls", 0)
+            self.retries += total.get("retries", 0)
+            self.tokens += total.get("prompt_tokens", 0) + total.get("completion_tokens", 0)
+            result["summary"] = thinker.run_summary
+
+        return result
+
+    def write(self, result: Dict[str, Any]) -> None:
+        # one line per record, flushed so that an interrupted batch can be resumed from what it wrote
+        self.output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+        self.output.flush()
+
+    async def __worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            item: Optional[Tuple[int, str]] = await queue.get()
+            try:
+                if item is None:
+                    return
+                self.write(await self.run_record(*item))
+            finally:
+                queue.task_done()
+
+    async def __reporter(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            report: Dict[str, Any] = self.report()
+            logging.info(
+                f"{report['succeeded']} runs completed, {report['failed']} failed, "
+                f"{report['runs_per_second']:.2f} runs/s, {report['tokens_per_second']:.0f} tokens/s."
+            )
+
+    async def run(self, items: AsyncIterator[Tuple[int, str]]) -> Dict[str, Any]:
+        """
+        The function `run` feeds the records to the workers. The queue in between holds a few records
+        per worker, so the input is read as fast as the runs complete.
+        :return: the throughput report of the batch.
+        """
+        self.started_at = time.perf_counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * self.workers)
+        workers: List[asyncio.Task] = [asyncio.create_task(self.__worker(queue)) for _ in range(self.workers)]
+        reporter: asyncio.Task = asyncio.create_task(self.__reporter())
+
+        try:
+            async for item in items:
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        seconds: float = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "invalid": self.invalid,
+            "seconds": round(seconds, 3),
+            "runs_per_second": self.succeeded / seconds if seconds else 0.0,
+            "tokens_per_second": self.tokens / seconds if seconds else 0.0,
+            "latency_seconds": {
+                "p50": percentile(self.latencies, 0.5),
+                "p95": percentile(self.latencies, 0.95),
+                "p99": percentile(self.latencies, 0.99),
+                "max": max(self.latencies) if self.latencies else None,
+            },
+            "llm_calls": self.llm_calls,
+            "retries": self.retries,
+            "tokens": self.tokens,
+            "workers": self.workers,
+        }
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    logging.info(f"Warmed up in {warm_up()} seconds")
+
+    completed: Set[int] = completed_indexes(arguments.output) if arguments.resume else set()
+    if completed:
+        logging.info(f"Resuming, {len(completed)} records are already completed.")
+
+    try:
+        with open(arguments.output, "a", encoding="utf-8") as output:
+            runner: BatchRunner = BatchRunner(
+                output=output,
+                workers=arguments.workers,
+                deadline_seconds=arguments.deadline_seconds,
+                max_tokens=arguments.max_tokens,
+                report_interval=arguments.report_interval
+            )
+            report: Dict[str, Any] = await runner.run(
+                records(arguments.input, offset=arguments.offset, limit=arguments.limit, completed=completed)
+            )
+    finally:
+        # the memories of the runs are written behind, they are flushed before the process exits
+        MemoryStore.close_all()
+
+    report.update(skipped=len(completed), output=arguments.output)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    import os
+
+    parser = argparse.ArgumentParser(description="Run situations from a JSONL file through Thinker")
+    parser.add_argument("--input", required=True, help="One {\"situation\", \"thoughts\"} record per line")
+    parser.add_argument("--output", required=True, help="The results are appended to it, one line per record")
+    parser.add_argument("--workers", type=int, default=8, help="The runs in progress at the same time")
+    parser.add_argument("--offset", type=int, default=0, help="The input lines skipped, to resume from a line")
+    parser.add_argument("--limit", type=int, default=None, help="The records run at most")
+    parser.add_argument("--resume", action="store_true", help="Skip the records already completed in the output")
+    parser.add_argument("--deadline-seconds", type=float, default=None)
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--report-interval", type=float, default=30.0, help="The seconds between progress lines")
+
+    logging.basicConfig(level=logging.INFO)
+    os.environ['TOKENIZERS_PARALLELISM'] = "false"
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,390 @@
+"""
+The script serves a local stand-in of the chat completions API, so that Thinker can be benchmarked
+without spending anything on a live API. The replies are canned briefs, predictions, suggestions and
+simulation scores, picked from the JSON schema or the prompt of the request. The latency follows a
+configurable distribution, and a share of the requests fail with a 500, a 429 or a malformed JSON
+reply. Streamed requests get their content in chunks, the first one after part of the latency. The
+requests whose client disconnects before the reply is written are counted as `disconnects`.
+
+Usage:
+    python benchmarks/mock_server.py [--port 8000] [--latency lognormal:0.8:0.5] [--error-rate 0.01]
+                                     [--rate-limit-rate 0.02] [--malformed-rate 0.02] [--seed 0]
+
+Then point Thinker at it:
+    export OPENAI_BASE_URL="http://127.0.0.1:8000/v1" OPENAI_API_KEY="mock" OPENAI_MODEL="mock"
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+MOVES: List[str] = [
+    "Take a short break and come back to it",
+    "Talk it through with the manager",
+    "Split the work into smaller milestones",
+    "Ask a colleague for a second opinion",
+    "Sleep on it and decide tomorrow",
+    "Write the options down and compare them",
+    "Delegate the least important tasks",
+    "Set a deadline and commit to it",
+]
+SCENARIOS: List[str] = [
+    "The situation improves on its own",
+    "The situation stays as it is for a while",
+    "The situation gets worse before it gets better",
+    "An unexpected opportunity comes up",
+    "Other people get involved",
+]
+
+
+class LatencyDistribution:
+
+    def __init__(self, specification: str = "lognormal:0.8:0.5") -> None:
+        """
+        The initializer of `LatencyDistribution`.
+
+        :param specification: "fixed:<seconds>", "uniform:<low>:<high>" or "lognormal:<median>:<sigma>"
+        :type specification: str
+        """
+        self.specification: str = specification
+        kind, *parameters = specification.split(":")
+        self.kind: str = kind
+        self.parameters: List[float] = [float(parameter) for parameter in parameters]
+
+        expected: Dict[str, int] = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if expected.get(kind) != len(self.parameters):
+            raise ValueError(f"Unknown latency distribution: {specification}")
+
+    def sample(self, generator: random.Random) -> float:
+        match self.kind:
+            case "fixed":
+                return self.parameters[0]
+            case "uniform":
+                return generator.uniform(*self.parameters)
+            case "lognormal":
+                median, sigma = self.parameters
+                return generator.lognormvariate(math.log(median), sigma)
+
+
+class MockBehaviour:
+
+    def __init__(
+        self,
+        latency: str = "lognormal:0.8:0.5",
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        first_byte_share: float = 0.3,
+        seed: int = 0,
+    ) -> None:
+        """
+        The initializer of `MockBehaviour`.
+
+        :param latency: The specification of the `LatencyDistribution` of a request
+        :type latency: str
+        :param error_rate: The share of requests failing with a 500
+        :type error_rate: float
+        :param rate_limit_rate: The share of requests failing with a 429
+        :type rate_limit_rate: float
+        :param malformed_rate: The share of replies whose content is not valid JSON
+        :type malformed_rate: float
+        :param first_byte_share: The share of the latency before the first chunk of a streamed reply
+        :type first_byte_share: float
+        :param seed: The seed of the draws, so that a sweep fails the same way on every commit
+        :type seed: int
+        """
+        self.latency: LatencyDistribution = LatencyDistribution(latency)
+        self.error_rate: float = error_rate
+        self.rate_limit_rate: float = rate_limit_rate
+        self.malformed_rate: float = malformed_rate
+        self.first_byte_share: float = first_byte_share
+        self.generator: random.Random = random.Random(seed)
+        # the handlers draw from several threads
+        self.lock: threading.Lock = threading.Lock()
+
+    def draw(self) -> Tuple[float, str]:
+        """
+        The function `draw` decides the latency and the outcome of a request.
+        :return: the latency in seconds, and "ok", "error", "rate_limit" or "malformed".
+        """
+        with self.lock:
+            latency: float = self.latency.sample(self.generator)
+            roll: float = self.generator.random()
+
+        for outcome, rate in (
+            ("error", self.error_rate), ("rate_limit", self.rate_limit_rate), ("malformed", self.malformed_rate)
+        ):
+            if roll < rate:
+                return latency, outcome
+            roll -= rate
+
+        return latency, "ok"
+
+    def choice(self, options: List[Any]) -> Any:
+        with self.lock:
+            return self.generator.choice(options)
+
+    def percentage(self) -> int:
+        with self.lock:
+            return self.generator.randint(5, 95)
+
+
+def stage_of(body: Dict[str, Any]) -> str:
+    """
+    The function `stage_of` tells the stage of Thinker a request belongs to, from the name of its JSON
+    schema, or from its prompt when the request is not constrained by a schema.
+    """
+    response_format: Dict[str, Any] = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return response_format["json_schema"]["name"].lower()
+
+    if response_format.get("type") != "json_object":
+        return "text"
+
+    # the instruction comes first, the sections after it may quote the replies of other stages
+    instruction: str = body["messages"][-1]["content"].lstrip().split("\n")[0]
+    if "'scores'" in instruction:
+        return "simulation"
+    if "'scenarios'" in instruction:
+        return "prediction"
+    if "'move'" in instruction:
+        return "suggestion"
+
+    return "brief"
+
+
+def canned_content(stage: str, body: Dict[str, Any], behaviour: MockBehaviour) -> str:
+    prompt: str = body["messages"][-1]["content"]
+    match stage:
+        case "brief":
+            return json.dumps({"summary": "Someone is worn out and weighs how to get their energy back."})
+        case "prediction":
+            return json.dumps({"scenarios": [
+                {"scenario": scenario, "probability_in_percentage": behaviour.percentage()} for scenario in SCENARIOS
+            ]})
+        case "suggestion":
+            return json.dumps({
+                "move": behaviour.choice(MOVES),
+                "rationale": "It keeps the options open at little cost.",
+                "success_rate_in_percentage": behaviour.percentage(),
+            })
+        case "simulation":
+            ids: List[int] = [int(item_id) for item_id in re.findall(r'"id": (\d+)', prompt)]
+            return json.dumps({"scores": [
+                {"id": item_id, "recommendation_score": behaviour.percentage()} for item_id in ids
+            ]})
+        case _:
+            return "1. Set the goal.\n2. Take the first step.\n3. Review the outcome and adjust."
+
+
+class MockOpenAIServer:
+
+    def __init__(self, behaviour: MockBehaviour = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        The initializer of `MockOpenAIServer`. The server is started by `start`.
+
+        :param behaviour: The latency and the failures of the server, none by default
+        :type behaviour: MockBehaviour
+        :param host: The interface to listen on
+        :type host: str
+        :param port: The port to listen on, a free one if 0
+        :type port: int
+        """
+        self.behaviour: MockBehaviour = behaviour or MockBehaviour(latency="fixed:0")
+        self.counters: Dict[str, int] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self.__handler())
+        # the benchmark opens many connections at once
+        self.server.request_queue_size = 256
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def statistics(self, reset: bool = False) -> Dict[str, int]:
+        with self.lock:
+            counters: Dict[str, int] = dict(self.counters)
+            if reset:
+                self.counters = {}
+
+        return counters
+
+    def start(self) -> "MockOpenAIServer":
+        threading.Thread(target=self.server.serve_forever, name="mock-openai", daemon=True).start()
+        logging.info(f"Mock chat completions API served at {self.base_url}")
+
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __handler(self) -> type:
+        server: "MockOpenAIServer" = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            # keep-alive, as the pooled client expects
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug(format % args)
+
+            def __send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None) -> None:
+                body: bytes = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self) -> None:
+                try:
+                    self.__respond()
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up on the request, e.g. a run that was cancelled or timed out
+                    server.count("disconnects")
+                    self.close_connection = True
+
+            def __respond(self) -> None:
+                body: Dict[str, Any] = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if not self.path.endswith("/chat/completions"):
+                    self.__send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+
+                stage: str = stage_of(body)
+                latency, outcome = server.behaviour.draw()
+                server.count("requests")
+                server.count(f"requests_{stage}")
+                server.count(f"outcome_{outcome}")
+
+                if outcome == "error":
+                    time.sleep(latency)
+                    self.__send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                    return
+                if outcome == "rate_limit":
+                    # rate limited requests are turned away right away
+                    self.__send_json(
+                        429,
+                        {"error": {"message": "Injected rate limit", "type": "rate_limit_exceeded"}},
+                        headers={"Retry-After": "0"}
+                    )
+                    return
+
+                choices: List[str] = [
+                    canned_content(stage, body, server.behaviour) for _ in range(body.get("n") or 1)
+                ]
+                if outcome == "malformed":
+                    choices = [content[:len(content) // 2] for content in choices]
+
+                prompt_tokens: int = len(json.dumps(body["messages"])) // 4
+                completion_tokens: int = sum(len(content) // 4 + 1 for content in choices)
+                usage: Dict[str, Any] = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                }
+
+                if body.get("stream"):
+                    self.__stream(body, choices[0], usage, latency)
+                    return
+
+                time.sleep(latency)
+                self.__send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "system_fingerprint": "mock",
+                    "choices": [
+                        {
+                            "index": index,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                        for index, content in enumerate(choices)
+                    ],
+                    "usage": usage,
+                })
+
+            def __stream(self, body: Dict[str, Any], content: str, usage: Dict[str, Any], latency: float) -> None:
+                pieces: List[str] = [content[index:index + 16] for index in range(0, len(content), 16)] or [""]
+                first_byte: float = latency * server.behaviour.first_byte_share
+
+                time.sleep(first_byte)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                def chunk(payload: Dict[str, Any]) -> None:
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                common: Dict[str, Any] = {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                }
+                for index, piece in enumerate(pieces):
+                    if index:
+                        time.sleep((latency - first_byte) / len(pieces))
+                    chunk({**common, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                chunk({**common, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                chunk({**common, "choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a mock chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="lognormal:0.8:0.5", help="fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with a 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of replies that are not valid JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server: MockOpenAIServer = MockOpenAIServer(
+        behaviour=MockBehaviour(
+            latency=arguments.latency,
+            error_rate=arguments.error_rate,
+            rate_limit_rate=arguments.rate_limit_rate,
+            malformed_rate=arguments.malformed_rate,
+            seed=arguments.seed
+        ),
+        host=arguments.host,
+        port=arguments.port
+    )
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.statistics(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
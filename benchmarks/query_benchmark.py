@@ -0,0 +1,248 @@
+"""
+The script benchmarks `Thinker.query_process` against the local `MockOpenAIServer`, so that the
+performance of commits can be compared without a live API. It sweeps the tree shape and the number of
+users running queries at the same time, and reports for every combination the throughput, the
+p50/p95/p99 latency of a run, the LLM calls and the requests the server received, and the peak RSS of
+the process. The results are appended to a JSONL file, one line per combination, labelled with the
+commit they were measured on.
+
+Usage:
+    python benchmarks/query_benchmark.py [--base-tree-size 2,5] [--branch-size-factor 2,5] [--users 1,8]
+                                         [--runs-per-user 2] [--latency lognormal:0.3:0.5]
+                                         [--error-rate 0.01] [--rate-limit-rate 0.02] [--malformed-rate 0.02]
+                                         [--output benchmarks/results.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_server import MockBehaviour, MockOpenAIServer
+
+SITUATIONS: List[List[str]] = [
+    ["I am feeling tired", "I want to rest but the deadline is close"],
+    ["My team missed the release date", "I am not sure whether to cut scope or move the date"],
+    ["A recruiter offered me a job abroad", "The pay is better but my family is here"],
+    ["My landlord is raising the rent", "I could move, or negotiate, or take on a flatmate"],
+]
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+
+    ordered: List[float] = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(share * len(ordered)) - 1))]
+
+
+def current_rss_mb() -> Optional[float]:
+    # the resident set size of the process, only available from procfs
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+class RSSSampler:
+
+    def __init__(self, interval: float = 0.05) -> None:
+        """
+        The `RSSSampler` class samples the resident set size of the process on a thread, so that the
+        peak of each combination is known, whereas `ru_maxrss` only tells the peak of the process.
+        """
+        self.interval: float = interval
+        self.peak_mb: Optional[float] = current_rss_mb()
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.__run, name="rss-sampler", daemon=True)
+
+    def __run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            rss: Optional[float] = current_rss_mb()
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or 0.0, rss)
+
+    def __enter__(self) -> "RSSSampler":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_once(index: int, base_tree_size: int, branch_size_factor: int) -> Dict[str, Any]:
+    """
+    The function `run_once` runs one query end to end with the given tree shape.
+    :return: the latency of the run, whether it failed, and the totals of its run summary.
+    """
+    from commons.ThinkerInterface import Thinker
+
+    situation, thoughts = SITUATIONS[index % len(SITUATIONS)]
+    started_at: float = time.perf_counter()
+    thinker: Thinker = Thinker(situation=situation, thoughts=thoughts)
+    thinker.query.base_tree_size = base_tree_size
+    thinker.query.branch_size_factor = branch_size_factor
+
+    error: Optional[str] = None
+    try:
+        async for _ in thinker.query_process():
+            pass
+    except Exception as e:
+        error = repr(e)
+        logging.error(f"Run {index} failed: {error}")
+
+    return {
+        "seconds": time.perf_counter() - started_at,
+        "error": error,
+        "total": thinker.run_summary["total"] if thinker.run_summary else {},
+    }
+
+
+async def run_combination(base_tree_size: int, branch_size_factor: int, users: int, runs_per_user: int) -> List[Dict[str, Any]]:
+    async def user(user_index: int) -> List[Dict[str, Any]]:
+        # the runs of a user are sequential, as they would be in the UI
+        return [
+            await run_once(user_index * runs_per_user + run, base_tree_size, branch_size_factor)
+            for run in range(runs_per_user)
+        ]
+
+    results: List[List[Dict[str, Any]]] = await asyncio.gather(*[user(index) for index in range(users)])
+
+    return [run for runs in results for run in runs]
+
+
+def measure(
+    server: MockOpenAIServer,
+    base_tree_size: int,
+    branch_size_factor: int,
+    users: int,
+    runs_per_user: int,
+) -> Dict[str, Any]:
+    server.statistics(reset=True)
+    with RSSSampler() as sampler:
+        started_at: float = time.perf_counter()
+        runs: List[Dict[str, Any]] = asyncio.run(
+            run_combination(base_tree_size, branch_size_factor, users, runs_per_user)
+        )
+        elapsed: float = time.perf_counter() - started_at
+
+    latencies: List[float] = [run["seconds"] for run in runs if run["error"] is None]
+    totals: List[Dict[str, Any]] = [run["total"] for run in runs if run["total"]]
+
+    return {
+        "base_tree_size": base_tree_size,
+        "branch_size_factor": branch_size_factor,
+        "users": users,
+        "runs": len(runs),
+        "failures": sum(1 for run in runs if run["error"] is not None),
+        "seconds": elapsed,
+        "throughput_runs_per_second": len(latencies) / elapsed if elapsed else None,
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None,
+        },
+        "llm_calls": sum(total.get("llm_calls", 0) for total in totals),
+        "retries": sum(total.get("retries", 0) for total in totals),
+        "parse_failures": sum(total.get("parse_failures", 0) for total in totals),
+        "tokens": sum(total.get("prompt_tokens", 0) + total.get("completion_tokens", 0) for total in totals),
+        "server": server.statistics(),
+        "peak_rss_mb": sampler.peak_mb,
+    }
+
+
+def integers(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Thinker against a mock chat completions API")
+    parser.add_argument("--base-tree-size", type=integers, default=[2, 5], help="Comma-separated values")
+    parser.add_argument("--branch-size-factor", type=integers, default=[2, 5], help="Comma-separated values")
+    parser.add_argument("--users", type=integers, default=[1, 8], help="Concurrent users, comma-separated")
+    parser.add_argument("--runs-per-user", type=int, default=2)
+    parser.add_argument("--latency", default="lognormal:0.3:0.5", help="fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results.jsonl"))
+    parser.add_argument("--label", default=None, help="The label of the results, the commit by default")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    server: MockOpenAIServer = MockOpenAIServer(
+        behaviour=MockBehaviour(
+            latency=arguments.latency,
+            error_rate=arguments.error_rate,
+            rate_limit_rate=arguments.rate_limit_rate,
+            malformed_rate=arguments.malformed_rate,
+            seed=arguments.seed
+        )
+    ).start()
+
+    # set before the settings are first read, the memories of the benchmark go to a throwaway database
+    os.environ.update({
+        "OPENAI_BASE_URL": server.base_url,
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_MODEL": "mock",
+        "CACHE_ENABLED": "false",
+        "MEMORY_PATH": tempfile.mkdtemp(prefix="thinker-benchmark-"),
+    })
+    os.chdir(ROOT)
+
+    label: Optional[str] = arguments.label or commit()
+    print(f"{'tree':>6} {'users':>5} {'runs/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'requests':>8} {'rss MB':>7}")
+    with open(arguments.output, "a", encoding="utf-8") as output:
+        for base_tree_size in arguments.base_tree_size:
+            for branch_size_factor in arguments.branch_size_factor:
+                for users in arguments.users:
+                    result: Dict[str, Any] = {
+                        "label": label,
+                        "latency": arguments.latency,
+                        "error_rate": arguments.error_rate,
+                        "rate_limit_rate": arguments.rate_limit_rate,
+                        "malformed_rate": arguments.malformed_rate,
+                        **measure(server, base_tree_size, branch_size_factor, users, arguments.runs_per_user),
+                    }
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+
+                    latency: Dict[str, Optional[float]] = result["latency_seconds"]
+                    print(
+                        f"{base_tree_size}x{branch_size_factor:<4} {users:>5} "
+                        f"{result['throughput_runs_per_second'] or 0:>7.2f} "
+                        f"{latency['p50'] or 0:>7.2f} {latency['p95'] or 0:>7.2f} {latency['p99'] or 0:>7.2f} "
+                        f"{result['server'].get('requests', 0):>8} {result['peak_rss_mb'] or 0:>7.1f}"
+                    )
+
+    server.stop()
+    print(f"Peak RSS of the process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    print(f"Results appended to {arguments.output}")
+
+
+if __name__ == "__main__":
+    main()
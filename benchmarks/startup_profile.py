@@ -0,0 +1,87 @@
+"""
+The script profiles the cold start of Thinker with `python -X importtime`. It reports how long
+importing the entry modules takes, the slowest modules they pull in, and what the same imports cost
+when the heavy dependencies are loaded eagerly, i.e. what the lazy imports save. With `--warm-up`, it
+also times the warm-up hook of `app.py`.
+
+Usage:
+    python benchmarks/startup_profile.py [--module commons.ThinkerInterface] [--top 15] [--warm-up]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES: List[str] = ["openai", "chromadb", "numpy", "httpx"]
+# statements timing what runs between them in a subprocess
+TIMER: str = "import time; started_at = time.perf_counter()"
+ELAPSED: str = "print(time.perf_counter() - started_at)"
+ENVIRONMENT: Dict[str, str] = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "profile")}
+
+
+def run(statement: str, *options: str) -> subprocess.CompletedProcess:
+    """
+    The function `run` runs `statement` in a fresh interpreter from the root of the repository.
+    :return: the completed process, with its output as text.
+    """
+    completed = subprocess.run(
+        [sys.executable, *options, "-c", statement], cwd=ROOT, capture_output=True, text=True, env=ENVIRONMENT
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    return completed
+
+
+def import_times(statement: str) -> Dict[str, int]:
+    """
+    The function `import_times` runs `statement` in a fresh interpreter with `-X importtime`.
+    :return: module name -> cumulative import time in microseconds.
+    """
+    times: Dict[str, int] = {}
+    # the report goes to stderr
+    for line in run(statement, "-X", "importtime").stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+
+    return times
+
+
+def top_level(times: Dict[str, int], top: int) -> List[Tuple[str, int]]:
+    # the packages rather than their submodules, whose times are included in the package
+    packages: Dict[str, int] = {}
+    for module, microseconds in times.items():
+        package: str = module.split(".")[0] if not module.startswith("commons") else module
+        packages[package] = max(packages.get(package, 0), microseconds)
+
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profile the cold start of Thinker")
+    parser.add_argument("--module", default="commons.ThinkerInterface", help="The entry module to import")
+    parser.add_argument("--top", type=int, default=15, help="The number of slowest modules listed")
+    parser.add_argument("--warm-up", action="store_true", help="Time the warm-up hook of app.py as well")
+    arguments = parser.parse_args()
+
+    lazy: Dict[str, int] = import_times(f"import {arguments.module}")
+    print(f"import {arguments.module}: {lazy[arguments.module] / 1e6:.3f}s")
+    for module, microseconds in top_level(lazy, arguments.top):
+        print(f"  {microseconds / 1e6:8.3f}s  {module}")
+
+    # touching an attribute forces the lazily bound modules to load, as an eager import would
+    forced: str = "; ".join(f"import {module}; {module}.__name__" for module in HEAVY_MODULES)
+    deferred: float = float(run(f"import {arguments.module}; {TIMER}; {forced}; {ELAPSED}").stdout.split()[-1])
+    print(f"deferred to first use: {deferred:.3f}s ({', '.join(HEAVY_MODULES)})")
+
+    if arguments.warm_up:
+        output: List[str] = run(f"import app; {TIMER}; print(app.warm_up()); {ELAPSED}").stdout.splitlines()
+        print(f"warm-up: {float(output[-1]):.3f}s {output[-2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 from typing_extensions import AsyncGenerator, Literal
 from .components.MemoryComponents import MemoryComponent
 from .components.QueryComponents import QueryComponent
+from .components.SearchComponents import TreeSearchComponent
 from .components.ThinkComponents import StrategyComponent
-from .components.mechanics.Loaders import ConfigLoader
+from .components.mechanics.Loaders import ConfigLoader, PromptRegistry
+from .components.mechanics.Tracing import RunTracer
 
 # The `Thinker` class is a component that processes queries, retrieves suggestions, and elaborates on
 # selected suggestions using a strategy component.
@@ -11,74 +13,172 @@ class Thinker:
     def __init__(
         self, 
         situation: str, 
-        thoughts: str
+        thoughts: str,
+        deadline_seconds: float = None,
+        max_tokens: int = None
     ) -> None:
+        """
+        The initializer of `Thinker`. With a deadline or a token ceiling, the run is in budget mode:
+        the tree is narrowed to what the budget affords, and branches stop being grown once it is
+        nearly spent.
+        
+        :param deadline_seconds: The seconds the run may take, the `budget` of the config if not given
+        :type deadline_seconds: float
+        :param max_tokens: The tokens the run may consume, the `budget` of the config if not given
+        :type max_tokens: int
+        """
         
         # retrieve configs
         self.config: dict = ConfigLoader().configurations()
+        PromptRegistry.watch = self.config.get('reload_prompts', False)
         
         # extract relevant memories from the database
         self.memory: MemoryComponent = MemoryComponent(situation=situation, thoughts=thoughts)
         
+        # the budget of the search bounds the whole run, the tighter of it and of the run budget holds
+        search: dict = self.config.get('search', {})
+        budget: dict = search if search.get('enabled', False) else {}
+        run_budget: dict = self.config.get('budget', {})
+        self.deadline_seconds: float = deadline_seconds or run_budget.get('deadline_seconds')
+        max_tokens = min(
+            [limit for limit in (max_tokens or run_budget.get('max_tokens'), budget.get('max_tokens')) if limit],
+            default=None
+        )
+        
         # initialize `QueryComponent` with the config
         self.query: QueryComponent = QueryComponent(
             memory=self.memory, 
             base_tree_size=self.config['base_tree_size'],
             branch_size_factor=self.config['branch_size_factor'],
             top_n_advices=self.config['top_n_advices'],
-            inference_model=self.config['inference_model']
+            inference_model=self.config['inference_model'],
+            multi_sample=self.config.get('multi_sample', False),
+            hedging=self.config.get('hedging'),
+            simulation_batch_tokens=self.config.get('simulation_batch_tokens', 2000),
+            max_requests=budget.get('max_requests'),
+            max_tokens=max_tokens,
+            budget_reserve=run_budget.get('reserve', 0.1)
         )
         
+        # the beam search deepens the tree when the configured depth is beyond one level
+        self.search: TreeSearchComponent = None
+        if search.get('enabled', False):
+            self.search = TreeSearchComponent(
+                query=self.query,
+                depth=search.get('depth', 1),
+                beam_width=search.get('beam_width', 3),
+                predictions_per_node=search.get('predictions_per_node', 2),
+                suggestions_per_prediction=search.get('suggestions_per_prediction', 2)
+            )
+        
         # initialize `StrategyComponent`
         self.strategizer: StrategyComponent = StrategyComponent()
+        
+        # the spans of the stages and of the LLM calls of the run, every core reports to the same tracer
+        self.tracer: RunTracer = RunTracer()
+        for core in (self.query.text_generator, self.strategizer.text_generation_core):
+            core.tracer = self.tracer
+        self.run_summary: dict = None
     
     async def query_process(self) -> AsyncGenerator[str, None]:
         """
         The `query_process` function saves the current situation into memory, performs a series of queries,
-        and retrieves the suggestions from the `QueryComponent`.
+        and retrieves the suggestions from the `QueryComponent`. Each stage is traced, and the last step
+        carries the `run_summary` of the run.
         """
         
-        # save the current situation into the memory
-        yield "💾 Saving memory...", None
-        await self.memory.store_memory()
+        # the deadline of the run bounds every LLM call and retry of the query
+        self.query.text_generator.start_run(self.deadline_seconds)
+        self.tracer.start()
         
-        # query
-        yield "📝 Generating brief...", None
-        await self.query.brief()
-        yield "✅ Brief generated.", self.query.the_brief
+        try:
+            # save the current situation into the memory
+            with self.tracer.stage("memory"):
+                yield "💾 Saving memory...", None
+                await self.memory.store_memory()
+            
+            # query
+            with self.tracer.stage("brief"):
+                yield "📝 Generating brief...", None
+                async for partial_brief in self.query.brief_stream():
+                    # partial outputs are strings, the consumer shows them while they are streaming
+                    yield "📝 Generating brief...", partial_brief
+            yield "✅ Brief generated.", self.query.the_brief
 
-        yield "🔮 Generating predictions...", None
-        await self.query.predict()
-        yield f"✅ Generated {len(self.query.the_predictions)} predictions.", self.query.the_predictions
+            if self.config.get('pipelined_query', False):
+                # each branch gets its suggestions as soon as its prediction lands
+                with self.tracer.stage("expansion"):
+                    yield "🔮 Generating predictions and suggestions...", None
+                    async for step, data in self.query.expand():
+                        yield step, data
+                yield f"✅ Generated {len(self.query.the_predictions)} predictions.", self.query.the_predictions
+                yield f"✅ Generated {len(self.query.the_suggestions)} raw suggestions.", self.query.the_suggestions
+            
+            else:
+                with self.tracer.stage("prediction"):
+                    yield "🔮 Generating predictions...", None
+                    await self.query.predict()
+                yield f"✅ Generated {len(self.query.the_predictions)} predictions.", self.query.the_predictions
 
-        yield "💡 Generating suggestions...", None
-        await self.query.suggest()
-        yield f"✅ Generated {len(self.query.the_suggestions)} raw suggestions.", self.query.the_suggestions
+                with self.tracer.stage("suggestion"):
+                    yield "💡 Generating suggestions...", None
+                    await self.query.suggest()
+                yield f"✅ Generated {len(self.query.the_suggestions)} raw suggestions.", self.query.the_suggestions
 
-        yield "⚖️ Evaluating suggestions...", None
-        _, self.tree_structure = await self.query.evaluate()
-        
-        # retrieve the final outputs of the `QueryComponent`
-        self.the_suggestions: list = self.query.the_suggestions
-        yield f"✅ Evaluation complete. Top {len(self.the_suggestions)} suggestions selected.", self.the_suggestions
+            if self.config.get('hedging', {}).get('enabled', False):
+                yield f"🛡️ Hedged requests: {self.query.hedge_statistics()}", None
+
+            if self.search is not None:
+                with self.tracer.stage("search"):
+                    yield f"🧭 Searching {self.search.depth} levels deep...", None
+                    async for step, data in self.search.search():
+                        yield step, data
+
+            with self.tracer.stage("evaluation"):
+                yield "⚖️ Evaluating suggestions...", None
+                _, self.tree_structure = await self.query.evaluate()
+            
+            # retrieve the final outputs of the `QueryComponent`
+            self.the_suggestions: list = self.query.the_suggestions
+            yield f"✅ Evaluation complete. Top {len(self.the_suggestions)} suggestions selected.", self.the_suggestions
+
+            if self.query.budget.limited():
+                report: dict = self.query.budget.report()
+                yield (
+                    f"💰 {report['shape']['base_tree_size']}x{report['shape']['branch_size_factor']} tree, "
+                    f"{report['trimmed_branches']} branches trimmed, {report['requests']} requests, "
+                    f"{report['tokens']} tokens spent."
+                ), report
+
+        except BaseException as e:
+            self.run_summary = self.tracer.finish(error=e)
+            raise
+
+        self.run_summary = self.tracer.finish()
+        total: dict = self.run_summary["total"]
+        yield (
+            f"📊 {self.run_summary['seconds']:.1f}s, {total['llm_calls']} LLM calls, {total['retries']} retries, "
+            f"{total['prompt_tokens'] + total['completion_tokens']} tokens."
+        ), self.run_summary
     
-    async def think_process(self, selected_suggestion: int) -> str:
+    async def think_process(self, selected_suggestion: int) -> AsyncGenerator[str, None]:
         """
         The `think_process` function takes a selected suggestion, elaborates on it using the `strategizer`,
-        and returns the suggestion steps.
+        and streams the suggestion steps.
         
         :param selected_suggestion: An integer representing the index of the selected suggestion from a list
         of suggestions
         :type selected_suggestion: int
-        :return: The function `think_process` returns a string, which is the value of the variable
-        `suggestion_steps`.
+        :return: The function `think_process` yields the suggestion steps generated so far, the last
+        value is the complete elaboration.
         """
         
         selection: str = self.the_suggestions[selected_suggestion]
-        suggestion_steps: str = await self.strategizer.elaborate(
-            suggestion=selection, 
-            query=self.query, 
-            memory=self.memory
-        )
-        
-        return suggestion_steps
\ No newline at end of file
+        # the calls of the elaboration feed the metrics, the summary of the run is already written
+        with self.tracer.stage("elaboration"):
+            async for suggestion_steps in self.strategizer.elaborate_stream(
+                suggestion=selection, 
+                query=self.query, 
+                memory=self.memory
+            ):
+                yield suggestion_steps
\ No newline at end of file
@@ -4,31 +4,72 @@ provides a method to get a JSON response from the OpenAI language model. The mai
 demonstrates the usage of the class by generating responses to multiple prompts.
 """
 
+from __future__ import annotations
+
+import asyncio
+import json
 import logging
 import random
-from typing import List, Dict
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, List, Dict, Tuple, Type
 
-import openai
-from openai import AsyncOpenAI
-from openai.types.chat import ChatCompletion
+from pydantic import BaseModel
 
+from commons.components.api.settings.cache_settings import CacheSettings
 from commons.components.api.settings.common_settings import CommonSettings
 from commons.components.api.settings.openai_settings import OpenAISettings
+from commons.components.api.settings.retry_settings import RetrySettings
+from commons.components.api.settings.scheduler_settings import SchedulerSettings
+from commons.components.mechanics.Caches import ResponseCache
+from commons.components.mechanics.Imports import lazy_import
+from commons.components.mechanics.ClientPools import ClientRegistry
+from commons.components.mechanics.Retries import InvalidResponseError, RetryExhaustedError, RetryPolicy
+from commons.components.mechanics.Schemas import response_format as schema_response_format
+from commons.components.mechanics.Schedulers import RequestScheduler, SchedulerPermit
+from commons.components.mechanics.Tracing import RunTracer, Span
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+# the client library is heavy to import, it is loaded when the first core is created
+openai = lazy_import("openai")
 
 
 class TextGenerationCore:
 
+    # the scheduler is shared by every core in the process, so that the concurrency cap and
+    # the rate limits hold across all the `Thinker` instances
+    scheduler: RequestScheduler = None
+    scheduler_settings: SchedulerSettings = None
+    # the opt-in response cache, also shared by the whole process
+    cache: ResponseCache = None
+    cache_settings: CacheSettings = None
+    # the retry engine of every LLM call
+    retry_policy: RetryPolicy = None
+    retry_settings: RetrySettings = None
+    # (base_url, model) -> whether the backend honours `n`, learnt from the first multi-sample call
+    n_support: Dict[Tuple[str, str], bool] = {}
+    # (base_url, model) -> whether the backend accepts `json_schema` response formats
+    json_schema_support: Dict[Tuple[str, str], bool] = {}
+
     def __init__(self, api_type: str = None, model: str = None) -> None:
         if api_type:
             self.api_type = api_type
         else:
             self.api_type = CommonSettings().type
         self.overall_token_consumption: int = 0
+        # requests sent to the API, retries included and cache hits excluded
+        self.overall_requests: int = 0
+        # prompt tokens served from the prompt cache of the provider
+        self.overall_cached_tokens: int = 0
+        # the usage of the last streamed response, reported by the final chunk
+        self.last_stream_usage = None
         # initialize the variables
         match self.api_type:
             case 'openai':
                 try:
                     settings = OpenAISettings()
+                    self.settings: OpenAISettings = settings
 
                     if settings.api_key is None:
                         raise ValueError("OpenAI API key is required")
@@ -52,12 +93,137 @@ class TextGenerationCore:
             case 'google':
                 ...
 
-    def __initialize_OpenAI(self) -> AsyncOpenAI:
+        self.scheduler: RequestScheduler = self.shared_scheduler()
+        self.cache: ResponseCache = self.shared_cache()
+        self.retry_policy: RetryPolicy = self.shared_retry_policy()
+        # the `time.monotonic()` after which no LLM call of the current run is started
+        self.run_deadline: float = None
+        # the spans of the LLM calls, `Thinker` hands its own tracer in so that they join its run
+        self.tracer: RunTracer = RunTracer()
+
+    @classmethod
+    def shared_scheduler(cls) -> RequestScheduler:
+        """
+        The function `shared_scheduler` returns the process-wide `RequestScheduler`, creating it
+        from the `SchedulerSettings` on first use.
+        :return: a `RequestScheduler` object.
+        """
+        if TextGenerationCore.scheduler is None:
+            settings = SchedulerSettings()
+            TextGenerationCore.scheduler_settings = settings
+            TextGenerationCore.scheduler = RequestScheduler(
+                max_concurrency=settings.max_concurrency,
+                min_concurrency=settings.min_concurrency,
+                requests_per_minute=settings.requests_per_minute,
+                tokens_per_minute=settings.tokens_per_minute,
+                increase_step=settings.increase_step,
+                decrease_factor=settings.decrease_factor,
+                congestion_errors=(openai.RateLimitError, openai.APITimeoutError, TimeoutError)
+            )
+
+        return TextGenerationCore.scheduler
+
+    @classmethod
+    def shared_retry_policy(cls) -> RetryPolicy:
+        """
+        The function `shared_retry_policy` returns the process-wide `RetryPolicy`, creating it from
+        the `RetrySettings` on first use.
+        :return: a `RetryPolicy` object.
+        """
+        if TextGenerationCore.retry_policy is None:
+            settings = RetrySettings()
+            TextGenerationCore.retry_settings = settings
+            TextGenerationCore.retry_policy = RetryPolicy(
+                max_attempts=settings.max_attempts,
+                base_delay=settings.base_delay,
+                max_delay=settings.max_delay,
+                call_timeout=settings.call_timeout,
+                retryable_errors=(
+                    openai.RateLimitError,
+                    openai.APIConnectionError,
+                    openai.InternalServerError
+                )
+            )
+
+        return TextGenerationCore.retry_policy
+
+    def start_run(self, deadline_seconds: float = None) -> None:
+        """
+        The function `start_run` starts the deadline of a run: no LLM call or retry of this core is
+        started once it has passed.
+
+        :param deadline_seconds: The seconds the run may take, `RETRY_RUN_DEADLINE` if not given and
+        no deadline if neither is set
+        :type deadline_seconds: float
+        """
+        if deadline_seconds is None:
+            deadline_seconds = TextGenerationCore.retry_settings.run_deadline
+
+        self.run_deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+
+    @classmethod
+    def shared_cache(cls) -> ResponseCache:
+        """
+        The function `shared_cache` returns the process-wide `ResponseCache`, or `None` if the cache
+        is not enabled in the `CacheSettings`.
+        :return: a `ResponseCache` object or `None`.
+        """
+        if TextGenerationCore.cache_settings is None:
+            settings = CacheSettings()
+            TextGenerationCore.cache_settings = settings
+            if settings.enabled:
+                TextGenerationCore.cache = ResponseCache(
+                    path=settings.path,
+                    ttl_seconds=settings.ttl_seconds,
+                    max_memory_entries=settings.max_memory_entries,
+                    max_disk_entries=settings.max_disk_entries
+                )
+                logging.info(f"Response cache enabled at {settings.path}")
+
+        return TextGenerationCore.cache
+
+    def __cache_key(
+            self,
+            message: list,
+            response_format: dict,
+            seed: int,
+            use_cache: bool,
+            cache_variant: int,
+            **sampling
+    ) -> str:
+        # `seed` is the one requested by the caller, not the randomized one, so that repeated runs
+        # hit the cache. `cache_variant` tells intentionally diverse samples of a prompt apart.
+        if self.cache is None or not use_cache:
+            return None
+
+        return ResponseCache.make_key(
+            model=self.model,
+            messages=message,
+            response_format=response_format,
+            seed=seed,
+            sampling=sampling,
+            variant=cache_variant
+        )
+
+    @staticmethod
+    def __cached_tokens(usage) -> int:
+        # not every backend reports the details of the prompt tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+    def __estimate_tokens(self, message: list, n: int = 1) -> int:
+        # a rough estimate of 4 characters per token, the scheduler corrects it with the real usage
+        prompt_tokens: int = len(json.dumps(message, ensure_ascii=False)) // 4
+        return prompt_tokens + n * TextGenerationCore.scheduler_settings.expected_completion_tokens
+
+    def __initialize_OpenAI(self) -> openai.AsyncOpenAI:
         """
         initialize an OpenAI instance.
+        The client is taken from the process-wide `ClientRegistry`, so the connections are reused.
         """
         if self.api_type == 'openai':
-            self.client: AsyncOpenAI = AsyncOpenAI(
+            self.client: openai.AsyncOpenAI = ClientRegistry.get_openai_client(
+                settings=self.settings,
                 api_key=self.api_key,
                 base_url=self.base_url
             )
@@ -68,14 +234,18 @@ class TextGenerationCore:
             self,
             message: list,
             response_format: dict = None,
-            seed: int = None
+            seed: int = None,
+            cache_key: str = None,
+            n: int = 1,
+            validator: Callable[[str], Any] = None
     ) -> ChatCompletion:
 
         """
         The function `__response` is an asynchronous function that takes in a list of messages, a
         response format dictionary, and a seed integer as parameters. It uses the OpenAI API to create a
-        chat completion based on the given parameters and returns the response. If there is a timeout
-        error, it logs the error message.
+        chat completion based on the given parameters and returns the response. Failed attempts are
+        retried by the shared `RetryPolicy`, which raises `RetryExhaustedError` once it gives up. The
+        call is recorded as a span of `tracer`.
         
         :param message: The `message` parameter is a list of message objects that represent the
         conversation between the user and the AI model. Each message object has two properties: `role`
@@ -91,46 +261,137 @@ class TextGenerationCore:
         model generates the same response for the same input message. This can be useful for debugging
         or reproducibility purposes. If no
         :type seed: int
+        :param cache_key: The key of the request in the response cache, `None` bypasses the cache
+        :type cache_key: str
+        :param n: The number of choices to generate for the message
+        :type n: int
+        :param validator: A function raising `InvalidResponseError` on the content of a choice that
+        cannot be used. A single reply that fails it is retried by the `RetryPolicy` like any other
+        failed attempt. Only responses whose choices all pass are cached, and cached ones that fail are
+        dropped.
+        :type validator: Callable[[str], Any]
         :return: a ChatCompletion object.
         """
 
-        try:
-            response: ChatCompletion = await self.client.chat.completions.create(
-                model=self.model,
-                messages=message,
-                response_format=response_format,
-                seed=seed
-            )
-
-            remote_system_fingerprint: str = response.system_fingerprint
-            logging.info(f"Current remote system fingerprint is {remote_system_fingerprint}")
-
-            completion_tokens: int = response.usage.completion_tokens
-            prompt_tokens: int = response.usage.prompt_tokens
-            total_tokens: int = response.usage.total_tokens
-            logging.info(
-                f"Completion tokens: {completion_tokens}"
-                f"\nPrompt tokens: {prompt_tokens}"
-                f"\nTotal tokens: {total_tokens}"
-            )
+        with self.tracer.call("chat completion", n=n, streamed=False) as span:
+            return await self.__traced_response(message, response_format, seed, cache_key, n, validator, span)
 
-            # update the `self.overall_token_consumption`
-            self.overall_token_consumption += total_tokens
-            logging.info(f"Overall token consumption by far: {self.overall_token_consumption}")
-
-        except openai.APITimeoutError as e:
-            logging.error(f"Timeout error: {e}")
+    async def __traced_response(
+            self,
+            message: list,
+            response_format: dict,
+            seed: int,
+            cache_key: str,
+            n: int,
+            validator: Callable[[str], Any],
+            span: Span
+    ) -> ChatCompletion:
+        if cache_key:
+            cached: str = self.cache.get(cache_key)
+            if cached is not None:
+                response: ChatCompletion = openai.types.chat.ChatCompletion.model_validate_json(cached)
+                if self.__valid(self.__contents(response), validator):
+                    logging.info(f"Response served from the cache: {self.cache.statistics()}")
+                    span.set(cache_hit=True)
+                    return response
+                # an unusable response would be served until it expires, it is requested again instead
+                logging.warning("The cached response is unusable, it is dropped from the cache")
+                self.cache.delete(cache_key)
+
+        async def attempt(timeout: float) -> Tuple[ChatCompletion, bool]:
+            async with self.scheduler.slot(estimated_tokens=self.__estimate_tokens(message, n=n)) as permit:
+                logging.debug(f"Request waited {permit.queue_wait:.2f}s in the scheduler")
+                self.overall_requests += 1
+                span.add("attempts")
+                span.add("queue_wait", permit.queue_wait)
+                async with asyncio.timeout(timeout):
+                    # `n` is only sent when several choices are wanted, not every backend accepts it
+                    response: ChatCompletion = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=message,
+                        response_format=response_format,
+                        seed=seed,
+                        **({"n": n} if n > 1 else {})
+                    )
+                if response.usage:
+                    permit.record_usage(response.usage.total_tokens)
+
+            # an unusable response is billed all the same
+            self.__account(response, span)
+
+            # each reply goes through the validator once. A single reply that fails it is worth nothing,
+            # so it is requested again within the same policy, whereas the usable choices of a
+            # multi-choice response are kept
+            valid: bool = self.__valid(self.__contents(response), validator)
+            if n == 1 and not valid:
+                raise InvalidResponseError("The response did not pass the validation")
+
+            return response, valid
+
+        response, valid = await self.retry_policy.run(
+            attempt, deadline=self.run_deadline, description="Chat completion"
+        )
 
-        except TimeoutError as e:
-            logging.error(f"Timeout error: {e}")
+        if cache_key and valid:
+            self.cache.put(cache_key, response.model_dump_json())
 
-        except openai.APIConnectionError as e:
-            logging.error(f"Connection error: {e}")
+        return response
 
-        else:
-            return response
+    def __account(self, response: ChatCompletion, span: Span) -> None:
+        remote_system_fingerprint: str = response.system_fingerprint
+        logging.info(f"Current remote system fingerprint is {remote_system_fingerprint}")
+
+        if not response.usage:
+            return
+
+        completion_tokens: int = response.usage.completion_tokens
+        prompt_tokens: int = response.usage.prompt_tokens
+        total_tokens: int = response.usage.total_tokens
+        cached_tokens: int = self.__cached_tokens(response.usage)
+        logging.info(
+            f"Completion tokens: {completion_tokens}"
+            f"\nPrompt tokens: {prompt_tokens}"
+            f"\nCached prompt tokens: {cached_tokens}"
+            f"\nTotal tokens: {total_tokens}"
+        )
+        self.overall_cached_tokens += cached_tokens
+        # the tokens of every attempt of the call add up
+        span.add("prompt_tokens", prompt_tokens)
+        span.add("completion_tokens", completion_tokens)
+        span.add("cached_tokens", cached_tokens)
+
+        # update the `self.overall_token_consumption`
+        self.overall_token_consumption += total_tokens
+        logging.info(f"Overall token consumption by far: {self.overall_token_consumption}")
+
+    @staticmethod
+    def __contents(response: ChatCompletion) -> List[str]:
+        return [choice.message.content for choice in response.choices]
+
+    @staticmethod
+    def __valid(contents: List[str], validator: Callable[[str], Any]) -> bool:
+        # every content is checked, the validator may count each unusable one. The caller still gets a
+        # response with unusable choices, e.g. to keep the usable ones
+        if validator is None:
+            return True
+        valid: bool = True
+        for content in contents:
+            try:
+                validator(content)
+            except InvalidResponseError:
+                valid = False
+
+        return valid
+
+    async def get_chat_response_OpenAI(
+            self,
+            message: str,
+            seed: int = None,
+            use_cache: bool = True,
+            cache_variant: int = None
+    ) -> ChatCompletion:
 
-    async def get_chat_response_OpenAI(self, message: str, seed: int = None) -> ChatCompletion:
+        requested_seed: int = seed
 
         # we randomize the seed here instead of in the parameter input
         # to prevent the case, in which concurrent callings result in the same seeds
@@ -152,7 +413,14 @@ class TextGenerationCore:
 
         response: ChatCompletion = await self.__response(
             message=self.chat_message,
-            seed=seed
+            seed=seed,
+            cache_key=self.__cache_key(
+                message=self.chat_message,
+                response_format=None,
+                seed=requested_seed,
+                use_cache=use_cache,
+                cache_variant=cache_variant
+            )
         )
 
         # append the assistant response to the `self.chat_message`
@@ -162,7 +430,19 @@ class TextGenerationCore:
 
         return response
 
-    async def get_json_response_OpenAI(self, message: str, seed: int = None) -> ChatCompletion:
+    async def get_json_response_OpenAI(
+            self,
+            message: str,
+            seed: int = None,
+            use_cache: bool = True,
+            cache_variant: int = None,
+            n: int = 1,
+            schema: Type[BaseModel] = None,
+            validator: Callable[[str], Any] = None
+    ) -> ChatCompletion:
+
+        requested_seed: int = seed
+        backend: Tuple[str, str] = (self.base_url, self.model)
 
         # we randomize the seed here instead of in the parameter input
         # to prevent the case, in which concurrent callings result in the same seeds
@@ -172,32 +452,349 @@ class TextGenerationCore:
         # OpenAI instance initiated
         self.__initialize_OpenAI()
 
-        # response format
+        # response format, constrained by the schema where the backend supports structured outputs
         response_format: dict = {
             "type": "json_object"
         }
+        if schema is not None and TextGenerationCore.json_schema_support.get(
+            backend, self.settings.supports_json_schema
+        ):
+            response_format = schema_response_format(schema)
 
         # log the generation specifications
         logging.info(f"Seed for generation: {seed}")
-        logging.info("Generation mode: json")
+        logging.info(f"Generation mode: {response_format['type']}")
 
         message: List(Dict(str, str)) = [
             {"role": "user", "content": message}
         ]
 
         # get the response from the LLM
-        response: ChatCompletion = await self.__response(
-            message=message,
-            response_format=response_format,
-            seed=seed
-        )
+        try:
+            response: ChatCompletion = await self.__response(
+                message=message,
+                response_format=response_format,
+                seed=seed,
+                cache_key=self.__cache_key(
+                    message=message,
+                    response_format=response_format,
+                    seed=requested_seed,
+                    use_cache=use_cache,
+                    cache_variant=cache_variant,
+                    n=n
+                ),
+                n=n,
+                validator=validator
+            )
+        except openai.BadRequestError as e:
+            if response_format["type"] != "json_schema" or backend in TextGenerationCore.json_schema_support:
+                raise
+            # the backend rejects structured outputs, fall back to the plain JSON mode
+            logging.warning(f"The backend rejected the JSON schema ({e}), it is disabled for it")
+            TextGenerationCore.json_schema_support[backend] = False
+            return await self.get_json_response_OpenAI(
+                message=message[0]["content"],
+                seed=requested_seed,
+                use_cache=use_cache,
+                cache_variant=cache_variant,
+                n=n,
+                validator=validator
+            )
+
+        if response_format["type"] == "json_schema":
+            TextGenerationCore.json_schema_support[backend] = True
 
         return response
 
+    async def get_json_choices_OpenAI(
+            self,
+            message: str,
+            n: int,
+            use_cache: bool = True,
+            cache_variant: int = None,
+            schema: Type[BaseModel] = None,
+            validator: Callable[[str], Any] = None
+    ) -> List[str]:
+        """
+        The function `get_json_choices_OpenAI` gets `n` JSON samples of the same message. Where the
+        backend supports `n`, the samples come from one request and share one billed prompt. Backends
+        that ignore `n` are remembered, and the missing samples are requested one by one.
+
+        :param message: The user message to send
+        :type message: str
+        :param n: The number of samples wanted
+        :type n: int
+        :param use_cache: Whether the response cache may serve the samples
+        :type use_cache: bool
+        :param cache_variant: The variant of the samples in the response cache
+        :type cache_variant: int
+        :param schema: The pydantic model constraining the samples, where the backend supports it
+        :type schema: Type[BaseModel]
+        :param validator: The check of a sample, the responses with unusable samples are not cached
+        :type validator: Callable[[str], Any]
+        :return: a list of the contents of the choices, shorter than `n` if some requests failed.
+        `RetryExhaustedError` is raised when no sample could be generated at all.
+        """
+        backend: Tuple[str, str] = (self.base_url, self.model)
+        contents: List[str] = []
+
+        if n > 1 and TextGenerationCore.n_support.get(backend, self.settings.supports_n):
+            try:
+                response: ChatCompletion = await self.get_json_response_OpenAI(
+                    message=message,
+                    use_cache=use_cache,
+                    cache_variant=cache_variant,
+                    n=n,
+                    schema=schema,
+                    validator=validator
+                )
+            except openai.BadRequestError as e:
+                if backend in TextGenerationCore.n_support:
+                    raise
+                # the backend rejects `n`, fall back to one request per sample below
+                logging.warning(f"The backend rejected `n` ({e}), it is disabled for it")
+                TextGenerationCore.n_support[backend] = False
+                response = None
+
+            contents = [choice.message.content for choice in response.choices] if response else []
+            if response and len(contents) < n and backend not in TextGenerationCore.n_support:
+                logging.warning(f"The backend returned {len(contents)} of {n} choices, `n` is disabled for it")
+                TextGenerationCore.n_support[backend] = False
+            elif response and backend not in TextGenerationCore.n_support:
+                TextGenerationCore.n_support[backend] = True
+
+        # fall back to one request per missing sample
+        missing: int = n - len(contents)
+        if missing > 0:
+            responses: list = await asyncio.gather(*[
+                self.get_json_response_OpenAI(
+                    message=message,
+                    use_cache=use_cache,
+                    cache_variant=cache_variant if n == 1 else [cache_variant, i],
+                    schema=schema,
+                    validator=validator
+                )
+                for i in range(missing)
+            ], return_exceptions=True)
+
+            for response in responses:
+                if isinstance(response, RetryExhaustedError):
+                    logging.error(f"A sample is dropped: {response}")
+                elif isinstance(response, BaseException):
+                    raise response
+                else:
+                    contents.append(response.choices[0].message.content)
+
+            # every request failed, there is nothing to return
+            if not contents:
+                raise RetryExhaustedError(f"None of the {missing} samples could be generated", 0)
+
+        return contents
+
+    async def __stream(
+            self,
+            message: list,
+            response_format: dict = None,
+            seed: int = None,
+            cache_key: str = None,
+            validator: Callable[[str], Any] = None
+    ) -> AsyncIterator[str]:
+        """
+        The function `__stream` is the streaming counterpart of `__response`. It yields the content
+        deltas as they arrive, and accounts the usage reported by the final chunk once the stream
+        is over. A cached response is yielded as a single delta, and a streamed one is cached once
+        it is complete and passes `validator`. The time to the first delta is recorded on the span of
+        the call.
+        """
+        with self.tracer.call("chat completion", n=1, streamed=True) as span:
+            async for delta in self.__traced_stream(message, response_format, seed, cache_key, validator, span):
+                yield delta
 
-if __name__ == "__main__":
+    async def __traced_stream(
+            self,
+            message: list,
+            response_format: dict,
+            seed: int,
+            cache_key: str,
+            validator: Callable[[str], Any],
+            span: Span
+    ) -> AsyncIterator[str]:
+        if cache_key:
+            cached: str = self.cache.get(cache_key)
+            if cached is not None:
+                response: ChatCompletion = openai.types.chat.ChatCompletion.model_validate_json(cached)
+                if self.__valid(self.__contents(response), validator):
+                    logging.info(f"Streamed response served from the cache: {self.cache.statistics()}")
+                    span.set(cache_hit=True, first_byte=span.elapsed())
+                    yield response.choices[0].message.content
+                    return
+                logging.warning("The cached response is unusable, it is dropped from the cache")
+                self.cache.delete(cache_key)
+
+        async def attempt(timeout: float) -> tuple:
+            # only opening the stream is retried, deltas that were already yielded cannot be taken back
+            permit: SchedulerPermit = await self.scheduler.acquire(estimated_tokens=self.__estimate_tokens(message))
+            self.overall_requests += 1
+            span.add("attempts")
+            span.add("queue_wait", permit.queue_wait)
+            try:
+                async with asyncio.timeout(timeout):
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=message,
+                        response_format=response_format,
+                        seed=seed,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+            except BaseException as e:
+                await self.scheduler.release(permit, congested=isinstance(e, self.scheduler.congestion_errors))
+                raise
+
+            return permit, stream
+
+        permit, stream = await self.retry_policy.run(
+            attempt, deadline=self.run_deadline, description="Streamed chat completion"
+        )
+
+        usage = None
+        congested: bool = False
+        content: str = ""
+        completion_id: str = None
+        try:
+            async for chunk in stream:
+                completion_id = completion_id or chunk.id
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if "first_byte" not in span.attributes:
+                        span.set(first_byte=span.elapsed())
+                    content += chunk.choices[0].delta.content
+                    yield chunk.choices[0].delta.content
+
+        except BaseException as e:
+            congested = isinstance(e, self.scheduler.congestion_errors)
+            raise
+
+        finally:
+            if usage:
+                permit.record_usage(usage.total_tokens)
+            await self.scheduler.release(permit, congested=congested)
+
+        self.last_stream_usage = usage
+        if usage:
+            logging.info(
+                f"Completion tokens: {usage.completion_tokens}"
+                f"\nPrompt tokens: {usage.prompt_tokens}"
+                f"\nCached prompt tokens: {self.__cached_tokens(usage)}"
+                f"\nTotal tokens: {usage.total_tokens}"
+            )
+            self.overall_cached_tokens += self.__cached_tokens(usage)
+            span.set(
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                cached_tokens=self.__cached_tokens(usage)
+            )
+            self.overall_token_consumption += usage.total_tokens
+            logging.info(f"Overall token consumption by far: {self.overall_token_consumption}")
+
+        # the complete stream goes through the validator once, whether it is cached or not
+        if self.__valid([content], validator) and cache_key:
+            # the stream is cached as the response it would have been without streaming
+            response: ChatCompletion = openai.types.chat.ChatCompletion.model_validate({
+                "id": completion_id or "stream",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": self.model,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }],
+                "usage": usage.model_dump() if usage else None,
+            })
+            self.cache.put(cache_key, response.model_dump_json())
+
+    async def stream_chat_response_OpenAI(self, message: str, seed: int = None) -> AsyncIterator[str]:
+        """
+        The function `stream_chat_response_OpenAI` streams a chat response delta by delta, so that the
+        caller can show the first tokens while the rest is still being generated.
+
+        :param message: The user message to send
+        :type message: str
+        :param seed: The seed of the generation, randomized if not given
+        :type seed: int
+        :return: an async iterator of content deltas.
+        """
+        if seed is None:
+            seed = random.randint(a=0, b=999999)
 
-    import asyncio
+        self.__initialize_OpenAI()
+
+        logging.info(f"Seed for generation: {seed}")
+        logging.info("Generation mode: generic / streaming")
+
+        self.chat_message: list = [
+            {"role": "user", "content": str(message)}
+        ]
+
+        content: str = ""
+        async for delta in self.__stream(message=self.chat_message, seed=seed):
+            content += delta
+            yield delta
+
+        self.chat_message.append(
+            {"role": "assistant", "content": content}
+        )
+
+    async def stream_json_response_OpenAI(
+            self,
+            message: str,
+            seed: int = None,
+            use_cache: bool = True,
+            validator: Callable[[str], Any] = None
+    ) -> AsyncIterator[str]:
+        """
+        The function `stream_json_response_OpenAI` streams a JSON response delta by delta. The deltas
+        only form valid JSON once the stream is over.
+
+        :param message: The user message to send
+        :type message: str
+        :param seed: The seed of the generation, randomized if not given
+        :type seed: int
+        :param use_cache: Whether the response cache may serve the response, and store it
+        :type use_cache: bool
+        :param validator: The check of the complete response, an unusable one is not cached
+        :type validator: Callable[[str], Any]
+        :return: an async iterator of content deltas.
+        """
+        requested_seed: int = seed
+        if seed is None:
+            seed = random.randint(a=0, b=999999)
+
+        self.__initialize_OpenAI()
+
+        logging.info(f"Seed for generation: {seed}")
+        logging.info("Generation mode: json / streaming")
+
+        messages: list = [{"role": "user", "content": message}]
+        response_format: dict = {"type": "json_object"}
+        async for delta in self.__stream(
+            message=messages,
+            response_format=response_format,
+            seed=seed,
+            cache_key=self.__cache_key(
+                message=messages,
+                response_format=response_format,
+                seed=requested_seed,
+                use_cache=use_cache,
+                cache_variant=None
+            ),
+            validator=validator
+        ):
+            yield delta
+
+if __name__ == "__main__":
 
     logging.basicConfig(level=logging.INFO)
 
@@ -228,5 +825,7 @@ if __name__ == "__main__":
         for result in results:
             print(result.choices[0].message.content)
 
+        await ClientRegistry.aclose()
+
 
     asyncio.run(main())
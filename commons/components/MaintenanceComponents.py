@@ -0,0 +1,448 @@
+import datetime
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from .LLMCores import TextGenerationCore
+from .mechanics.ContextPackers import TokenCounter
+from .mechanics.Imports import lazy_import
+from .mechanics.Loaders import PromptRegistry
+from .mechanics.MemoryStores import MemoryStore
+from .mechanics.Retries import RetryExhaustedError
+
+np = lazy_import("numpy")
+
+
+def parse_timestamp(value: str) -> Optional[datetime.datetime]:
+    # the memories store `str(datetime.datetime.now())`
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# The `RetentionPolicy` class decides which memories are kept, from their age and their usage.
+class RetentionPolicy:
+
+    def __init__(
+        self,
+        max_age_days: Optional[float] = None,
+        min_retrievals: int = 1,
+        recently_used_days: Optional[float] = 30,
+        keep_outcomes: bool = True,
+    ) -> None:
+        """
+        The initializer of `RetentionPolicy`. A memory older than `max_age_days` is dropped, unless it
+        was retrieved `min_retrievals` times, was retrieved in the last `recently_used_days`, or has an
+        eventual outcome and `keep_outcomes` is on.
+
+        :param max_age_days: The age in days beyond which a memory may be dropped, `None` keeps them all
+        :type max_age_days: float
+        :param min_retrievals: The retrievals that keep an old memory
+        :type min_retrievals: int
+        :param recently_used_days: The days within which a retrieval keeps an old memory
+        :type recently_used_days: float
+        :param keep_outcomes: Whether the memories with an eventual outcome are always kept
+        :type keep_outcomes: bool
+        """
+        self.max_age_days: Optional[float] = max_age_days
+        self.min_retrievals: int = min_retrievals
+        self.recently_used_days: Optional[float] = recently_used_days
+        self.keep_outcomes: bool = keep_outcomes
+
+    def keeps(self, metadata: Dict[str, Any], now: datetime.datetime) -> bool:
+        if self.max_age_days is None:
+            return True
+
+        created_at: Optional[datetime.datetime] = parse_timestamp(metadata.get("timestamp"))
+        # a memory whose age is unknown is not dropped
+        if created_at is None or now - created_at <= datetime.timedelta(days=self.max_age_days):
+            return True
+
+        if self.keep_outcomes and metadata.get("eventual_outcome"):
+            return True
+        if metadata.get("retrievals", 0) >= self.min_retrievals:
+            return True
+
+        last_retrieved: Optional[datetime.datetime] = parse_timestamp(metadata.get("last_retrieved"))
+        if self.recently_used_days is not None and last_retrieved is not None:
+            return now - last_retrieved <= datetime.timedelta(days=self.recently_used_days)
+
+        return False
+
+
+# The `MemoryMaintenanceComponent` class keeps the memory collection bounded. It applies retention
+# policies, consolidates clusters of old similar memories into summary records, and compacts the
+# collection by rebuilding it. Each operation reports the index size and the query latency before and
+# after it. It also streams the memories out to JSONL and back in, a page or a batch at a time.
+class MemoryMaintenanceComponent:
+
+    def __init__(self, store: MemoryStore = None, collection: str = None, page_size: int = 500) -> None:
+        """
+        The initializer of `MemoryMaintenanceComponent`.
+
+        :param store: The `MemoryStore` holding the collection, the process-wide one if not given
+        :type store: MemoryStore
+        :param collection: The name of the collection, the one of the `MemorySettings` if not given
+        :type collection: str
+        :param page_size: The records read from Chroma at once
+        :type page_size: int
+        """
+        self.store: MemoryStore = store or MemoryStore.shared()
+        self.collection_name: str = collection or self.store.settings.collection
+        self.page_size: int = page_size
+
+    @property
+    def collection(self):
+        return self.store.collection(self.collection_name)
+
+    async def pages(self, include: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        The function `pages` reads the collection `page_size` records at a time, after flushing the
+        writes still queued.
+
+        :param include: The fields of the records to read, e.g. ["documents", "metadatas"]
+        :type include: List[str]
+        :return: an async iterator of `collection.get` results.
+        """
+        await self.store.flush(self.collection_name)
+
+        offset: int = 0
+        while True:
+            page: Dict[str, Any] = await self.store.run(
+                self.collection.get, limit=self.page_size, offset=offset, include=include
+            )
+            if not page["ids"]:
+                return
+
+            yield page
+            offset += len(page["ids"])
+
+    def __disk_bytes(self) -> int:
+        total: int = 0
+        for directory, _, files in os.walk(self.store.path):
+            for file in files:
+                total += os.path.getsize(os.path.join(directory, file))
+
+        return total
+
+    async def metrics(self, probes: int = 20) -> Dict[str, Any]:
+        """
+        The function `metrics` measures the size of the index, and the latency of `probes` queries made
+        with the embeddings of stored memories.
+        :return: the records, the bytes on disk, and the p50/p95 query latency in milliseconds.
+        """
+        await self.store.flush(self.collection_name)
+        records: int = await self.store.run(self.collection.count)
+
+        latencies: List[float] = []
+        if records:
+            sample: Dict[str, Any] = await self.store.run(
+                self.collection.get, limit=probes, include=["embeddings"]
+            )
+            for embedding in sample["embeddings"]:
+                started_at: float = time.perf_counter()
+                await self.store.run(
+                    self.collection.query,
+                    query_embeddings=[list(embedding)],
+                    n_results=min(records, self.store.settings.retrieval_candidates)
+                )
+                latencies.append((time.perf_counter() - started_at) * 1000)
+
+        return {
+            "records": records,
+            "disk_bytes": self.__disk_bytes(),
+            "query_latency_ms": {
+                "p50": float(np.percentile(latencies, 50)) if latencies else None,
+                "p95": float(np.percentile(latencies, 95)) if latencies else None,
+            },
+        }
+
+    async def apply_retention(self, policy: RetentionPolicy, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        The function `apply_retention` deletes the memories the policy does not keep.
+        :return: the number of memories scanned and deleted, with the metrics before and after.
+        """
+        before: Dict[str, Any] = await self.metrics()
+        now: datetime.datetime = datetime.datetime.now()
+
+        # the ids are collected first, deleting while paging would shift the offsets
+        expired: List[str] = []
+        scanned: int = 0
+        async for page in self.pages(include=["metadatas"]):
+            scanned += len(page["ids"])
+            expired.extend(
+                memory_id for memory_id, metadata in zip(page["ids"], page["metadatas"])
+                if not policy.keeps(metadata or {}, now)
+            )
+
+        if not dry_run:
+            for start in range(0, len(expired), self.page_size):
+                await self.store.run(self.collection.delete, ids=expired[start:start + self.page_size])
+        logging.info(f"Retention: {len(expired)} of {scanned} memories {'would be ' if dry_run else ''}deleted.")
+
+        return {"scanned": scanned, "deleted": len(expired), "dry_run": dry_run,
+                "before": before, "after": await self.metrics()}
+
+    async def __summarize(self, documents: List[str], metadatas: List[Dict[str, Any]], use_llm: bool) -> str:
+        memories: str = "\n".join(
+            f"- {document} (selected: {metadata.get('selected_recommendation', '')}; "
+            f"outcome: {metadata.get('eventual_outcome', '')})"
+            for document, metadata in zip(documents, metadatas)
+        )
+        if use_llm:
+            try:
+                response = await TextGenerationCore().get_chat_response_OpenAI(
+                    message=PromptRegistry.compose("prompt_08_consolidation", [("memories", memories)]),
+                    use_cache=False
+                )
+                return response.choices[0].message.content.strip()
+
+            except (RetryExhaustedError, ValueError) as e:
+                logging.error(f"The memories are consolidated without the LLM: {e}")
+
+        # without the LLM, the distinct situations are kept side by side
+        return TokenCounter.shared().truncate(
+            "; ".join(dict.fromkeys(documents)), self.store.settings.max_entry_tokens
+        )
+
+    async def consolidate(
+        self,
+        older_than_days: float = 90,
+        similarity: float = 0.9,
+        min_cluster_size: int = 3,
+        use_llm: bool = True,
+        dry_run: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        The function `consolidate` replaces each cluster of old similar memories by one summary record.
+        The clusters are grown greedily around the oldest memories, from the cosine similarity of their
+        embeddings.
+
+        :param older_than_days: The age in days from which a memory may be consolidated
+        :type older_than_days: float
+        :param similarity: The cosine similarity from which two memories belong to the same cluster
+        :type similarity: float
+        :param min_cluster_size: The memories a cluster needs to be consolidated
+        :type min_cluster_size: int
+        :param use_llm: Whether the summary is written by the LLM, or by joining the situations
+        :type use_llm: bool
+        :param dry_run: Whether the clusters are only counted
+        :type dry_run: bool
+        :return: the clusters and memories consolidated, with the metrics before and after.
+        """
+        before: Dict[str, Any] = await self.metrics()
+        cutoff: datetime.datetime = datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+
+        ids: List[str] = []
+        documents: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        embeddings: List[Any] = []
+        async for page in self.pages(include=["documents", "metadatas", "embeddings"]):
+            for memory_id, document, metadata, embedding in zip(
+                page["ids"], page["documents"], page["metadatas"], page["embeddings"]
+            ):
+                created_at: Optional[datetime.datetime] = parse_timestamp((metadata or {}).get("timestamp"))
+                if created_at is not None and created_at < cutoff:
+                    ids.append(memory_id)
+                    documents.append(document)
+                    metadatas.append(metadata)
+                    embeddings.append(embedding)
+
+        clusters: List[List[int]] = []
+        if ids:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            order: List[int] = sorted(range(len(ids)), key=lambda index: metadatas[index]["timestamp"])
+            unassigned = np.ones(len(ids), dtype=bool)
+            for leader in order:
+                if not unassigned[leader]:
+                    continue
+                members = np.flatnonzero(unassigned & (vectors @ vectors[leader] >= similarity))
+                unassigned[members] = False
+                if len(members) >= min_cluster_size:
+                    clusters.append([int(member) for member in members])
+
+        consolidated: int = 0
+        for cluster in [] if dry_run else clusters:
+            summary: str = await self.__summarize(
+                [documents[index] for index in cluster], [metadatas[index] for index in cluster], use_llm
+            )
+            cluster_metadatas: List[Dict[str, Any]] = [metadatas[index] for index in cluster]
+            metadata: Dict[str, Any] = {
+                "timestamp": max(metadata["timestamp"] for metadata in cluster_metadatas),
+                "selected_recommendation": "; ".join(dict.fromkeys(
+                    metadata.get("selected_recommendation", "") for metadata in cluster_metadatas
+                    if metadata.get("selected_recommendation")
+                )),
+                "eventual_outcome": "; ".join(dict.fromkeys(
+                    metadata.get("eventual_outcome", "") for metadata in cluster_metadatas
+                    if metadata.get("eventual_outcome")
+                )),
+                "retrievals": sum(metadata.get("retrievals", 0) for metadata in cluster_metadatas),
+                "consolidated_from": len(cluster),
+            }
+
+            # the summary is written before the originals are deleted, so a crash loses nothing
+            await self.store.run(
+                self.collection.add,
+                ids=[str(uuid.uuid4())],
+                documents=[summary],
+                metadatas=[metadata],
+                embeddings=await self.store.embed([summary])
+            )
+            await self.store.run(self.collection.delete, ids=[ids[index] for index in cluster])
+            consolidated += len(cluster)
+
+        logging.info(f"Consolidation: {len(clusters)} clusters found among {len(ids)} old memories.")
+
+        return {"candidates": len(ids), "clusters": len(clusters), "consolidated": consolidated, "dry_run": dry_run,
+                "before": before, "after": await self.metrics()}
+
+    async def compact(self) -> Dict[str, Any]:
+        """
+        The function `compact` rebuilds the collection by copying its records into a fresh collection
+        that replaces it, which reclaims the space the deletions left in the index. It is meant to run
+        offline, while no `Thinker` writes to the collection.
+        :return: the records copied, with the metrics before and after.
+        """
+        rebuilt_name: str = f"{self.collection_name}_compacting"
+        backup_name: str = f"{self.collection_name}_backup"
+
+        # an interrupted compaction is recovered first. The original only becomes the backup once the
+        # copy is complete, and the backup is only dropped once the copy replaced it, so one of them
+        # always holds every memory.
+        existing: List[str] = [
+            getattr(collection, "name", collection) for collection in await self.store.run(self.store.client.list_collections)
+        ]
+        if backup_name in existing:
+            if self.collection_name in existing:
+                # the swap was over, only the backup was left
+                await self.store.run(self.store.client.delete_collection, backup_name)
+            else:
+                backup = await self.store.run(self.store.client.get_collection, backup_name)
+                await self.store.run(backup.modify, name=self.collection_name)
+                self.store.forget(self.collection_name)
+                logging.warning(f"Compaction: {self.collection_name} is restored from its backup.")
+        if rebuilt_name in existing:
+            # a copy left by an interrupted compaction is started over
+            await self.store.run(self.store.client.delete_collection, rebuilt_name)
+
+        before: Dict[str, Any] = await self.metrics()
+        rebuilt = await self.store.run(self.store.client.create_collection, name=rebuilt_name)
+
+        copied: int = 0
+        async for page in self.pages(include=["documents", "metadatas", "embeddings"]):
+            await self.store.run(
+                rebuilt.add,
+                ids=page["ids"],
+                documents=page["documents"],
+                metadatas=page["metadatas"],
+                embeddings=page["embeddings"]
+            )
+            copied += len(page["ids"])
+
+        original = await self.store.run(self.store.client.get_collection, self.collection_name)
+        await self.store.run(original.modify, name=backup_name)
+        await self.store.run(rebuilt.modify, name=self.collection_name)
+        self.store.forget(self.collection_name)
+        await self.store.run(self.store.client.delete_collection, backup_name)
+        logging.info(f"Compaction: {copied} memories copied into a fresh collection.")
+
+        return {"copied": copied, "before": before, "after": await self.metrics()}
+
+    async def export_memories(self, embeddings: bool = False) -> AsyncIterator[str]:
+        """
+        The function `export_memories` streams the memories as JSONL lines, one page in memory at a
+        time whatever the size of the collection.
+
+        :param embeddings: Whether the embeddings are exported too, which spares embedding the memories
+        again on import at the cost of a much larger file
+        :type embeddings: bool
+        :return: an async iterator of lines holding the "id", "document", "metadata" and optionally
+        "embedding" of a memory, each ending with a newline.
+        """
+        include: List[str] = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+        exported: int = 0
+        async for page in self.pages(include=include):
+            for index, memory_id in enumerate(page["ids"]):
+                record: Dict[str, Any] = {
+                    "id": memory_id,
+                    "document": page["documents"][index],
+                    "metadata": page["metadatas"][index],
+                }
+                if embeddings:
+                    record["embedding"] = [float(value) for value in page["embeddings"][index]]
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+            exported += len(page["ids"])
+
+        logging.info(f"{exported} memories exported.")
+
+    async def import_memories(self, lines: Iterable[str], batch_size: int = 256) -> Dict[str, int]:
+        """
+        The function `import_memories` upserts the memories of JSONL lines, as written by
+        `export_memories`, `batch_size` records at a time. Records without an embedding are embedded
+        per batch. Upserts make an interrupted import safe to run again.
+
+        :param lines: The JSONL lines, e.g. an open file, read lazily
+        :type lines: Iterable[str]
+        :param batch_size: The records written at once
+        :type batch_size: int
+        :return: the number of memories imported, embedded on the way, and of lines skipped.
+        """
+        counters: Dict[str, int] = {"imported": 0, "embedded": 0, "skipped": 0}
+        batch: List[Dict[str, Any]] = []
+
+        async def write() -> None:
+            missing: List[Dict[str, Any]] = [record for record in batch if record.get("embedding") is None]
+            if missing:
+                for record, embedding in zip(missing, await self.store.embed([record["document"] for record in missing])):
+                    record["embedding"] = embedding
+                counters["embedded"] += len(missing)
+
+            await self.store.run(
+                self.collection.upsert,
+                ids=[record["id"] for record in batch],
+                documents=[record["document"] for record in batch],
+                metadatas=[record["metadata"] for record in batch],
+                embeddings=[record["embedding"] for record in batch]
+            )
+            counters["imported"] += len(batch)
+            batch.clear()
+
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record: Dict[str, Any] = json.loads(line)
+                if not isinstance(record.get("document"), str):
+                    raise ValueError("the record has no document")
+                metadata: Dict[str, Any] = record.get("metadata") or {}
+                if not isinstance(metadata, dict):
+                    raise ValueError("the metadata of the record is not an object")
+                record.setdefault("id", str(uuid.uuid4()))
+                # the retrieval reads all of these fields, the retention needs the timestamp, and Chroma
+                # rejects empty metadata and null values
+                record["metadata"] = {
+                    "timestamp": str(datetime.datetime.now()),
+                    "selected_recommendation": "",
+                    "eventual_outcome": "",
+                    **{name: value for name, value in metadata.items() if value is not None},
+                }
+            except (json.JSONDecodeError, ValueError, AttributeError) as e:
+                logging.error(f"Line {number} is skipped: {e!r}")
+                counters["skipped"] += 1
+                continue
+
+            batch.append(record)
+            if len(batch) >= batch_size:
+                await write()
+
+        if batch:
+            await write()
+        logging.info(f"Import: {counters}")
+
+        return counters
@@ -1,10 +1,16 @@
+from __future__ import annotations
+
 import datetime
 import uuid
 import asyncio
-
-import chromadb
+from typing import TYPE_CHECKING
 
 from .LLMCores import *
+from .mechanics.ContextPackers import ContextPacker
+from .mechanics.MemoryStores import MemoryStore, WriteBehindQueue
+
+if TYPE_CHECKING:
+    import chromadb
 
 """
 [ ] Write down daily events, and then save them into the vector database for future retrieval
@@ -17,7 +23,7 @@ from .LLMCores import *
 # recording, storing, retrieving, and deleting memories based on a given situation.
 class MemoryComponent:
     
-    def __init__(self, situation: str, thoughts: str) -> None:
+    def __init__(self, situation: str, thoughts: str, store: MemoryStore = None) -> None:
         """
         The above function is the initialization method for a class, which sets the initial values for the
         situation and thoughts attributes, and also initializes the database and collection for storing
@@ -31,6 +37,8 @@ class MemoryComponent:
         initial thoughts or reflections of the object. It is used to store the thoughts or reflections
         related to the situation that the object is in
         :type thoughts: str
+        :param store: The `MemoryStore` holding the database, the process-wide one if not given
+        :type store: MemoryStore
         """
         # initiated right away, the attributes of a memory
         self.situation = situation
@@ -40,11 +48,20 @@ class MemoryComponent:
         self.selected_recommendation: str = ""
         self.eventual_outcome: str = ""
         
-        # initiate the database and the collection
-        self.client = chromadb.PersistentClient('resources/VectorDB')
-        self.collection = self.client.create_collection(
-            name="ThinkerMemory",
-            get_or_create=True
+        # the database and the collection are opened once per process and reused
+        self.store: MemoryStore = store or MemoryStore.shared()
+        self.client = self.store.client
+        self.collection = self.store.collection()
+        # the writes are queued and applied in batches, off the event loop
+        self.writer: WriteBehindQueue = self.store.writer()
+        # the id of the memory stored by this run
+        self.memory_uuid: str = None
+        # the retrieved memories are fitted into the token budget of the brief prompt
+        settings = self.store.settings
+        self.context_packer: ContextPacker = ContextPacker(
+            token_budget=settings.context_tokens,
+            max_distance=settings.max_distance,
+            max_entry_tokens=settings.max_entry_tokens
         )
     
     async def record_selected_recommendation(self, recommendation: str) -> None:
@@ -79,17 +96,18 @@ class MemoryComponent:
         The `store_memory` function adds an event to the memory collection, including the situation,
         timestamp, selected recommendation, and an empty field for eventual outcome.
         """
-        # add the event to the memory
-        self.collection.add(
-            ids=[str(uuid.uuid4())],
-            documents=[self.situation],
-            metadatas=[
-                {
-                    "timestamp":str(datetime.datetime.now()), 
-                    "selected_recommendation": self.selected_recommendation, 
-                    "eventual_outcome": "", # this needs to be handled differently, as the eventual outcome usually won't be recorded along with the other threes
-                }
-            ]
+        # queue the event for the memory, it is journalled right away and written in the background
+        self.memory_uuid = str(uuid.uuid4())
+        embedding: list = (await self.store.embed([self.situation]))[0]
+        self.writer.upsert(
+            record_id=self.memory_uuid,
+            document=self.situation,
+            embedding=embedding,
+            metadata={
+                "timestamp":str(datetime.datetime.now()), 
+                "selected_recommendation": self.selected_recommendation, 
+                "eventual_outcome": "", # this needs to be handled differently, as the eventual outcome usually won't be recorded along with the other threes
+            }
         )
         logging.info("Memory stored")
     
@@ -98,7 +116,9 @@ class MemoryComponent:
         The function `get_all_memories` returns all the memories from a collection.
         :return: a list of all the memories.
         """
-        return self.collection.get()
+        await self.store.flush()
+        
+        return await self.store.run(self.collection.get)
     
     async def delete_memories(self, ids: list) -> None:
         """
@@ -107,7 +127,10 @@ class MemoryComponent:
         :param ids: A list of memory IDs that need to be deleted
         :type ids: list
         """
-        self.collection.delete(
+        # the memories may still be queued
+        await self.store.flush()
+        await self.store.run(
+            self.collection.delete,
             ids=ids
         )
         logging.info("Memories deleted.")
@@ -121,43 +144,68 @@ class MemoryComponent:
         """
         # edit the event in the memory
         if self.eventual_outcome:
-            self.collection.update(
-                ids=[memory_uuid],
-                metadatas=[
-                    {"eventual_outcome": self.eventual_outcome}
-                ]
+            self.writer.update(
+                record_id=memory_uuid,
+                metadata={"eventual_outcome": self.eventual_outcome}
             )
             logging.info("Eventual outcome is recorded.")
         else:
             logging.info("Eventual outcome is not recorded yet. Edit operation aborted.")
     
     async def __retrieve_memory_organizer(self, event_content: str, metadata: dict) -> str:
-        return "event_content: " + event_content + "\n" + "eventual_outcome: " + metadata['eventual_outcome'] + "\n" + "selected_recommendation: " + metadata['selected_recommendation'] + "\n" + "timestamp: " + metadata['timestamp']
+        # memories written by other tools may lack some of the fields
+        metadata = metadata or {}
+        return "event_content: " + event_content + "\n" + "eventual_outcome: " + str(metadata.get('eventual_outcome', '')) + "\n" + "selected_recommendation: " + str(metadata.get('selected_recommendation', '')) + "\n" + "timestamp: " + str(metadata.get('timestamp', ''))
     
-    async def retrieve_memory(self) -> chromadb.QueryResult:
+    async def retrieve_memory(self) -> list:
         """
-        The function retrieves the most relevant historical events based on a given situation.
+        The function retrieves the most relevant historical events based on a given situation. The
+        memory stored by this run is left out, as are the events too distant from the situation, and
+        the closest of the others are packed into the token budget of the context.
         :return: The function `retrieve_memory` returns a list of historical events.
         """
-        # get the most relevant historical events
-        historical_events: chromadb.QueryResult = self.collection.query(
-            query_texts=[self.situation],
-            n_results=10
+        # get the most relevant historical events, the situation was embedded when it was stored
+        historical_events: chromadb.QueryResult = await self.store.run(
+            self.collection.query,
+            query_embeddings=await self.store.embed([self.situation]),
+            # one more, in case the memory of this run is among them
+            n_results=self.store.settings.retrieval_candidates + 1
         )
         logging.info("Historical events retrieved.")
         logging.info(f"Historical events' distances: {historical_events['distances']}")
         logging.info(f"Historical events: {historical_events['documents']}")
         
         # organize the `historical_events`
+        candidates: list = [
+            (memory_id, event_content, metadata, distance) 
+            for memory_id, event_content, metadata, distance in zip(
+                historical_events['ids'][0], 
+                historical_events['documents'][0], 
+                historical_events['metadatas'][0], 
+                historical_events['distances'][0]
+            ) if memory_id != self.memory_uuid
+        ][:self.store.settings.retrieval_candidates]
         tasks = [
             self.__retrieve_memory_organizer(
                 event_content, 
                 metadata
-            ) for event_content, metadata in zip(historical_events['documents'][0], historical_events['metadatas'][0])
+            ) for _, event_content, metadata, _ in candidates
         ]
         organized_historical_events: list = await asyncio.gather(*tasks)
         
-        return organized_historical_events
+        # the usage of the relevant memories is counted for the retention policies, in a single write
+        self.writer.record_usage(
+            record_ids=[
+                memory_id for memory_id, _, _, distance in candidates
+                if self.context_packer.max_distance is None or distance <= self.context_packer.max_distance
+            ],
+            increments={"retrievals": 1},
+            metadata={"last_retrieved": str(datetime.datetime.now())}
+        )
+        
+        return self.context_packer.pack(
+            [(event, candidate[3]) for event, candidate in zip(organized_historical_events, candidates)]
+        )
 
 class FeedbackComponent:
     
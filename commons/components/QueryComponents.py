@@ -1,10 +1,14 @@
 import asyncio
 import json
-import re
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, AsyncGenerator, AsyncIterator, Callable
 
 from .LLMCores import *
+from .mechanics.Budgets import SearchBudget
+from .mechanics.Hedging import HedgedFanOut, LatencyTracker
+from .mechanics.Loaders import PromptRegistry
 from .mechanics.QueryOperations import QueryOperation
+from .mechanics.Retries import InvalidResponseError, RetryExhaustedError
+from .mechanics.Schemas import Brief, ParseStatistics, Prediction, Simulation, Suggestion, parse_response
 from .MemoryComponents import *
 
 
@@ -17,6 +21,12 @@ class QueryComponent:
         top_n_advices: int = 5,
         inference_model: str = "gpt-4.1",
         api_type: str = "openai",
+        multi_sample: bool = False,
+        hedging: Optional[Dict[str, Any]] = None,
+        simulation_batch_tokens: Optional[int] = 2000,
+        max_requests: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        budget_reserve: float = 0.1,
     ) -> None:
         # initialized variables
         self.memory: MemoryComponent = memory
@@ -26,6 +36,11 @@ class QueryComponent:
         self.branch_size_factor: int = branch_size_factor
         # the number determines how many advices it will eventually sort out
         self.top_n_advices: int = top_n_advices
+        # request the samples of a prompt as the choices of one request, where the backend allows it
+        self.multi_sample: bool = multi_sample
+        # the estimated tokens of the suggestions packed into one simulation request, `None` disables
+        # the simulation and keeps the self-reported success rates
+        self.simulation_batch_tokens: Optional[int] = simulation_batch_tokens
         logging.info(
             f"QueryComponent initialized with base_tree_size: {base_tree_size}"
         )
@@ -36,10 +51,41 @@ class QueryComponent:
             f"QueryComponent initialized with top_n_advices: {top_n_advices}"
         )
 
+        # the fan-out of each stage, hedged if `hedging` is enabled
+        hedging = hedging or {}
+        self.fan_outs: Dict[str, HedgedFanOut] = {}
+        for stage in ("prediction", "suggestion"):
+            if hedging.get("enabled", False):
+                self.fan_outs[stage] = HedgedFanOut(
+                    tracker=LatencyTracker.for_stage(stage),
+                    extra_requests=hedging.get("extra_requests", 0),
+                    hedge_percentile=hedging.get("hedge_percentile"),
+                    min_samples=hedging.get("min_samples", 20),
+                    max_hedges=hedging.get("max_hedges", 0)
+                )
+            else:
+                self.fan_outs[stage] = HedgedFanOut(tracker=LatencyTracker.for_stage(stage))
+
         # initialize the `text_generator`
         self.text_generator: TextGenerationCore = TextGenerationCore(
             api_type=api_type
         )
+        # the request, token and time budget of the run, unlimited unless configured or given a deadline
+        self.budget: SearchBudget = SearchBudget(
+            self.text_generator, max_requests=max_requests, max_tokens=max_tokens, reserve=budget_reserve
+        )
+        # the (predictions, suggestions per prediction) of the run, narrowed by the budget in `predict`
+        # or `expand`
+        self.shape: Tuple[int, int] = (base_tree_size, branch_size_factor)
+
+        # the structured output model of each stage, and the counters of parse failures and retries
+        self.schemas: Dict[str, type] = {
+            "brief": Brief,
+            "prediction": Prediction,
+            "suggestion": Suggestion,
+            "simulation": Simulation,
+        }
+        self.parse_statistics: ParseStatistics = ParseStatistics()
 
         # other variables that we will get later on
         self.the_brief: Dict[str, Any] = {}
@@ -49,254 +95,580 @@ class QueryComponent:
         # Store tree structure: each prediction has its suggestions
         self.tree_structure: Dict[str, Any] = {"root": None, "predictions": []}
 
+    async def __brief_prompt(self) -> str:
+        # retrieve the historical events
+        historical_events: list = await self.memory.retrieve_memory()
+
+        # construct the prompt to send, the date changes once a day so it goes last
+        brief_prompt: str = PromptRegistry.compose(
+            "prompt_03_brief",
+            [
+                ("my thoughts to the situation", self.memory.thoughts),
+                ("situation", self.memory.situation),
+                ("context", "\n\n".join(historical_events)),
+                ("info_lookup", "Current date is " + str(datetime.date.today())),
+            ]
+        )
+        logging.info("Brief prompt generated.")
+        logging.debug(brief_prompt)
+
+        return brief_prompt
+
     async def brief(self) -> None:
         """
         The `brief` function generates a brief prompt by combining various pieces of information and
         sends it to the OpenAI text generator to generate a brief.
         """
-        with open("resources/prompts/prompt_03_brief", "r") as prompt:
-            prompt: str = prompt.read()
+        brief_prompt: str = await self.__brief_prompt()
 
-        # retrieve the historical events
-        historical_events: list = await self.memory.retrieve_memory()
+        # get the brief, a reply that is not valid JSON is requested again within the retry policy
+        self.the_brief = await self.__request_json(prompt=brief_prompt, stage="brief")
+        logging.info("Brief recorded.")
 
-        # construct the prompt to send
-        situation = "[situation]:" + self.memory.situation + "\n"
-        context = "[context]:" + str(historical_events) + "\n"
-        thoughts = (
-            "\n[my thoughts to the situation]:" + self.memory.thoughts + "\n"
-        )
-        info_lookup = (
-            "[info_lookup]:"
-            + "Current date is "
-            + str(datetime.datetime.now())
-            + "\n"
-        )
+    async def brief_stream(self) -> AsyncGenerator[str, None]:
+        """
+        The `brief_stream` function is the streaming version of `brief`. It yields the brief text
+        generated so far, and records the parsed brief once the stream is over. A streamed brief that
+        cannot be parsed is generated again with `brief`.
+        """
+        brief_prompt: str = await self.__brief_prompt()
 
-        brief_prompt: str = (
-            prompt + thoughts + situation + info_lookup + context
-        )
-        logging.info("Brief prompt generated.")
-        logging.debug(brief_prompt)
+        content: str = ""
+        # the same situation, thoughts and memories on the same day are served from the response cache
+        async for delta in self.text_generator.stream_json_response_OpenAI(
+            message=brief_prompt, validator=self.__validator("brief")
+        ):
+            content += delta
+            yield content
 
-        # get the brief
         try:
-            while True:
-                brief: ChatCompletion = (
-                    await self.text_generator.get_json_response_OpenAI(
-                        message=brief_prompt
-                    )
-                )
-                if brief is None:
-                    continue
+            self.the_brief = self.__parse("brief", content)
+            logging.info("Brief recorded.")
 
-                logging.info("Brief generated.")
+        except InvalidResponseError as e:
+            # the validator counted the failure and the retry
+            logging.error(f"Streamed brief could not be parsed due to {e}. Retry without streaming.")
+            await self.brief()
 
-                # record the brief into the object instance
-                self.the_brief = json.loads(brief.choices[0].message.content)
-                logging.info("Brief recorded.")
-                break
-        except json.JSONDecodeError as e:
-            logging.error(f"Brief generation failed due to {e}. Retry.")
-
-    async def predict(self) -> None:
+    def __parse(self, stage: str, content: str) -> Dict[str, Any]:
         """
-        The `predict` function reads a prompt from a file, appends a summary to it, generates a
-        prediction using OpenAI's text generator, and records the prediction in the object instance.
+        The function `__parse` validates a reply that went through the validator of its stage against
+        the model of the stage, and counts it in `parse_statistics` if it is usable; the validator
+        counted it already if it is not. `InvalidResponseError` is raised if the reply is unusable.
         """
-        with open("resources/prompts/prompt_04_predictions", "r") as prompt:
-            prompt: str = prompt.read()
+        parsed: Dict[str, Any] = parse_response(content, self.schemas[stage])
+        self.parse_statistics.parsed(stage)
 
-        # construct the prompt to send
-        prompt = prompt + "\n" + "[summary]:" + str(self.the_brief)
+        return parsed
 
-        # get the predictions based on the `base_tree_size`
-        # original seed: seed=458282
-        tasks = [
-            self.text_generator.get_json_response_OpenAI(message=prompt)
-            for i in range(self.base_tree_size)
+    def __validator(self, stage: str, counted: bool = False, retried: bool = True) -> Callable[[str], Dict[str, Any]]:
+        """
+        The function `__validator` returns the check of the replies of a stage that the core runs once
+        per reply. It keeps unusable responses out of the response cache, and has a single reply
+        requested again. The check counts every unusable reply in `parse_statistics` and in the
+        tracer, along with its retry. A `counted` check also counts the usable replies, otherwise the
+        caller counts them with `__parse`.
+
+        :param stage: The stage whose model the replies must satisfy
+        :type stage: str
+        :param counted: Whether the usable replies are counted by the check
+        :type counted: bool
+        :param retried: Whether an unusable reply is requested again, the samples of a multi-choice
+        suggestion request are dropped instead
+        :type retried: bool
+        """
+        def validate(content: str) -> Dict[str, Any]:
+            try:
+                parsed: Dict[str, Any] = parse_response(content, self.schemas[stage])
+            except InvalidResponseError:
+                self.parse_statistics.failed(stage)
+                self.text_generator.tracer.parse_failure(stage)
+                if retried:
+                    # the reply is requested again, unless the attempts or the run are over
+                    self.parse_statistics.retried(stage)
+                raise
+
+            if counted:
+                self.parse_statistics.parsed(stage)
+            return parsed
+
+        return validate
+
+    def __prediction_prompt(self, moves: Optional[List[str]] = None) -> str:
+        # construct the prompt to send, the moves already taken narrow it down to a deeper node
+        sections: list = [("summary", str(self.the_brief))]
+        if moves:
+            sections.append(("moves already taken", str(moves)))
+
+        return PromptRegistry.compose("prompt_04_predictions", sections)
+
+    def __suggestion_prompt(self, prediction: Dict[str, Any], moves: Optional[List[str]] = None) -> str:
+        # the brief and the thoughts are shared by every branch, so they come before the prediction
+        sections: list = [
+            ("summary", str(self.the_brief)),
+            ("thoughts", self.memory.thoughts),
         ]
-        predictions = await asyncio.gather(*tasks)
-        logging.info("Predictions generated. ")
+        if moves:
+            sections.append(("moves already taken", str(moves)))
+        sections.append(("predictions", str(prediction)))
 
-        for prediction in predictions:
-            try:
-                # we stop the current iteration and start the next in case if the API request failed.
-                if prediction is None:
-                    continue
+        return PromptRegistry.compose("prompt_05_suggestions", sections)
+
+    def __initialize_tree(self) -> None:
+        self.tree_structure["root"] = self.the_brief
+        self.tree_structure["predictions"] = []
 
-                content: str = prediction.choices[0].message.content
+    def __plan(self) -> None:
+        # the brief is in, so the budget knows what a request of this run costs
+        self.shape = self.budget.plan(self.base_tree_size, self.branch_size_factor, self.multi_sample)
+        if self.shape != (self.base_tree_size, self.branch_size_factor):
+            logging.info(
+                f"The tree is narrowed from {self.base_tree_size}x{self.branch_size_factor} to "
+                f"{self.shape[0]}x{self.shape[1]} to fit the budget: {self.budget.report()}"
+            )
 
-                matches = re.findall(r"```json\n([\s\S]*?)\n```", content)
+    def __branch_requests(self) -> int:
+        # the requests the suggestions of one prediction take
+        return 1 if self.multi_sample else self.shape[1]
 
-                if matches:
-                    # record the prediction into the object instance
-                    self.the_predictions.append(json.loads(matches[0]))
-                    logging.info("Prediction recorded.")
-                else:
-                    self.the_predictions.append(json.loads(content))
-                    logging.info("Prediction recorded.")
+    def __record_prediction(self, prediction: Dict[str, Any]) -> int:
+        pred_idx: int = len(self.the_predictions)
+        self.the_predictions.append(prediction)
+        self.tree_structure["predictions"].append(
+            {"id": pred_idx, "data": prediction, "suggestions": []}
+        )
+        logging.info("Prediction recorded.")
+
+        return pred_idx
+
+    async def __sample(self, stage: str, prompt: str, samples: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        The function `__sample` fans `samples` requests of a prompt out and yields the parsed results of
+        each request as it lands. With `multi_sample` on, the samples are the choices of one request.
+        The `HedgedFanOut` of the stage may over-provision or hedge the requests.
+
+        :param stage: Either "prediction" or "suggestion"
+        :type stage: str
+        :return: an async iterator of lists of parsed results, one list per accepted request.
+        """
+        if self.multi_sample:
+            samples_per_request, requests = samples, 1
+        else:
+            samples_per_request, requests = 1, samples
+
+        request = self.__request_predictions if stage == "prediction" else self.__request_suggestions
+
+        # the index of a request is its cache variant, so that hedges and siblings sample differently
+        async for results in self.fan_outs[stage].stream(
+            lambda index: request(prompt=prompt, samples=samples_per_request, variant=index),
+            k=requests
+        ):
+            yield results
 
-            except json.JSONDecodeError as e:
+    async def __request_json(self, prompt: str, stage: str, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        The function `__request_json` requests one JSON reply of the prompt. A reply that does not
+        satisfy the model of the stage is a failed attempt of the `RetryPolicy` of the core, so transient
+        errors and parse failures share the same bounded attempts and the deadline of the run.
+        :return: the parsed reply. `RetryExhaustedError` is raised if no valid reply came in time.
+        """
+        response: ChatCompletion = await self.text_generator.get_json_response_OpenAI(
+            message=prompt,
+            use_cache=use_cache,
+            schema=self.schemas[stage],
+            validator=self.__validator(stage, counted=True)
+        )
+
+        # the reply passed the validator, which counted it
+        return parse_response(response.choices[0].message.content, self.schemas[stage])
+
+    async def __request_predictions(
+        self, prompt: str, samples: int, variant: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        The function `__request_predictions` requests `samples` predictions of the prompt and parses
+        them. A reply that is not valid JSON is requested again.
+        :return: the parsed predictions, without those that failed on every attempt.
+        """
+        try:
+            contents: List[str] = await self.text_generator.get_json_choices_OpenAI(
+                message=prompt,
+                n=samples,
+                cache_variant=variant,
+                schema=Prediction,
+                # an unusable prediction is requested again below
+                validator=self.__validator("prediction")
+            )
+        except RetryExhaustedError as e:
+            logging.error(f"Predictions are dropped: {e}")
+            return []
+
+        predictions: List[Dict[str, Any]] = []
+        for content in contents:
+            try:
+                predictions.append(self.__parse("prediction", content))
+
+            except InvalidResponseError as e:
                 logging.error(
                     f"Prediction generation failed due to {e}. Retry."
                 )
-                valid_prediction = False
-
-                while valid_prediction == False:
-                    prediction: ChatCompletion = await self.text_generator.get_json_response_OpenAI(message=prompt)
-
-
-                    content: str = prediction.choices[0].message.content
-                    matches = re.findall(r"```json\n([\s\S]*?)\n```", content)
-
-                    if matches:
-                        # record the prediction into the object instance
-                        self.the_predictions.append(json.loads(matches[0]))
-                        valid_prediction = True
-                        logging.info("Retry succeeded. Prediction recorded.")
-                    else:
-                        try:
-                            self.the_predictions.append(json.loads(content))
-                            valid_prediction = True
-                            logging.info("Retry succeeded. Prediction recorded.")
-                            
-                        except json.decoder.JSONDecodeError as error:
-                            logging.warning(f"Got wrong json: {error}")
-                            logging.warning(f"Content: {prediction}")
+                try:
+                    predictions.append(
+                        await self.__request_json(prompt=prompt, stage="prediction", use_cache=False)
+                    )
+                    logging.info("Retry succeeded. Prediction recorded.")
+                except RetryExhaustedError as error:
+                    logging.error(f"A prediction is dropped: {error}")
 
-    async def suggest(self) -> None:
-        # load the prompt
-        with open("resources/prompts/prompt_05_suggestions", "r") as prompt:
-            prompt: str = prompt.read()
+        return predictions
 
+    async def __request_suggestions(
+        self, prompt: str, samples: int, variant: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        The function `__request_suggestions` requests `samples` suggestions of the prompt and parses
+        them, each choice of a multi-sample response being a separate branch.
+        :return: the parsed suggestions, without those whose request or parsing failed.
+        """
+        try:
+            contents: List[str] = await self.text_generator.get_json_choices_OpenAI(
+                message=prompt,
+                n=samples,
+                cache_variant=variant,
+                schema=Suggestion,
+                # a single suggestion is requested again by the core, the samples of several are dropped
+                validator=self.__validator("suggestion", retried=samples == 1)
+            )
+        except RetryExhaustedError as e:
+            logging.error(f"Suggestions are dropped: {e}")
+            return []
+
+        suggestions: List[Dict[str, Any]] = []
+        for content in contents:
+            try:
+                suggestions.append(self.__parse("suggestion", content))
+
+            except InvalidResponseError as e:
+                logging.error(f"Could not parse the suggestion: {e}")
+                logging.debug(f"Problematic content: {content}")
+
+        return suggestions
+
+    def __record_suggestion(self, pred_idx: int, suggestion: Dict[str, Any], dedup: QueryOperation) -> None:
+        # Append the parsed JSON to the tree structure, and to the suggestions list unless it duplicates
+        # a suggestion already there
+        self.tree_structure["predictions"][pred_idx]["suggestions"].append(suggestion)
+        if dedup.insert(suggestion, key="move"):
+            self.the_suggestions.append(suggestion)
+
+    async def predict(self) -> None:
+        """
+        The `predict` function reads a prompt from a file, appends a summary to it, generates a
+        prediction using OpenAI's text generator, and records the prediction in the object instance.
+        """
+        prompt: str = self.__prediction_prompt()
+        self.__initialize_tree()
+        self.__plan()
+
+        # get the predictions based on the `base_tree_size`, narrowed to the budget
+        # original seed: seed=458282
+        async for predictions in self.__sample("prediction", prompt, self.shape[0]):
+            for prediction in predictions:
+                self.__record_prediction(prediction)
+        logging.info("Predictions generated. ")
+
+    async def suggest(self) -> None:
         # construct the prompt to send and track prediction indices
         prompt_data: list = []
-        counter: int = 0
         for pred_idx, prediction in enumerate(self.the_predictions):
-            iterative_prompt = (
-                prompt
-                + "[predictions]:"
-                + str(prediction)
-                + "\n"
-                + "[summary]:"
-                + str(self.the_brief)
-                + "\n"
-                + "[thoughts]:"
-                + self.memory.thoughts
-                + "\n"
-            )
-            prompt_data.append((pred_idx, prediction, iterative_prompt))
-            counter += 1
+            iterative_prompt: str = self.__suggestion_prompt(prediction)
+            prompt_data.append((pred_idx, iterative_prompt))
             logging.info(
-                f"Suggestions prompt generated ({counter}/{len(self.the_predictions)})"
+                f"Suggestions prompt generated ({pred_idx + 1}/{len(self.the_predictions)})"
             )
             logging.debug(f"Suggestions prompt preview: {iterative_prompt}")
 
-        # Initialize tree structure for predictions
-        self.tree_structure["root"] = self.the_brief
-        self.tree_structure["predictions"] = []
-        for pred_idx, prediction in enumerate(self.the_predictions):
-            self.tree_structure["predictions"].append(
-                {"id": pred_idx, "data": prediction, "suggestions": []}
-            )
+        # the branches beyond the budget are trimmed, but one is always grown while the budget is not
+        # exhausted, so that the run has suggestions to rank
+        affordable: list = [
+            item for index, item in enumerate(prompt_data)
+            if self.budget.affords(self.__branch_requests() * (index + 1))
+            or (index == 0 and not self.budget.exhausted())
+        ]
+        if len(affordable) < len(prompt_data):
+            logging.info(f"{len(prompt_data) - len(affordable)} branches are trimmed to stay in the budget.")
+            self.budget.trim(len(prompt_data) - len(affordable))
+        prompt_data = affordable
+
+        # the duplicated branches are removed as the suggestions arrive
+        dedup: QueryOperation = QueryOperation(query_object=self.the_suggestions)
+
+        # get the suggestions of every prediction, with prediction index tracking
+        async def branch(pred_idx: int, iterative_prompt: str) -> None:
+            async for suggestions in self.__sample("suggestion", iterative_prompt, self.shape[1]):
+                for suggestion in suggestions:
+                    self.__record_suggestion(pred_idx, suggestion, dedup)
+
+        await asyncio.gather(*[
+            branch(pred_idx, iterative_prompt) for pred_idx, iterative_prompt in prompt_data
+        ])
+        logging.info(f"The number of suggestions after cleaning: {len(self.the_suggestions)}")
+
+    async def expand(self) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        The `expand` function is the pipelined version of `predict` followed by `suggest`. Each
+        prediction is parsed as soon as its request completes and its suggestions are dispatched right
+        away, so a slow prediction only delays its own branch. Duplicates and near-duplicates are
+        dropped as the suggestions arrive.
 
-        # get the suggestions, with prediction index tracking
-        tasks = []
-        task_info = []
-        for pred_idx, prediction, iterative_prompt in prompt_data:
-            for i in range(self.branch_size_factor):
-                tasks.append(
-                    self.text_generator.get_json_response_OpenAI(
-                        message=iterative_prompt
-                    )
-                )
-                task_info.append(pred_idx)
+        :return: an async generator of (progress message, data) tuples, one per landed prediction and
+        one per completed branch.
+        """
+        prompt: str = self.__prediction_prompt()
+        self.__initialize_tree()
+        self.__plan()
+
+        # the producers put (kind, prediction index, results) events, and a "done" event when they end
+        events: asyncio.Queue = asyncio.Queue()
 
-        results: list = await asyncio.gather(*tasks)
+        async def produce(stage: str, stage_prompt: str, samples: int, pred_idx: Optional[int]) -> None:
+            try:
+                async for results in self.__sample(stage, stage_prompt, samples):
+                    events.put_nowait((stage, pred_idx, results))
+            finally:
+                events.put_nowait(("done", pred_idx, None))
+
+        producers: List[asyncio.Task] = [
+            asyncio.create_task(produce("prediction", prompt, self.shape[0], None))
+        ]
+        running: int = 1
+        dedup: QueryOperation = QueryOperation(query_object=self.the_suggestions)
+        # the requests of the branches in flight, which the budget has not necessarily counted yet
+        reserved: int = 0
+
+        try:
+            while running:
+                kind, pred_idx, results = await events.get()
+
+                if kind == "done":
+                    running -= 1
+                    if pred_idx is not None:
+                        reserved -= self.__branch_requests()
+                        branch: Dict[str, Any] = self.tree_structure["predictions"][pred_idx]
+                        yield (
+                            f"🌿 Branch {pred_idx + 1} complete with "
+                            f"{len(branch['suggestions'])} suggestions.",
+                            branch
+                        )
+
+                elif kind == "prediction":
+                    for prediction in results:
+                        pred_idx: int = self.__record_prediction(prediction)
+                        first: bool = running == 1 and not self.the_suggestions
+                        if not self.budget.affords(reserved + self.__branch_requests()) and not (
+                            first and not self.budget.exhausted()
+                        ):
+                            self.budget.trim()
+                            yield (
+                                f"✂️ Prediction {pred_idx + 1} landed, its branch is trimmed to stay in the budget.",
+                                prediction
+                            )
+                            continue
+
+                        producers.append(asyncio.create_task(produce(
+                            "suggestion", self.__suggestion_prompt(prediction), self.shape[1], pred_idx
+                        )))
+                        running += 1
+                        reserved += self.__branch_requests()
+
+                        yield (
+                            f"🔮 Prediction {pred_idx + 1} landed, "
+                            f"{self.shape[1]} suggestions dispatched.",
+                            prediction
+                        )
 
-        # post-process the results
-        for task_idx, result in enumerate(results):
-            pred_idx = task_info[task_idx]
+                else:
+                    for suggestion in results:
+                        self.__record_suggestion(pred_idx, suggestion, dedup)
 
-            # we stop the current iteration and start the next in case if the API request failed.
-            if result is None:
-                continue
+        finally:
+            # the consumer may stop early, the requests still in flight are not needed anymore
+            for producer in producers:
+                producer.cancel()
 
-            content = result.choices[0].message.content
+        logging.info(f"The number of suggestions after cleaning: {len(self.the_suggestions)}")
 
-            # Use a regular expression to find JSON within triple backticks
-            matches = re.findall(r"```json\n([\s\S]*?)\n```", content)
+    async def expand_node(
+        self, moves: List[str], predictions: int, suggestions: int
+    ) -> List[Dict[str, Any]]:
+        """
+        The `expand_node` function grows the tree one level below a suggestion. It predicts how the
+        situation develops once `moves` are taken, and suggests the next moves of every prediction.
+        The suggestions are not deduplicated, nor added to `the_suggestions`.
+
+        :param moves: The moves taken from the root down to the expanded suggestion, in order
+        :type moves: List[str]
+        :param predictions: The number of predictions of the node
+        :type predictions: int
+        :param suggestions: The number of suggestions of each prediction
+        :type suggestions: int
+        :return: the branches of the node, shaped like the ones of `tree_structure`. Every suggestion
+        carries the `previous_moves` that lead to it.
+        """
+        prompt: str = self.__prediction_prompt(moves)
+        branches: List[Dict[str, Any]] = []
+
+        async def branch(node_branch: Dict[str, Any]) -> None:
+            iterative_prompt: str = self.__suggestion_prompt(node_branch["data"], moves)
+            async for results in self.__sample("suggestion", iterative_prompt, suggestions):
+                for suggestion in results:
+                    suggestion["previous_moves"] = list(moves)
+                    node_branch["suggestions"].append(suggestion)
+
+        # the suggestions of a prediction are dispatched as soon as it lands
+        tasks: List[asyncio.Task] = []
+        try:
+            async for results in self.__sample("prediction", prompt, predictions):
+                for prediction in results:
+                    node_branch: Dict[str, Any] = {"id": len(branches), "data": prediction, "suggestions": []}
+                    branches.append(node_branch)
+                    tasks.append(asyncio.create_task(branch(node_branch)))
+            await asyncio.gather(*tasks)
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return branches
+
+    @staticmethod
+    def __simulation_item(item_id: int, suggestion: Dict[str, Any]) -> Dict[str, Any]:
+        item: Dict[str, Any] = {"id": item_id, "move": suggestion["move"], "rationale": suggestion.get("rationale")}
+        if suggestion.get("previous_moves"):
+            item["previous_moves"] = suggestion["previous_moves"]
+
+        return item
+
+    def __simulation_chunks(self, suggestions: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        # the suggestions are packed in order until the next one would exceed the tokens of a chunk,
+        # the tokens of an item being estimated at four characters each
+        chunks: List[List[Dict[str, Any]]] = []
+        chunk: List[Dict[str, Any]] = []
+        chunk_tokens: int = 0
+        for suggestion in suggestions:
+            tokens: int = len(str(self.__simulation_item(0, suggestion))) // 4 + 1
+            if chunk and chunk_tokens + tokens > self.simulation_batch_tokens:
+                chunks.append(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(suggestion)
+            chunk_tokens += tokens
+
+        if chunk:
+            chunks.append(chunk)
+
+        return chunks
+
+    def __simulation_prompt(self, items: List[Dict[str, Any]]) -> str:
+        # the brief and the thoughts are shared by every chunk, so they come before the moves
+        return PromptRegistry.compose(
+            "prompt_06_simulation_batch",
+            [
+                ("summary", str(self.the_brief)),
+                ("thoughts", self.memory.thoughts),
+                ("suggested_next_moves", json.dumps(items, ensure_ascii=False)),
+            ]
+        )
+
+    async def simulate(self, suggestions: List[Dict[str, Any]]) -> int:
+        """
+        The `simulate` function scores the suggestions with the simulation prompt and records their
+        `simulation_score`. The suggestions are packed into chunks of `simulation_batch_tokens`, each
+        chunk being one request, and the chunks are requested in parallel. Suggestions that are
+        already scored are skipped, and the chunks beyond the budget of the run are not requested.
+
+        :param suggestions: The suggestions to score
+        :type suggestions: List[Dict[str, Any]]
+        :return: the number of suggestions that got a score. The others keep their self-reported
+        success rate.
+        """
+        pending: List[Dict[str, Any]] = [
+            suggestion for suggestion in suggestions if "simulation_score" not in suggestion
+        ]
+        if self.simulation_batch_tokens is None or not pending:
+            return 0
+
+        chunks: List[List[Dict[str, Any]]] = self.__simulation_chunks(pending)
+        affordable: int = len(chunks)
+        while affordable and not self.budget.affords(affordable):
+            affordable -= 1
+        if affordable < len(chunks):
+            logging.info(f"The budget affords {affordable} of {len(chunks)} simulation requests.")
+            chunks = chunks[:affordable]
+
+        async def score(chunk: List[Dict[str, Any]]) -> int:
+            # the ids are the positions in the chunk, so a reply cannot score a move of another chunk
+            items: List[Dict[str, Any]] = [
+                self.__simulation_item(item_id, suggestion) for item_id, suggestion in enumerate(chunk)
+            ]
             try:
-                if matches:
-                    # Take the first match as the JSON content
-                    json_str = matches[0]
-                    json_result: dict = json.loads(json_str)
-                else:
-                    # Fallback to parsing the content directly if no markdown was found
-                    json_result: dict = json.loads(content)
-
-                # post-process the `success_rate_in_percentage`
-                if isinstance(
-                    json_result["success_rate_in_percentage"], str
-                ) and json_result["success_rate_in_percentage"].endswith("%"):
-                    json_result["success_rate_in_percentage"] = int(
-                        json_result["success_rate_in_percentage"].rstrip("%")
-                    )
-                    logging.info(
-                        f"Success rate is in percentage: {json_result['success_rate_in_percentage']}, converted"
-                    )
+                simulation: Dict[str, Any] = await self.__request_json(
+                    prompt=self.__simulation_prompt(items), stage="simulation"
+                )
+            except RetryExhaustedError as e:
+                logging.error(f"A chunk of {len(chunk)} suggestions could not be simulated: {e}")
+                return 0
 
-                elif isinstance(json_result["success_rate_in_percentage"], int):
-                    logging.info(
-                        f"Success rate is already an integer: {json_result['success_rate_in_percentage']}"
-                    )
-                    pass
+            scored: int = 0
+            for entry in simulation["scores"]:
+                if 0 <= entry["id"] < len(chunk) and "simulation_score" not in chunk[entry["id"]]:
+                    chunk[entry["id"]]["simulation_score"] = max(0, min(100, entry["recommendation_score"]))
+                    scored += 1
 
-                else:
-                    json_result["success_rate_in_percentage"] = int(
-                        json_result["success_rate_in_percentage"]
-                    )
-                    logging.info(
-                        f"Success rate is not an integer: {json_result['success_rate_in_percentage']}, converted."
-                    )
+            return scored
 
-                # Append the parsed JSON to the suggestions list and tree structure
-                self.the_suggestions.append(json_result)
-                self.tree_structure["predictions"][pred_idx][
-                    "suggestions"
-                ].append(json_result)
+        scored: int = sum(await asyncio.gather(*[score(chunk) for chunk in chunks]))
+        logging.info(f"{scored} of {len(pending)} suggestions simulated in {len(chunks)} requests.")
 
-            except json.JSONDecodeError as e:
-                logging.error(f"Could not decode the JSON response: {e}")
-                logging.error(f"Problematic content: {content}")
+        return scored
 
-            except Exception as e:
-                logging.error(
-                    f"An unexpected error occurred while parsing the JSON: {e}"
-                )
+    def hedge_statistics(self) -> Dict[str, Dict[str, int]]:
+        """
+        The function `hedge_statistics` reports, per stage, how many requests were launched on top of
+        the needed ones and how many of them were wasted.
+        """
+        return {
+            stage: {"fired": fan_out.hedges_fired, "wasted": fan_out.hedges_wasted}
+            for stage, fan_out in self.fan_outs.items()
+        }
 
-        # remove the duplicated branches
-        self.the_suggestions = QueryOperation(
-            query_object=self.the_suggestions
-        ).prune_branches(key="move")
+    @staticmethod
+    def rank(suggestion: Dict[str, Any]) -> Tuple[bool, float]:
+        """
+        The function `rank` is the sort key of the suggestions. The simulation scores and the
+        self-reported success rates are not on the same scale, so the simulated suggestions come first,
+        by their simulation score, and the others after them, by their success rate.
+        """
+        if "simulation_score" in suggestion:
+            return True, suggestion["simulation_score"]
 
-        # for suggestion in self.the_suggestions:
-        #     print(suggestion['move'])
-        #     print(suggestion['rationale'])
-        #     print(suggestion['success_rate_in_percentage'])
+        return False, suggestion.get("success_rate_in_percentage", 0)
 
     async def evaluate(self) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
         """
-        Evaluate the suggestions and decide whether to keep making branches or not.
+        Evaluate the suggestions and decide whether to keep making branches or not. The suggestions
+        are simulated in batches first, and ranked by their simulation score where they got one, ahead
+        of those the budget left unsimulated. The report of the budget is added to the tree.
         """
+        await self.simulate(self.the_suggestions)
 
-        self.the_suggestions.sort(
-            key=lambda x: x["success_rate_in_percentage"], reverse=True
-        )
+        self.the_suggestions.sort(key=self.rank, reverse=True)
 
         # we keep the `top_n_advices`
         self.the_suggestions = self.the_suggestions[: self.top_n_advices]
         logging.info(f"The top {self.top_n_advices} suggestions are kept.")
+        logging.info(f"Parse statistics per stage: {self.parse_statistics.report()}")
+
+        # the shape the run could afford, and what it spent
+        self.tree_structure["budget"] = self.budget.report()
 
         return self.the_suggestions, self.tree_structure
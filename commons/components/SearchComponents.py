@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Dict, List, Tuple
+
+from .mechanics.Budgets import SearchBudget
+from .mechanics.QueryOperations import QueryOperation
+from .QueryComponents import QueryComponent
+
+
+# The `TreeSearchComponent` class deepens the tree of a `QueryComponent` with a beam search. The
+# suggestions of a level are scored by the batched simulation of the query, and only the `beam_width`
+# best ones are expanded into the next level, until `depth` levels are built or the budget of the
+# query is spent.
+class TreeSearchComponent:
+
+    def __init__(
+        self,
+        query: QueryComponent,
+        depth: int = 1,
+        beam_width: int = 3,
+        predictions_per_node: int = 2,
+        suggestions_per_prediction: int = 2,
+    ) -> None:
+        """
+        The initializer of `TreeSearchComponent`.
+
+        :param query: The `QueryComponent` whose first level is already built by `predict` and
+        `suggest`, or by `expand`. Its budget bounds the search
+        :type query: QueryComponent
+        :param depth: The number of suggestion levels of the tree, 1 only scores the first level
+        :type depth: int
+        :param beam_width: The number of suggestions of a level that get expanded
+        :type beam_width: int
+        :param predictions_per_node: The number of predictions made below an expanded suggestion
+        :type predictions_per_node: int
+        :param suggestions_per_prediction: The number of suggestions made for each of them
+        :type suggestions_per_prediction: int
+        """
+        self.query: QueryComponent = query
+        self.depth: int = depth
+        self.beam_width: int = beam_width
+        self.predictions_per_node: int = predictions_per_node
+        self.suggestions_per_prediction: int = suggestions_per_prediction
+        self.budget: SearchBudget = query.budget
+
+    async def search(self) -> AsyncGenerator[Tuple[str, Any], None]:
+        """
+        The `search` function scores the first level of the tree, then expands the best suggestions of
+        each level into the next one. The subtree of every expanded suggestion is recorded under
+        "expansions" in the `tree_structure` of the query, and the unique children are added to its
+        `the_suggestions`.
+
+        :return: an async generator of (progress message, data) tuples, one per scored level.
+        """
+        # the children of a node are compared with every suggestion kept so far
+        dedup: QueryOperation = QueryOperation(query_object=[])
+        for suggestion in self.query.the_suggestions:
+            dedup.insert(suggestion, key="move")
+
+        self.query.tree_structure["expansions"] = []
+        level: List[Dict[str, Any]] = list(self.query.the_suggestions)
+        scored: int = await self.query.simulate(level)
+        yield f"🎯 Level 1 scored, {scored} suggestions simulated.", self.budget.report()
+
+        # the cost of a node: its predictions, their suggestions, and a share of the simulation
+        node_cost: int = self.predictions_per_node * (1 + self.suggestions_per_prediction) + 1
+
+        for depth in range(2, self.depth + 1):
+            beam: List[Dict[str, Any]] = sorted(level, key=QueryComponent.rank, reverse=True)[: self.beam_width]
+            beam = [node for index, node in enumerate(beam) if self.budget.affords(node_cost * (index + 1))]
+            if not beam:
+                yield f"💸 The budget is spent, the search stops at level {depth - 1}.", self.budget.report()
+                break
+
+            async def expand(node: Dict[str, Any]) -> List[Dict[str, Any]]:
+                moves: List[str] = node.get("previous_moves", []) + [str(node["move"])]
+                branches: List[Dict[str, Any]] = await self.query.expand_node(
+                    moves, self.predictions_per_node, self.suggestions_per_prediction
+                )
+                # the suggestions stay flat, their subtrees are recorded beside the first level
+                self.query.tree_structure["expansions"].append(
+                    {"depth": depth, "moves": moves, "predictions": branches}
+                )
+                return [suggestion for branch in branches for suggestion in branch["suggestions"]]
+
+            children: List[Dict[str, Any]] = [
+                child for children in await asyncio.gather(*[expand(node) for node in beam]) for child in children
+            ]
+
+            level = [child for child in children if dedup.insert(child, key="move")]
+            self.query.the_suggestions.extend(level)
+            scored = await self.query.simulate(level)
+            yield (
+                f"🎯 Level {depth} expanded from {len(beam)} suggestions, {scored} new suggestions scored.",
+                self.budget.report()
+            )
+
+        logging.info(f"Search budget spent: {self.budget.report()}")
@@ -1,3 +1,5 @@
+from typing import AsyncGenerator
+
 from .LLMCores import TextGenerationCore
 from .mechanics.Loaders import PromptLoader
 from .QueryComponents import QueryComponent
@@ -8,16 +10,35 @@ class StrategyComponent:
     def __init__(self) -> None:
         self.text_generation_core: TextGenerationCore = TextGenerationCore()
         
-    async def elaborate(self, suggestion: str, query: QueryComponent, memory: MemoryComponent):
-        """
-        This component is used to expand the suggestions into concrete steps.
-        """
-        prompt: str = PromptLoader("prompt_07_finalOutput").prompt_constructor(
+    def __elaboration_prompt(self, suggestion: str, query: QueryComponent, memory: MemoryComponent) -> str:
+        return PromptLoader("prompt_07_finalOutput").prompt_constructor(
             summary=query.the_brief,
             thoughts=memory.thoughts,
             suggestion=suggestion,
         )
         
+    async def elaborate(self, suggestion: str, query: QueryComponent, memory: MemoryComponent):
+        """
+        This component is used to expand the suggestions into concrete steps.
+        """
+        prompt: str = self.__elaboration_prompt(suggestion=suggestion, query=query, memory=memory)
+        
         response = await self.text_generation_core.get_chat_response_OpenAI(message=prompt)
         
-        return response.choices[0].message.content
\ No newline at end of file
+        return response.choices[0].message.content
+    
+    async def elaborate_stream(
+        self, 
+        suggestion: str, 
+        query: QueryComponent, 
+        memory: MemoryComponent
+    ) -> AsyncGenerator[str, None]:
+        """
+        The streaming version of `elaborate`, which yields the elaboration generated so far.
+        """
+        prompt: str = self.__elaboration_prompt(suggestion=suggestion, query=query, memory=memory)
+        
+        elaboration: str = ""
+        async for delta in self.text_generation_core.stream_chat_response_OpenAI(message=prompt):
+            elaboration += delta
+            yield elaboration
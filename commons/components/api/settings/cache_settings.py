@@ -0,0 +1,14 @@
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class CacheSettings(BaseSettings):
+    enabled: bool = Field(False, description="Cache the LLM responses by request content")
+    path: str = Field("resources/cache/llm_responses.sqlite3", description="On-disk store of the cache")
+    ttl_seconds: float = Field(7 * 24 * 3600, description="Seconds before a cached response expires")
+    max_memory_entries: int = Field(1024, description="Responses kept in the in-memory LRU")
+    max_disk_entries: int = Field(20000, description="Responses kept in the on-disk store")
+
+    model_config = SettingsConfigDict(
+        env_prefix="cache_"
+    )
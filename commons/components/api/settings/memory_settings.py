@@ -0,0 +1,20 @@
+from typing import Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class MemorySettings(BaseSettings):
+    path: str = Field("resources/VectorDB", description="On-disk store of the vector database")
+    collection: str = Field("ThinkerMemory", description="The collection holding the memories")
+    write_batch_size: int = Field(32, description="Queued writes that trigger a flush")
+    flush_interval: float = Field(1.0, description="Seconds between two flushes of the queued writes")
+    embedding_cache_entries: int = Field(4096, description="Embeddings kept in the in-memory LRU")
+    retrieval_candidates: int = Field(10, description="Memories retrieved before they are packed")
+    max_distance: Optional[float] = Field(1.5, description="Distance above which a memory is not relevant")
+    context_tokens: int = Field(1000, description="Tokens the memories may take in the brief prompt")
+    max_entry_tokens: int = Field(200, description="Tokens a memory is truncated to")
+
+    model_config = SettingsConfigDict(
+        env_prefix="memory_"
+    )
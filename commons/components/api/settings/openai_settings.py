@@ -6,6 +6,13 @@ class OpenAISettings(BaseSettings):
     api_key: str | None = Field(None, description="OpenAI API key")
     base_url: str | None = Field(None, description="Basic URL of OpenAI API")
     model: str | None = Field(..., description="Specify the OpenAI model to be used")
+    max_connections: int = Field(100, description="Size of the shared HTTP connection pool")
+    max_keepalive_connections: int = Field(20, description="Idle connections kept alive in the pool")
+    keepalive_expiry: float = Field(30.0, description="Seconds before an idle connection is closed")
+    timeout: float = Field(60.0, description="Read/write timeout of a request in seconds")
+    connect_timeout: float = Field(10.0, description="Connect timeout of a request in seconds")
+    supports_n: bool = Field(True, description="Whether the backend can return several choices per request")
+    supports_json_schema: bool = Field(True, description="Whether the backend accepts json_schema response formats")
 
     model_config = SettingsConfigDict(
         env_prefix="openai_"
@@ -0,0 +1,14 @@
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class RetrySettings(BaseSettings):
+    max_attempts: int = Field(4, description="Attempts of an LLM call, the first one included")
+    base_delay: float = Field(0.5, description="Seconds of the first backoff, doubled on every retry")
+    max_delay: float = Field(20.0, description="Upper bound of a backoff in seconds")
+    call_timeout: float | None = Field(60.0, description="Timeout of a single attempt in seconds")
+    run_deadline: float | None = Field(None, description="Seconds a run may spend on LLM calls")
+
+    model_config = SettingsConfigDict(
+        env_prefix="retry_"
+    )
@@ -0,0 +1,16 @@
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class SchedulerSettings(BaseSettings):
+    max_concurrency: int = Field(16, description="Maximum number of LLM requests in flight per process")
+    min_concurrency: int = Field(1, description="Lower bound of the adaptive concurrency limit")
+    requests_per_minute: int | None = Field(None, description="Request rate limit of the provider")
+    tokens_per_minute: int | None = Field(None, description="Token rate limit of the provider")
+    expected_completion_tokens: int = Field(512, description="Completion tokens assumed before the usage is known")
+    increase_step: float = Field(1.0, description="Additive increase of the concurrency limit on success")
+    decrease_factor: float = Field(0.5, description="Multiplicative decrease of the concurrency limit on congestion")
+
+    model_config = SettingsConfigDict(
+        env_prefix="scheduler_"
+    )
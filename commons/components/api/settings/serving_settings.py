@@ -0,0 +1,16 @@
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class ServingSettings(BaseSettings):
+    session_ttl_seconds: float = Field(1800.0, description="Seconds a session is kept after its last use")
+    max_sessions: int = Field(1000, description="Sessions kept at most, the least recently used are evicted")
+    max_concurrent_runs: int = Field(8, description="Tree runs in progress at the same time, the others queue")
+    queue_concurrency: int = Field(64, description="Event handlers Gradio runs at the same time")
+    max_queue_size: int | None = Field(None, description="Events Gradio queues before turning users away")
+    stream_update_interval_seconds: float = Field(0.1, description="Seconds between two updates of a streamed output")
+    stream_update_characters: int = Field(2000, description="Characters a streamed output grows by before an early update")
+
+    model_config = SettingsConfigDict(
+        env_prefix="serving_"
+    )
@@ -0,0 +1,12 @@
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class TracingSettings(BaseSettings):
+    trace_path: str | None = Field(None, description="JSONL file the spans of every run are appended to")
+    metrics_port: int | None = Field(None, description="Port of the Prometheus text endpoint, disabled if not set")
+    metrics_host: str = Field("127.0.0.1", description="Interface the Prometheus text endpoint listens on")
+
+    model_config = SettingsConfigDict(
+        env_prefix="tracing_"
+    )
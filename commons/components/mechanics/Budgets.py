@@ -0,0 +1,208 @@
+# The code defines `SearchBudget`, the global request, token and time budget of a run. It reads the
+# counters and the deadline of a `TextGenerationCore`, so every request of the run is accounted,
+# whichever component sent it. In budget mode, it also sizes the tree of the run to what is left.
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .Hedging import LatencyTracker
+
+
+class SearchBudget:
+
+    def __init__(
+        self,
+        core: Any,
+        max_requests: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        reserve: float = 0.1,
+        request_tokens: int = 1500,
+    ) -> None:
+        """
+        The initializer of `SearchBudget`. The deadline is the `run_deadline` of the core, set by
+        `start_run`.
+
+        :param core: The `TextGenerationCore` whose `overall_requests` and `overall_token_consumption`
+        are spent
+        :type core: TextGenerationCore
+        :param max_requests: The requests the run may send, `None` for no limit
+        :type max_requests: int
+        :param max_tokens: The tokens the run may consume, `None` for no limit
+        :type max_tokens: int
+        :param reserve: The share of the budget held back from new branches, so that the run can
+        still rank what it has once they are spent
+        :type reserve: float
+        :param request_tokens: The tokens of a request assumed until one has completed
+        :type request_tokens: int
+        """
+        self.core: Any = core
+        self.max_requests: Optional[int] = max_requests
+        self.max_tokens: Optional[int] = max_tokens
+        self.reserve: float = reserve
+        self.request_tokens: int = request_tokens
+
+        # the shape of the tree chosen by `plan`, and the branches trimmed to stay in the budget
+        self.shape: Dict[str, Any] = {}
+        self.trimmed: int = 0
+
+    @property
+    def requests(self) -> int:
+        return self.core.overall_requests
+
+    @property
+    def tokens(self) -> int:
+        return self.core.overall_token_consumption
+
+    def limited(self) -> bool:
+        """
+        The function `limited` tells whether the run has a budget at all.
+        """
+        return self.max_requests is not None or self.max_tokens is not None or self.core.run_deadline is not None
+
+    def seconds_left(self) -> Optional[float]:
+        """
+        The function `seconds_left` returns the seconds before the deadline of the run, `None` if the
+        run has no deadline.
+        """
+        if self.core.run_deadline is None:
+            return None
+
+        return max(0.0, self.core.run_deadline - time.monotonic())
+
+    def tokens_per_request(self) -> float:
+        # the average of the run so far, which tracks the prompts actually sent
+        return self.tokens / self.requests if self.requests else self.request_tokens
+
+    @staticmethod
+    def wave_seconds() -> Optional[float]:
+        """
+        The function `wave_seconds` estimates how long a wave of parallel requests takes, from the
+        latencies of the recent suggestion and prediction requests of the process.
+        :return: the median latency in seconds, `None` before any request completed.
+        """
+        for stage in ("suggestion", "prediction"):
+            latency: Optional[float] = LatencyTracker.for_stage(stage).percentile(0.5)
+            if latency is not None:
+                return latency
+
+        return None
+
+    def exhausted(self) -> bool:
+        """
+        The function `exhausted` tells whether the run has spent its requests, its tokens or its time.
+        """
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return True
+        if self.seconds_left() == 0.0:
+            return True
+
+        return False
+
+    def affords(self, requests: int, waves: int = 1) -> bool:
+        """
+        The function `affords` tells whether `requests` more requests fit in what is left of the
+        budget once the reserve is held back. Their tokens are anticipated from the average request of
+        the run, and their time from the latency of a wave of requests.
+
+        :param requests: The requests about to be sent
+        :type requests: int
+        :param waves: The waves of parallel requests they take, one after the other
+        :type waves: int
+        """
+        if self.exhausted():
+            return False
+
+        if self.max_requests is not None and self.requests + requests > self.max_requests:
+            return False
+        if self.max_tokens is not None and (
+            self.tokens + requests * self.tokens_per_request() > (1 - self.reserve) * self.max_tokens
+        ):
+            return False
+
+        seconds_left: Optional[float] = self.seconds_left()
+        wave_seconds: Optional[float] = self.wave_seconds()
+        if seconds_left is not None and wave_seconds is not None:
+            return waves * wave_seconds <= (1 - self.reserve) * seconds_left
+
+        return True
+
+    def remaining_requests(self) -> Optional[int]:
+        """
+        The function `remaining_requests` returns the requests left in the budget, `None` if the
+        requests are not limited.
+        """
+        if self.exhausted():
+            return 0
+        if self.max_requests is None:
+            return None
+
+        return self.max_requests - self.requests
+
+    def plan(self, predictions: int, suggestions: int, samples_per_request: bool = False) -> Tuple[int, int]:
+        """
+        The function `plan` sizes the tree of the run to the budget that is left. The wider of the two
+        levels is narrowed first, one at a time, until the predictions, their suggestions and the
+        simulation of the suggestions fit. A run without budget keeps the configured shape.
+
+        :param predictions: The configured number of predictions, i.e. `base_tree_size`
+        :type predictions: int
+        :param suggestions: The configured number of suggestions per prediction, i.e.
+        `branch_size_factor`
+        :type suggestions: int
+        :param samples_per_request: Whether the samples of a prompt are the choices of one request
+        :type samples_per_request: bool
+        :return: the number of predictions, and of suggestions per prediction.
+        """
+        planned: Tuple[int, int] = (predictions, suggestions)
+        if self.limited():
+            concurrency: int = max(1, int(getattr(self.core.scheduler, "limit", 1)))
+
+            def levels(width: int, branching: int) -> Tuple[int, int]:
+                # the requests of the prediction and of the suggestion levels
+                return (1, width) if samples_per_request else (width, width * branching)
+
+            def waves(width: int, branching: int) -> int:
+                # the levels run one after the other, each in waves of the concurrency limit, and the
+                # simulation takes one more
+                return sum(math.ceil(level / concurrency) for level in levels(width, branching)) + 1
+
+            def fits(width: int, branching: int) -> bool:
+                # the waves that even the narrowest tree takes are no reason to narrow it
+                extra_waves: int = waves(width, branching) - waves(1, 1) + 1
+                # the choices of a multi-sample request are billed, so the tokens follow the samples
+                if self.max_tokens is not None and (
+                    self.tokens + (width + width * branching + 1) * self.tokens_per_request()
+                    > (1 - self.reserve) * self.max_tokens
+                ):
+                    return False
+
+                return self.affords(sum(levels(width, branching)) + 1, waves=extra_waves) or (width, branching) == (1, 1)
+
+            while not fits(*planned):
+                width, branching = planned
+                planned = (width, branching - 1) if branching >= width else (width - 1, branching)
+
+        self.shape = {
+            "base_tree_size": planned[0],
+            "branch_size_factor": planned[1],
+            "configured": {"base_tree_size": predictions, "branch_size_factor": suggestions},
+        }
+
+        return planned
+
+    def trim(self, branches: int = 1) -> None:
+        self.trimmed += branches
+
+    def report(self) -> Dict[str, Any]:
+        seconds_left: Optional[float] = self.seconds_left()
+        return {
+            "requests": self.requests,
+            "max_requests": self.max_requests,
+            "tokens": self.tokens,
+            "max_tokens": self.max_tokens,
+            "seconds_left": round(seconds_left, 3) if seconds_left is not None else None,
+            "shape": self.shape,
+            "trimmed_branches": self.trimmed,
+        }
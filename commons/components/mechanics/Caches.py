@@ -0,0 +1,174 @@
+# The code defines `ResponseCache`, a content-addressed cache of LLM responses. Entries live in an
+# in-memory LRU in front of an SQLite store on disk, and both are bounded by size and TTL.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+
+class ResponseCache:
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 20000,
+    ) -> None:
+        """
+        The initializer of `ResponseCache`.
+
+        :param path: The path of the SQLite file backing the cache, `None` keeps it in memory only
+        :type path: str
+        :param ttl_seconds: The seconds after which an entry expires
+        :type ttl_seconds: float
+        :param max_memory_entries: The number of entries kept in the in-memory LRU
+        :type max_memory_entries: int
+        :param max_disk_entries: The number of entries kept on disk, the least recently used go first
+        :type max_disk_entries: int
+        """
+        self.ttl_seconds: float = ttl_seconds
+        self.max_memory_entries: int = max_memory_entries
+        self.max_disk_entries: int = max_disk_entries
+
+        # key -> (payload, created_at)
+        self.memory: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+
+        self.memory_hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+        self.connection: sqlite3.Connection = None
+        if path:
+            directory: str = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(**request: Any) -> str:
+        """
+        The function `make_key` hashes the canonical JSON of everything that determines a response,
+        e.g. model, messages, response format, seed and sampling parameters.
+        :return: a hex digest that identifies the request.
+        """
+        canonical: str = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def __expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def __remember(self, key: str, payload: str, created_at: float) -> None:
+        self.memory[key] = (payload, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> str:
+        """
+        The function `get` looks the key up in memory first and on disk second.
+
+        :param key: The key produced by `make_key`
+        :type key: str
+        :return: the cached payload, or `None` on a miss.
+        """
+        with self.lock:
+            if key in self.memory:
+                payload, created_at = self.memory[key]
+                if not self.__expired(created_at):
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return payload
+                del self.memory[key]
+
+            if self.connection:
+                row = self.connection.execute(
+                    "SELECT payload, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and not self.__expired(row[1]):
+                    self.connection.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                    )
+                    self.connection.commit()
+                    self.__remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+                if row:
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.connection.commit()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, payload: str) -> None:
+        """
+        The function `put` stores a payload in memory and on disk, then evicts the least recently
+        used entries beyond the size limits.
+
+        :param key: The key produced by `make_key`
+        :type key: str
+        :param payload: The serialized response
+        :type payload: str
+        """
+        now: float = time.time()
+        with self.lock:
+            self.__remember(key, payload, now)
+
+            if self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, payload, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, payload, now, now)
+                )
+                cursor = self.connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self.evictions += max(0, cursor.rowcount)
+                self.connection.commit()
+
+    def delete(self, key: str) -> None:
+        """
+        The function `delete` removes an entry from memory and from disk, e.g. a response that turned
+        out to be unusable.
+
+        :param key: The key produced by `make_key`
+        :type key: str
+        """
+        with self.lock:
+            self.memory.pop(key, None)
+            if self.connection:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+
+    def statistics(self) -> Dict[str, float]:
+        hits: int = self.memory_hits + self.disk_hits
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(hits / (hits + self.misses), 4) if hits + self.misses else 0.0,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+        logging.info(f"Response cache closed: {self.statistics()}")
@@ -0,0 +1,107 @@
+# The code defines `ClientRegistry`, which keeps one pooled API client per (api_type, base_url,
+# api_key) for the whole process, so that concurrent requests reuse warm keep-alive connections. The
+# clients of an event loop are closed when the loop shuts down, along with their connections.
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+from commons.components.api.settings.openai_settings import OpenAISettings
+from commons.components.mechanics.Imports import lazy_import
+
+httpx = lazy_import("httpx")
+openai = lazy_import("openai")
+
+
+class ClientRegistry:
+
+    # (api_type, base_url, api_key) -> (client, event loop the client was created in)
+    clients: Dict[Tuple[str, str, str], Tuple[openai.AsyncOpenAI, asyncio.AbstractEventLoop]] = {}
+    # event loop -> the task closing the clients of the loop when it shuts down
+    closers: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+    @classmethod
+    def get_openai_client(cls, settings: OpenAISettings, api_key: str, base_url: str = None) -> openai.AsyncOpenAI:
+        """
+        The function `get_openai_client` returns the shared `AsyncOpenAI` client for the given
+        credentials, creating it with the pool limits and timeouts of `settings` on first use.
+
+        :param settings: The `OpenAISettings` holding the pool size, keep-alive and timeouts
+        :type settings: OpenAISettings
+        :param api_key: The API key the client authenticates with
+        :type api_key: str
+        :param base_url: The base URL of the API, `None` for the default endpoint
+        :type base_url: str
+        :return: an `AsyncOpenAI` object.
+        """
+        key: Tuple[str, str, str] = ('openai', base_url, api_key)
+        loop: asyncio.AbstractEventLoop = cls.__running_loop()
+
+        if key in cls.clients:
+            client, client_loop = cls.clients[key]
+            if client_loop is loop and not client.is_closed():
+                return client
+            # connections cannot be shared across event loops. The old client is closed by the shutdown
+            # of its loop, unless the loop was closed without shutting its tasks down
+            if client_loop is not None and client_loop.is_closed() and not client.is_closed():
+                logging.warning("A pooled client outlived its event loop, its connections could not be closed")
+
+        http_client: httpx.AsyncClient = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry
+            )
+        )
+        client: openai.AsyncOpenAI = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            # the retries are done by the `RetryPolicy` of `TextGenerationCore`
+            max_retries=0,
+            timeout=httpx.Timeout(settings.timeout, connect=settings.connect_timeout)
+        )
+        cls.clients[key] = (client, loop)
+        if loop is not None and loop not in cls.closers:
+            cls.closers[loop] = loop.create_task(cls.__close_on_shutdown())
+        logging.info(f"Pooled OpenAI client created for {base_url or 'the default endpoint'}")
+
+        return client
+
+    @classmethod
+    async def __close_on_shutdown(cls) -> None:
+        """
+        The function `__close_on_shutdown` waits until its event loop shuts down, i.e. until
+        `asyncio.run` cancels the tasks left, then closes the clients created in the loop.
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        try:
+            await loop.create_future()
+        finally:
+            cls.closers.pop(loop, None)
+            keys: list = [key for key, (_, client_loop) in cls.clients.items() if client_loop is loop]
+            clients: list = [cls.clients.pop(key)[0] for key in keys]
+
+            await asyncio.gather(*[client.close() for client in clients], return_exceptions=True)
+            if clients:
+                logging.info(f"{len(clients)} pooled client(s) of a finished event loop closed.")
+
+    @staticmethod
+    def __running_loop() -> asyncio.AbstractEventLoop:
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    @classmethod
+    async def aclose(cls) -> None:
+        """
+        The function `aclose` closes every pooled client and its connections. It is meant to be
+        awaited once on shutdown, in the event loop that served the requests.
+        """
+        clients: list = [client for client, _ in cls.clients.values()]
+        cls.clients.clear()
+
+        await asyncio.gather(*[client.close() for client in clients], return_exceptions=True)
+        logging.info(f"{len(clients)} pooled client(s) closed.")
@@ -0,0 +1,109 @@
+# The code defines `TokenCounter`, which counts tokens with tiktoken when it is installed and estimates
+# them otherwise, and `ContextPacker`, which fits the most relevant memories into the token budget of a
+# prompt section.
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class TokenCounter:
+
+    # encoding name -> counter, shared by the whole process since loading an encoding is slow
+    counters: Dict[str, "TokenCounter"] = {}
+
+    def __init__(self, encoding_name: str = "o200k_base") -> None:
+        self.encoding: Any = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                # the encoding is downloaded on first use, which fails offline
+                logging.warning(f"Tokens are estimated, the {encoding_name} encoding is unavailable: {e!r}")
+
+    @classmethod
+    def shared(cls, encoding_name: str = "o200k_base") -> "TokenCounter":
+        if encoding_name not in cls.counters:
+            cls.counters[encoding_name] = TokenCounter(encoding_name)
+
+        return cls.counters[encoding_name]
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+
+        # about four characters per token in English
+        return len(text) // 4 + 1
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """
+        The function `truncate` cuts `text` down to about `tokens` tokens, marking the cut with "…".
+        """
+        if self.count(text) <= tokens:
+            return text
+
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text)[:tokens]) + "…"
+
+        return text[:tokens * 4] + "…"
+
+
+class ContextPacker:
+
+    def __init__(
+        self,
+        token_budget: int = 1000,
+        max_distance: Optional[float] = None,
+        max_entry_tokens: int = 200,
+        counter: TokenCounter = None,
+    ) -> None:
+        """
+        The initializer of `ContextPacker`.
+
+        :param token_budget: The tokens the packed entries may take altogether
+        :type token_budget: int
+        :param max_distance: The distance above which an entry is not relevant, `None` keeps them all
+        :type max_distance: float
+        :param max_entry_tokens: The tokens an entry is truncated to
+        :type max_entry_tokens: int
+        :param counter: The `TokenCounter` measuring the entries, the shared one if not given
+        :type counter: TokenCounter
+        """
+        self.token_budget: int = token_budget
+        self.max_distance: Optional[float] = max_distance
+        self.max_entry_tokens: int = max_entry_tokens
+        self.counter: TokenCounter = counter or TokenCounter.shared()
+
+    def pack(self, entries: List[Tuple[str, float]]) -> List[str]:
+        """
+        The function `pack` greedily keeps the closest entries that fit in the token budget. Entries
+        beyond `max_distance` are dropped, long ones are truncated, and an entry that does not fit
+        leaves room for the shorter ones after it.
+
+        :param entries: (text, distance) tuples, the lower the distance the more relevant the text
+        :type entries: List[Tuple[str, float]]
+        :return: the packed texts, the most relevant first.
+        """
+        packed: List[str] = []
+        used: int = 0
+        dropped: int = 0
+        for text, distance in sorted(entries, key=lambda entry: entry[1]):
+            if self.max_distance is not None and distance > self.max_distance:
+                dropped += 1
+                continue
+
+            text = self.counter.truncate(text, self.max_entry_tokens)
+            tokens: int = self.counter.count(text)
+            if used + tokens > self.token_budget:
+                dropped += 1
+                continue
+
+            packed.append(text)
+            used += tokens
+
+        logging.info(f"{len(packed)} memories packed in {used}/{self.token_budget} tokens, {dropped} dropped.")
+
+        return packed
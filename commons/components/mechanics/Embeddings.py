@@ -0,0 +1,95 @@
+# The code defines `EmbeddingService`, which computes the embeddings of the memories explicitly and
+# keeps them in an LRU keyed by the hash of the text, so that a text is embedded once however many
+# times it is stored, queried or submitted again.
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+
+class EmbeddingService:
+
+    def __init__(self, embedding_function: Callable[[List[str]], Any] = None, max_entries: int = 4096) -> None:
+        """
+        The initializer of `EmbeddingService`.
+
+        :param embedding_function: The function embedding a list of texts, the default one of Chroma if
+        not given, so that the embeddings match those Chroma computes itself
+        :type embedding_function: Callable
+        :param max_entries: The number of embeddings kept in the LRU
+        :type max_entries: int
+        """
+        if embedding_function is None:
+            from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+            embedding_function = DefaultEmbeddingFunction()
+        self.embedding_function: Callable[[List[str]], Any] = embedding_function
+        self.max_entries: int = max_entries
+
+        # text hash -> embedding
+        self.entries: OrderedDict[str, List[float]] = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        The function `embed` returns the embeddings of the texts, computing the ones missing from the
+        LRU in a single call of the embedding function. It is synchronous, callers on the event loop
+        run it on the worker of the `MemoryStore`.
+
+        :param texts: The texts to embed
+        :type texts: List[str]
+        :return: the embeddings as lists of floats, in the order of `texts`.
+        """
+        keys: List[str] = [self.make_key(text) for text in texts]
+
+        found: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        with self.lock:
+            for key, text in zip(keys, texts):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                    self.hits += 1
+                elif key not in missing:
+                    missing[key] = text
+                    self.misses += 1
+
+        if missing:
+            embeddings = self.embedding_function(list(missing.values()))
+            with self.lock:
+                for key, embedding in zip(missing, embeddings):
+                    # plain floats, so that the embeddings can be journalled as JSON
+                    found[key] = self.entries[key] = [float(value) for value in embedding]
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            logging.info(f"{len(missing)} texts embedded: {self.statistics()}")
+
+        return [found[key] for key in keys]
+
+    def warm_up(self) -> float:
+        """
+        The function `warm_up` loads the embedding model by embedding a probe text, which is not kept
+        in the LRU.
+        :return: the seconds it took.
+        """
+        started_at: float = time.perf_counter()
+        self.embedding_function(["warm-up"])
+
+        return time.perf_counter() - started_at
+
+    def statistics(self) -> Dict[str, Any]:
+        lookups: int = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,172 @@
+# The code defines `HedgedFanOut`, which runs the parallel requests of a tree level and accepts the
+# first k valid results. It can over-provision the level with extra requests, and send a duplicate of a
+# request that takes longer than a latency percentile, so that one straggler does not hold up the level.
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+
+# The `LatencyTracker` class keeps a rolling window of request latencies of one stage.
+class LatencyTracker:
+
+    # stage name -> tracker, shared by the whole process so that the percentiles have enough history
+    trackers: Dict[str, "LatencyTracker"] = {}
+
+    def __init__(self, window: int = 200) -> None:
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    @classmethod
+    def for_stage(cls, stage: str) -> "LatencyTracker":
+        if stage not in cls.trackers:
+            cls.trackers[stage] = LatencyTracker()
+
+        return cls.trackers[stage]
+
+    def record(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+    def percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """
+        The function `percentile` returns the latency below which `percentile` of the recorded
+        requests completed.
+
+        :param percentile: The percentile between 0 and 1, e.g. 0.95
+        :type percentile: float
+        :param min_samples: The number of recorded latencies needed for a meaningful answer
+        :type min_samples: int
+        :return: the latency in seconds, or `None` if there is not enough history yet.
+        """
+        if len(self.latencies) < max(1, min_samples):
+            return None
+
+        ordered: list = sorted(self.latencies)
+        index: int = min(len(ordered) - 1, math.ceil(percentile * len(ordered)) - 1)
+
+        return ordered[max(0, index)]
+
+
+class HedgedFanOut:
+
+    def __init__(
+        self,
+        tracker: LatencyTracker,
+        extra_requests: int = 0,
+        hedge_percentile: float = None,
+        min_samples: int = 20,
+        max_hedges: int = 0,
+    ) -> None:
+        """
+        The initializer of `HedgedFanOut`. With the defaults it simply runs the k requests and yields
+        their results as they complete.
+
+        :param tracker: The `LatencyTracker` of the stage, fed with the latency of every request
+        :type tracker: LatencyTracker
+        :param extra_requests: The requests launched on top of the k needed ones
+        :type extra_requests: int
+        :param hedge_percentile: The latency percentile after which a duplicate of a request is sent,
+        `None` disables the latency-triggered hedges
+        :type hedge_percentile: float
+        :param min_samples: The latencies recorded before the percentile is trusted
+        :type min_samples: int
+        :param max_hedges: The latency-triggered duplicates allowed per fan-out
+        :type max_hedges: int
+        """
+        self.tracker: LatencyTracker = tracker
+        self.extra_requests: int = extra_requests
+        self.hedge_percentile: float = hedge_percentile
+        self.min_samples: int = min_samples
+        self.max_hedges: int = max_hedges
+
+        # requests launched on top of the needed ones, and requests whose work was thrown away
+        self.hedges_fired: int = 0
+        self.hedges_wasted: int = 0
+
+    async def __timed(self, request: Awaitable[Any]) -> Any:
+        started_at: float = time.monotonic()
+        result: Any = await request
+        self.tracker.record(time.monotonic() - started_at)
+
+        return result
+
+    @staticmethod
+    def __is_valid(result: Any) -> bool:
+        # requests report a failure with `None` or an empty list of results
+        return result is not None and result != []
+
+    async def stream(self, factory: Callable[[int], Awaitable[Any]], k: int) -> AsyncIterator[Any]:
+        """
+        The function `stream` launches the requests and yields the first `k` valid results in the
+        order they complete. The requests still in flight are cancelled once `k` results are in.
+
+        :param factory: A function returning the request of the given index. Indexes beyond `k - 1`
+        belong to extra requests and hedges, so that they can sample differently
+        :type factory: Callable
+        :param k: The number of valid results wanted
+        :type k: int
+        :return: an async iterator of the valid results.
+        """
+        tasks: Dict[asyncio.Task, float] = {}
+        hedged: set = set()
+        next_index: int = 0
+        hedges: int = 0
+        accepted: int = 0
+        failed: int = 0
+
+        def launch() -> asyncio.Task:
+            nonlocal next_index
+            task: asyncio.Task = asyncio.create_task(self.__timed(factory(next_index)))
+            tasks[task] = time.monotonic()
+            next_index += 1
+            return task
+
+        for _ in range(k + self.extra_requests):
+            launch()
+
+        try:
+            while tasks and accepted < k:
+                threshold: Optional[float] = None
+                if self.hedge_percentile is not None and hedges < self.max_hedges:
+                    threshold = self.tracker.percentile(self.hedge_percentile, self.min_samples)
+
+                # wake up when the oldest request that was not hedged yet crosses the threshold
+                timeout: Optional[float] = None
+                if threshold is not None:
+                    candidates: list = [started_at for task, started_at in tasks.items() if task not in hedged]
+                    if candidates:
+                        timeout = max(0.0, min(candidates) + threshold - time.monotonic())
+
+                done, _ = await asyncio.wait(tasks.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    del tasks[task]
+                    if task.exception() is not None:
+                        logging.error(f"A request of the fan-out failed: {task.exception()!r}")
+                        failed += 1
+                    elif not self.__is_valid(task.result()):
+                        failed += 1
+                    elif accepted < k:
+                        accepted += 1
+                        yield task.result()
+
+                if threshold is None or accepted >= k:
+                    continue
+
+                now: float = time.monotonic()
+                for task, started_at in list(tasks.items()):
+                    if task not in hedged and now - started_at >= threshold and hedges < self.max_hedges:
+                        hedged.add(task)
+                        hedges += 1
+                        logging.info(f"A request is slower than {threshold:.2f}s, a hedge is sent.")
+                        hedged.add(launch())
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            fired: int = max(0, next_index - k)
+            self.hedges_fired += fired
+            # a request is wasted if it did not fail and its result was not used
+            self.hedges_wasted += max(0, next_index - accepted - failed) if fired else 0
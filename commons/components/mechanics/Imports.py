@@ -0,0 +1,31 @@
+# The code defines `lazy_import`, which binds a module whose code only runs on its first attribute
+# access. The heavy dependencies (openai, chromadb, numpy, httpx) are bound this way, so importing the
+# package stays fast and a process only pays for the modules it actually uses.
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    The function `lazy_import` returns the module `name`, loaded on first use. A module that is
+    already imported is returned as it is.
+
+    :param name: The absolute name of the module, e.g. "chromadb"
+    :type name: str
+    :return: the module. `ModuleNotFoundError` is raised right away if it is not installed.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module: ModuleType = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
@@ -1,6 +1,11 @@
-# The code defines two classes, `ConfigLoader` and `PromptLoader`, which are used to load
-# configurations from a JSON file and prompts from text files, respectively.
+# The code defines three classes, `ConfigLoader`, `PromptRegistry` and `PromptLoader`, which are used
+# to load configurations from a JSON file and prompts from text files, respectively.
 import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
 
 # The `ConfigLoader` class loads a JSON configuration file and provides a method to access the loaded
 # configurations.
@@ -16,6 +21,95 @@ class ConfigLoader:
         return self.config
 
 
+# The `PromptRegistry` class loads every prompt under `resources/prompts/` once per process. With
+# `watch` on, a changed file is picked up again on its next use.
+class PromptRegistry:
+    
+    prompts_path: str = "resources/prompts/"
+    # prompt name -> (prompt, modification time of the file)
+    prompts: Dict[str, Tuple[str, float]] = {}
+    watch: bool = False
+    # seconds between two checks of the files for changes
+    watch_interval: float = 2.0
+    last_checked: float = 0.0
+    lock: threading.Lock = threading.Lock()
+    
+    @classmethod
+    def load_all(cls) -> None:
+        """
+        The function `load_all` reads every prompt file of `prompts_path` into the registry.
+        """
+        with cls.lock:
+            for prompt_name in sorted(os.listdir(cls.prompts_path)):
+                path: str = os.path.join(cls.prompts_path, prompt_name)
+                if os.path.isfile(path) and not prompt_name.startswith('.'):
+                    cls.__load(prompt_name)
+            cls.last_checked = time.monotonic()
+        
+        logging.info(f"{len(cls.prompts)} prompts loaded into the registry.")
+    
+    @classmethod
+    def __load(cls, prompt_name: str) -> str:
+        path: str = os.path.join(cls.prompts_path, prompt_name)
+        with open(path, "r") as file:
+            prompt: str = file.read()
+        cls.prompts[prompt_name] = (prompt, os.path.getmtime(path))
+        
+        return prompt
+    
+    @classmethod
+    def __reload_changed(cls) -> None:
+        if time.monotonic() - cls.last_checked < cls.watch_interval:
+            return
+        
+        cls.last_checked = time.monotonic()
+        for prompt_name, (_, modified_at) in list(cls.prompts.items()):
+            path: str = os.path.join(cls.prompts_path, prompt_name)
+            if os.path.exists(path) and os.path.getmtime(path) != modified_at:
+                cls.__load(prompt_name)
+                logging.info(f"Prompt {prompt_name} changed on disk and was reloaded.")
+    
+    @classmethod
+    def get(cls, prompt_name: str) -> str:
+        """
+        The function `get` returns a prompt from the registry, loading the registry on first use.
+        
+        :param prompt_name: The file name of the prompt under `prompts_path`
+        :type prompt_name: str
+        :return: the prompt as a string.
+        """
+        if not cls.prompts:
+            cls.load_all()
+        
+        with cls.lock:
+            if cls.watch:
+                cls.__reload_changed()
+            if prompt_name not in cls.prompts:
+                return cls.__load(prompt_name)
+            
+            return cls.prompts[prompt_name][0]
+    
+    @classmethod
+    def compose(cls, prompt_name: str, sections: List[Tuple[str, str]]) -> str:
+        """
+        The function `compose` appends labelled sections to the static instruction of a prompt.
+        Callers pass the sections shared by sibling calls (e.g. the brief) first and the varying ones
+        last, so that the requests of a run start with an identical prefix and hit the prompt cache
+        of the provider.
+        
+        :param prompt_name: The file name of the prompt under `prompts_path`
+        :type prompt_name: str
+        :param sections: A list of (label, content) tuples, rendered as `[label]:content` lines
+        :type sections: list
+        :return: the composed prompt as a string.
+        """
+        prompt: str = cls.get(prompt_name).rstrip("\n") + "\n"
+        for label, content in sections:
+            prompt += "[" + label + "]:" + str(content) + "\n"
+        
+        return prompt
+
+
 # The `PromptLoader` class is a Python class that loads prompts from a file and allows for the
 # construction of prompts with provided arguments.
 class PromptLoader:
@@ -32,9 +126,9 @@ class PromptLoader:
         return len(self.prompt)
     
     def __load_prompt(self) -> str:
-        with open(self.prompts_path + self.prompt_name, "r") as self.file:
-            self.prompt: str = self.file.read()
-            return self.prompt
+        # the prompt comes from the `PromptRegistry`, so the file is not read again on every construction
+        self.prompt: str = PromptRegistry.get(self.prompt_name)
+        return self.prompt
     
     def prompt_constructor(self, *args, **kwargs) -> str:
         """
@@ -0,0 +1,448 @@
+# The code defines `MemoryStore`, which opens the persistent Chroma client once per process and caches
+# its collection handles, so that a `MemoryComponent` is created without touching the disk. Chroma is
+# synchronous, so every call goes through the single worker of the store and is awaited from the event
+# loop. Writes are queued in a `WriteBehindQueue`, journalled on disk, and flushed in batches.
+from __future__ import annotations
+
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+from commons.components.api.settings.memory_settings import MemorySettings
+from commons.components.mechanics.Embeddings import EmbeddingService
+from commons.components.mechanics.Imports import lazy_import
+
+# Chroma is heavy to import, it is loaded when the first store is opened
+chromadb = lazy_import("chromadb")
+
+
+class WriteBehindQueue:
+
+    def __init__(
+        self,
+        store: "MemoryStore",
+        collection: str,
+        journal_path: str,
+        batch_size: int = 32,
+        flush_interval: float = 1.0,
+    ) -> None:
+        """
+        The `WriteBehindQueue` class takes the writes of a collection off the critical path. A write is
+        queued and returns right away; a journal thread appends the queued writes to a journal on disk
+        with one fsync per group, and a background thread applies the journalled writes in batches once
+        `batch_size` of them are pending, every `flush_interval` seconds, and on shutdown. The writes
+        still in the journal after a crash are applied when the queue is opened again.
+
+        :param store: The `MemoryStore` whose worker applies the writes
+        :type store: MemoryStore
+        :param collection: The name of the collection written to
+        :type collection: str
+        :param journal_path: The file holding the writes that are not applied yet
+        :type journal_path: str
+        :param batch_size: The pending writes that trigger a flush
+        :type batch_size: int
+        :param flush_interval: The seconds between two flushes
+        :type flush_interval: float
+        """
+        self.store: "MemoryStore" = store
+        self.collection: str = collection
+        self.journal_path: str = journal_path
+        self.batch_size: int = batch_size
+        self.flush_interval: float = flush_interval
+
+        # the writes are "upsert"s of whole records, "update"s of their metadata, or "usage"s incrementing
+        # counters in the metadata of several records. They are queued
+        # until the journal thread writes them, and pending once they are in the journal.
+        self.queued: List[Dict[str, Any]] = []
+        self.pending: List[Dict[str, Any]] = []
+        # guards the lists only, the callers never wait on the disk
+        self.lock: threading.Lock = threading.Lock()
+        # one writer of the journal file at a time, be it an append or the rewrite after a flush
+        self.journal_lock: threading.Lock = threading.Lock()
+        # one flush at a time, otherwise a flush could rewrite the journal without another's batch
+        self.flushing: threading.Lock = threading.Lock()
+        self.wake_up: threading.Event = threading.Event()
+        self.journal_wake_up: threading.Event = threading.Event()
+        self.closed: bool = False
+        self.flushed: int = 0
+
+        self.__replay()
+        self.journal_thread: threading.Thread = threading.Thread(
+            target=self.__run_journal, name=f"journal-{collection}", daemon=True
+        )
+        self.journal_thread.start()
+        self.thread: threading.Thread = threading.Thread(
+            target=self.__run, name=f"write-behind-{collection}", daemon=True
+        )
+        self.thread.start()
+
+    def __replay(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, encoding="utf-8") as journal:
+            for line in journal:
+                # the last line may be cut short by a crash while it was written
+                try:
+                    self.pending.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.error(f"A truncated write is dropped from {self.journal_path}")
+
+        if self.pending:
+            logging.info(f"{len(self.pending)} journalled writes of {self.collection} are replayed.")
+
+    def __journal(self, writes: List[Dict[str, Any]], path: str, mode: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, mode, encoding="utf-8") as journal:
+            for write in writes:
+                journal.write(json.dumps(write, ensure_ascii=False) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def __append_journal(self) -> None:
+        """
+        The function `__append_journal` moves the queued writes to the journal, with a single fsync
+        for all of them, then makes them pending.
+        """
+        with self.journal_lock:
+            with self.lock:
+                writes: List[Dict[str, Any]] = self.queued
+                self.queued = []
+            if not writes:
+                return
+
+            try:
+                self.__journal(writes, self.journal_path, "a")
+            except OSError as e:
+                # the writes are still applied, they are only lost if the process crashes before
+                logging.error(f"{len(writes)} writes of {self.collection} could not be journalled: {e!r}")
+            with self.lock:
+                self.pending.extend(writes)
+                if len(self.pending) >= self.batch_size:
+                    self.wake_up.set()
+
+    def __rewrite_journal(self) -> None:
+        # the new journal is complete on disk before it replaces the old one, so a crash in between
+        # leaves one of the two whole
+        with self.journal_lock:
+            with self.lock:
+                writes: List[Dict[str, Any]] = list(self.pending)
+            temporary_path: str = self.journal_path + ".tmp"
+            self.__journal(writes, temporary_path, "w")
+            os.replace(temporary_path, self.journal_path)
+
+    def __enqueue(self, write: Dict[str, Any]) -> None:
+        with self.lock:
+            self.queued.append(write)
+        self.journal_wake_up.set()
+
+    def upsert(self, record_id: str, document: str, metadata: Dict[str, Any], **fields: Any) -> None:
+        """
+        The function `upsert` queues a record. Upserts are idempotent, so a write replayed from the
+        journal after it was already applied does no harm.
+        """
+        self.__enqueue({"kind": "upsert", "id": record_id, "document": document, "metadata": metadata, **fields})
+
+    def update(self, record_id: str, metadata: Dict[str, Any]) -> None:
+        """
+        The function `update` queues an update of the metadata of a record.
+        """
+        self.__enqueue({"kind": "update", "id": record_id, "metadata": metadata})
+
+    def record_usage(self, record_ids: List[str], increments: Dict[str, int], metadata: Dict[str, Any] = None) -> None:
+        """
+        The function `record_usage` queues, in one write, the increments of counters in the metadata of
+        several records. They are added to the stored values when the write is applied, so concurrent
+        runs never overwrite each other's counts.
+
+        :param record_ids: The records whose counters are incremented
+        :type record_ids: List[str]
+        :param increments: The counter name -> increment, e.g. {"retrievals": 1}
+        :type increments: Dict[str, int]
+        :param metadata: The metadata set on the records along with the increments
+        :type metadata: Dict[str, Any]
+        """
+        if record_ids:
+            self.__enqueue({"kind": "usage", "ids": list(record_ids), "increments": increments, "metadata": metadata or {}})
+
+    def __apply(self, writes: List[Dict[str, Any]]) -> None:
+        collection: chromadb.Collection = self.store.collection(self.collection)
+
+        # Chroma rejects a batch naming a record twice, so the writes are merged per record: the last
+        # upsert wins, and the updates and the increments after it are merged in order
+        merged_upserts: Dict[str, Dict[str, Any]] = {}
+        merged_updates: Dict[str, Dict[str, Any]] = {}
+        increments: Dict[str, Dict[str, int]] = {}
+        for write in writes:
+            if write["kind"] == "upsert":
+                # copied, the batch is queued again as it was if it fails
+                merged_upserts[write["id"]] = {**write, "metadata": dict(write["metadata"])}
+                merged_updates.pop(write["id"], None)
+                increments.pop(write["id"], None)
+            elif write["kind"] == "update":
+                merged_updates[write["id"]] = {**merged_updates.get(write["id"], {}), **write["metadata"]}
+            else:
+                for record_id in write["ids"]:
+                    merged_updates[record_id] = {**merged_updates.get(record_id, {}), **write["metadata"]}
+                    counters: Dict[str, int] = increments.setdefault(record_id, {})
+                    for name, value in write["increments"].items():
+                        counters[name] = counters.get(name, 0) + value
+
+        # the increments are added to the values of the batch, or to the stored ones. The writes are
+        # applied one batch at a time on the worker, so nothing changes the stored values in between.
+        stored_ids: List[str] = [record_id for record_id in increments if record_id not in merged_upserts]
+        stored: Dict[str, Dict[str, Any]] = {}
+        if stored_ids:
+            records = collection.get(ids=stored_ids, include=["metadatas"])
+            stored = dict(zip(records["ids"], records["metadatas"]))
+        for record_id, counters in increments.items():
+            if record_id in merged_upserts:
+                base: Dict[str, Any] = merged_upserts[record_id]["metadata"]
+                base.update({name: base.get(name, 0) + value for name, value in counters.items()})
+            elif record_id in stored:
+                base = stored[record_id] or {}
+                merged_updates[record_id].update({name: base.get(name, 0) + value for name, value in counters.items()})
+            else:
+                # the record was deleted in the meantime
+                merged_updates.pop(record_id, None)
+
+        # the upserts go first, so that an update of a record written in the same batch finds it
+        upserts: List[Dict[str, Any]] = list(merged_upserts.values())
+        updates: List[Dict[str, Any]] = [
+            {"id": record_id, "metadata": metadata} for record_id, metadata in merged_updates.items()
+        ]
+        if upserts:
+            extra: Dict[str, list] = {}
+            if all("embedding" in write for write in upserts):
+                extra["embeddings"] = [write["embedding"] for write in upserts]
+            collection.upsert(
+                ids=[write["id"] for write in upserts],
+                documents=[write["document"] for write in upserts],
+                metadatas=[write["metadata"] for write in upserts],
+                **extra
+            )
+        if updates:
+            collection.update(
+                ids=[write["id"] for write in updates],
+                metadatas=[write["metadata"] for write in updates]
+            )
+
+    def flush(self) -> int:
+        """
+        The function `flush` applies the pending writes in one batch, on the worker of the store. A
+        batch that fails stays queued for the next flush.
+        :return: the number of writes applied.
+        """
+        with self.flushing:
+            # the writes queued so far are applied too, they must be in the journal first
+            self.__append_journal()
+            with self.lock:
+                writes: List[Dict[str, Any]] = self.pending
+                self.pending = []
+            if not writes:
+                return 0
+
+            try:
+                try:
+                    future = self.store.executor.submit(self.__apply, writes)
+                except RuntimeError:
+                    # the worker no longer takes work at interpreter shutdown, the calling thread applies
+                    # the last batch itself
+                    self.__apply(writes)
+                else:
+                    future.result()
+
+            except Exception as e:
+                logging.error(f"{len(writes)} writes of {self.collection} could not be applied: {e!r}")
+                with self.lock:
+                    self.pending = writes + self.pending
+                return 0
+
+            # the journal only keeps the writes that arrived during the flush
+            self.__rewrite_journal()
+            self.flushed += len(writes)
+            logging.info(f"{len(writes)} writes of {self.collection} flushed.")
+
+            return len(writes)
+
+    def __run_journal(self) -> None:
+        # the writes that arrive while a group is written to the disk make up the next group
+        while not self.closed:
+            self.journal_wake_up.wait()
+            self.journal_wake_up.clear()
+            self.__append_journal()
+
+    def __run(self) -> None:
+        while not self.closed:
+            self.wake_up.wait(self.flush_interval)
+            self.wake_up.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """
+        The function `close` stops the background threads and flushes what is left.
+        """
+        self.closed = True
+        self.journal_wake_up.set()
+        self.wake_up.set()
+        self.journal_thread.join()
+        self.thread.join()
+        self.flush()
+
+
+class MemoryStore:
+
+    # path -> store, shared by the whole process
+    stores: Dict[str, "MemoryStore"] = {}
+    # guards the registry only, each store guards its own caches
+    registry_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, path: str, settings: MemorySettings = None) -> None:
+        """
+        The initializer of `MemoryStore` opens the persistent client, and measures how long it took.
+
+        :param path: The directory of the persistent Chroma database
+        :type path: str
+        :param settings: The `MemorySettings` of the write-behind queues
+        :type settings: MemorySettings
+        """
+        self.path: str = path
+        self.settings: MemorySettings = settings or MemorySettings()
+        self.collections: Dict[str, chromadb.Collection] = {}
+        self.writers: Dict[str, WriteBehindQueue] = {}
+        # guards the caches of collections and writers, the stores of other paths do not wait on it
+        self.lock: threading.Lock = threading.Lock()
+        # the embeddings are computed explicitly and cached, Chroma is handed the vectors
+        self.embeddings: EmbeddingService = EmbeddingService(max_entries=self.settings.embedding_cache_entries)
+        # seconds spent opening the client and each collection, the embedding function included
+        self.startup_seconds: Dict[str, float] = {}
+
+        # one worker runs every Chroma call, which keeps them off the event loop and in order
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+
+        started_at: float = time.perf_counter()
+        self.client = chromadb.PersistentClient(path)
+        self.startup_seconds["client"] = time.perf_counter() - started_at
+        logging.info(f"Memory store {path} opened in {self.startup_seconds['client']:.3f}s")
+
+    @classmethod
+    def shared(cls, path: str = None) -> "MemoryStore":
+        """
+        The function `shared` returns the process-wide `MemoryStore` of `path`, opening it on first
+        use. The path defaults to the one of the `MemorySettings`.
+        :return: a `MemoryStore` object.
+        """
+        path = path or MemorySettings().path
+        # the UI serves several sessions from threads, the client must only be opened once
+        with cls.registry_lock:
+            if path not in cls.stores:
+                cls.stores[path] = MemoryStore(path)
+
+            return cls.stores[path]
+
+    @classmethod
+    def close_all(cls) -> None:
+        """
+        The function `close_all` flushes the writes of every store, and shuts their workers down.
+        """
+        with cls.registry_lock:
+            stores: List["MemoryStore"] = list(cls.stores.values())
+            cls.stores = {}
+
+        for store in stores:
+            store.close()
+
+    def collection(self, name: str = None) -> chromadb.Collection:
+        """
+        The function `collection` returns the cached handle of a collection, creating the collection
+        if it does not exist yet. The name defaults to the one of the `MemorySettings`.
+        :return: a `chromadb.Collection` object.
+        """
+        name = name or self.settings.collection
+        with self.lock:
+            if name not in self.collections:
+                started_at: float = time.perf_counter()
+                self.collections[name] = self.client.get_or_create_collection(name=name)
+                self.startup_seconds[name] = time.perf_counter() - started_at
+                logging.info(f"Memory collection {name} opened in {self.startup_seconds[name]:.3f}s")
+
+            return self.collections[name]
+
+    def forget(self, name: str) -> None:
+        """
+        The function `forget` drops the cached handle of a collection that was deleted or replaced, so
+        that the next `collection` call opens it again.
+        """
+        with self.lock:
+            self.collections.pop(name, None)
+
+    def writer(self, name: str = None) -> WriteBehindQueue:
+        """
+        The function `writer` returns the `WriteBehindQueue` of a collection, replaying its journal on
+        first use.
+        :return: a `WriteBehindQueue` object.
+        """
+        name = name or self.settings.collection
+        with self.lock:
+            if name not in self.writers:
+                self.writers[name] = WriteBehindQueue(
+                    store=self,
+                    collection=name,
+                    journal_path=os.path.join(self.path, f"{name}.journal.jsonl"),
+                    batch_size=self.settings.write_batch_size,
+                    flush_interval=self.settings.flush_interval
+                )
+
+            return self.writers[name]
+
+    async def run(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        The function `run` awaits a synchronous Chroma call on the worker of the store, so that the
+        embedding and the SQLite I/O do not block the event loop.
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        The function `embed` awaits the embeddings of the texts, computed on the worker of the store.
+        """
+        return await self.run(self.embeddings.embed, texts)
+
+    async def flush(self, name: str = None) -> int:
+        """
+        The function `flush` applies the pending writes of a collection now, e.g. before reading back
+        or deleting records that may still be queued.
+        :return: the number of writes applied.
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+        # the flush waits on the worker, so it runs on its own thread
+        return await loop.run_in_executor(None, self.writer(name).flush)
+
+    def close(self) -> None:
+        for writer in list(self.writers.values()):
+            writer.close()
+        self.executor.shutdown(wait=True)
+
+    def statistics(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "collections": list(self.collections),
+            "startup_seconds": dict(self.startup_seconds),
+            "pending_writes": {name: len(writer.pending) + len(writer.queued) for name, writer in self.writers.items()},
+            "flushed_writes": {name: writer.flushed for name, writer in self.writers.items()},
+            "embeddings": self.embeddings.statistics(),
+        }
+
+
+# the writes still queued at exit are flushed rather than left to the journal
+atexit.register(MemoryStore.close_all)
@@ -1,70 +1,150 @@
+from __future__ import annotations
+
+import hashlib
 import logging
+import re
+from typing import Dict, List
+
+from .Imports import lazy_import
+
+np = lazy_import("numpy")
+
+# the hashes of MinHash are computed modulo a Mersenne prime
+MERSENNE_PRIME: int = (1 << 61) - 1
+MAX_HASH: int = (1 << 32) - 1
+
+
+class NearDuplicateIndex:
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.6,
+        num_permutations: int = 128,
+        bands: int = 32,
+        seed: int = 1
+    ) -> None:
+        """
+        The `NearDuplicateIndex` class is an online MinHash/LSH index of texts. Each text is inserted on
+        its own, and only the texts sharing an LSH band with it are compared, so a lookup stays
+        sub-linear as the index grows.
+
+        :param similarity_threshold: The Jaccard similarity of the word sets above which two texts are
+        near-duplicates
+        :type similarity_threshold: float
+        :param num_permutations: The number of hash functions of a MinHash signature
+        :type num_permutations: int
+        :param bands: The number of LSH bands the signature is split into
+        :type bands: int
+        :param seed: The seed of the hash functions
+        :type seed: int
+        """
+        self.similarity_threshold: float = similarity_threshold
+        self.bands: int = bands
+        self.rows: int = num_permutations // bands
+
+        generator = np.random.default_rng(seed)
+        self.a: np.ndarray = generator.integers(1, MERSENNE_PRIME, size=(self.bands * self.rows, 1), dtype=np.uint64)
+        self.b: np.ndarray = generator.integers(0, MERSENNE_PRIME, size=(self.bands * self.rows, 1), dtype=np.uint64)
+
+        # one bucket table per band: band signature -> ids of the texts in the bucket
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self.word_sets: List[frozenset] = []
+
+    def __len__(self) -> int:
+        return len(self.word_sets)
+
+    @staticmethod
+    def __words(text: str) -> frozenset:
+        return frozenset(re.findall(r"\w+", str(text).lower()))
+
+    def __signature(self, words: frozenset) -> np.ndarray:
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=4).digest(), 'little') for word in words],
+            dtype=np.uint64
+        )
+        # the products may wrap around 64 bits, which keeps the functions valid hashes
+        permuted = (self.a * hashes[np.newaxis, :] + self.b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+
+        return permuted.min(axis=1)
+
+    def insert(self, text: str) -> bool:
+        """
+        The function `insert` adds a text to the index unless a near-duplicate of it is already there.
+
+        :param text: The text to insert
+        :type text: str
+        :return: `True` if the text was inserted, `False` if it is a near-duplicate.
+        """
+        words: frozenset = self.__words(text)
+        if not words:
+            return True
+
+        signature: np.ndarray = self.__signature(words)
+        band_keys: List[bytes] = [
+            signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)
+        ]
+
+        # the candidates share at least one band, their real similarity is checked on the word sets
+        candidates: set = set()
+        for band, band_key in enumerate(band_keys):
+            candidates.update(self.buckets[band].get(band_key, ()))
+
+        for candidate in candidates:
+            other: frozenset = self.word_sets[candidate]
+            if len(words & other) / len(words | other) >= self.similarity_threshold:
+                return False
+
+        text_id: int = len(self.word_sets)
+        self.word_sets.append(words)
+        for band, band_key in enumerate(band_keys):
+            self.buckets[band].setdefault(band_key, []).append(text_id)
+
+        return True
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 class QueryOperation:
-    
-    def __init__(self, query_object: list) -> None:
+
+    def __init__(self, query_object: list, similarity_threshold: float = 0.6) -> None:
         self.query_object = query_object
-    
-    def __tfidf_cleaner(self, documents, key: str) -> list:
+
+        # the `window` is responsible for collecting unique moves
+        self.window: set = set()
+        self.index: NearDuplicateIndex = NearDuplicateIndex(similarity_threshold=similarity_threshold)
+        self.unique_documents: list = []
+
+    def insert(self, document: dict, key: str) -> bool:
         """
-        The function `__tfidf_cleaner` takes a list of documents, calculates the TF-IDF matrix and
-        cosine similarity matrix, filters out similar documents based on a similarity threshold, and
-        returns a list of unique documents.
-        
-        :param documents: The `documents` parameter is a list of strings, where each string represents a
-        document
+        The function `insert` keeps a document unless its `key` repeats or is a near-duplicate of a
+        kept one. It is meant to be called as the documents stream in.
+
+        :param document: The document to insert
+        :type document: dict
+        :param key: The key of the document whose text decides uniqueness
+        :type key: str
+        :return: `True` if the document was kept.
         """
-        moves: list = [document[key] for document in documents]
-        
-        vectorizer = TfidfVectorizer()
-        tfidf_matrix = vectorizer.fit_transform(moves)
-
-        # Calculate the cosine similarity matrix
-        cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-
-        # Set a threshold for filtering similar documents (you can adjust this)
-        similarity_threshold = 0.8
-
-        # Filter out similar documents based on the cosine similarity
-        unique_doc_indices = []
-        for i in range(cosine_sim.shape[0]):
-            if all(cosine_sim[i, j] < similarity_threshold or i == j for j in unique_doc_indices):
-                unique_doc_indices.append(i)
-
-        # The resulting list of unique documents
-        unique_moves: list = [moves[i] for i in unique_doc_indices]
-        
-        # Retrieve the original dictionaries corresponding to the unique moves
-        unique_documents: list = [document for document in documents if document[key] in unique_moves]
-        logging.info(f"The number of queries after cleaning: {len(unique_documents)}")
-
-        return unique_documents
-    
+        if document[key] in self.window:
+            return False
+        self.window.add(document[key])
+
+        if not self.index.insert(document[key]):
+            return False
+
+        self.unique_documents.append(document)
+        return True
+
     def prune_branches(self, key: str) -> list:
         """
-        The `prune_branches` function removes duplicate entries from a list of queries based on a
-        specified key and then applies a cleaning process using the `__tfidf_cleaner` method.
-        
+        The `prune_branches` function removes duplicate and near-duplicate entries from a list of
+        queries based on a specified key, keeping the first of each group.
+
         :param key: The `key` parameter is a string that represents the key in the query object
         dictionary that will be used to determine uniqueness
         :type key: str
-        :return: the result of calling the `__tfidf_cleaner` method with the `temporary_query_object` as
-        the `documents` parameter.
+        :return: the unique documents, in their original order.
         """
-        
-        # the `window` is responsible for collecting unique moves
-        window: set = set()
-        
-        # for storing the processed queries
-        temporary_query_object: list = []
-        
-        # strip away the repeated `move`
         for query in self.query_object:
-            if query[key] not in window:
-                window.add(query[key])
-                temporary_query_object.append(query)
-        
-        return self.__tfidf_cleaner(documents=temporary_query_object, key=key)
\ No newline at end of file
+            self.insert(query, key=key)
+        logging.info(f"The number of queries after cleaning: {len(self.unique_documents)}")
+
+        return self.unique_documents
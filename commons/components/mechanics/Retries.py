@@ -0,0 +1,166 @@
+# The code defines `RetryPolicy`, the single retry engine used by every LLM call: classified retryable
+# errors, exponential backoff with full jitter, bounded attempts, per-call timeouts, a per-run deadline
+# and Retry-After handling.
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+
+# The `InvalidResponseError` class is raised by the callers when a response arrived but cannot be used,
+# e.g. the JSON cannot be parsed, so that the policy requests it again.
+class InvalidResponseError(Exception):
+    pass
+
+
+# The `RetryExhaustedError` class is raised when a call failed on every attempt, or when the deadline
+# leaves no room for another attempt. The last error is chained as its `__cause__`.
+class RetryExhaustedError(Exception):
+
+    def __init__(self, message: str, attempts: int) -> None:
+        super().__init__(message)
+        self.attempts: int = attempts
+
+
+class RetryPolicy:
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        call_timeout: float = 60.0,
+        retryable_errors: Tuple[Type[BaseException], ...] = (),
+    ) -> None:
+        """
+        The initializer of `RetryPolicy`.
+
+        :param max_attempts: The number of attempts of a call, the first one included
+        :type max_attempts: int
+        :param base_delay: The delay in seconds of the first backoff, doubled on every retry
+        :type base_delay: float
+        :param max_delay: The upper bound of a backoff delay in seconds
+        :type max_delay: float
+        :param call_timeout: The timeout in seconds of a single attempt, `None` for no timeout
+        :type call_timeout: float
+        :param retryable_errors: The exception types worth another attempt, `InvalidResponseError` and
+        `TimeoutError` are always included
+        :type retryable_errors: tuple
+        """
+        self.max_attempts: int = max(1, max_attempts)
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.call_timeout: float = call_timeout
+        self.retryable_errors: Tuple[Type[BaseException], ...] = (
+            InvalidResponseError, TimeoutError
+        ) + tuple(retryable_errors)
+
+        self.retries: int = 0
+        self.exhausted: int = 0
+
+    def is_retryable(self, error: BaseException) -> bool:
+        return isinstance(error, self.retryable_errors)
+
+    @staticmethod
+    def retry_after(error: BaseException) -> Optional[float]:
+        """
+        The function `retry_after` reads the delay that the server asked for in the `retry-after-ms`
+        or `retry-after` headers of the response attached to an API error.
+        :return: the delay in seconds, or `None` if the server did not ask for one.
+        """
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+
+            value: str = headers.get("retry-after")
+            if not value:
+                return None
+            if value.replace(".", "", 1).isdigit():
+                return float(value)
+
+            # the header may also be an HTTP date
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """
+        The function `backoff` returns the delay before the next attempt: the Retry-After of the
+        server if any, otherwise a full jitter over an exponentially growing window.
+
+        :param attempt: The number of the attempt that just failed, starting at 1
+        :type attempt: int
+        :param error: The error of the failed attempt
+        :type error: BaseException
+        :return: the delay in seconds.
+        """
+        retry_after: Optional[float] = self.retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(
+        self,
+        operation: Callable[[Optional[float]], Awaitable[Any]],
+        deadline: float = None,
+        description: str = "LLM call",
+    ) -> Any:
+        """
+        The function `run` awaits `operation` until it succeeds, retrying the retryable errors. Errors
+        that are not retryable are raised right away.
+
+        :param operation: A coroutine function taking the timeout in seconds of the attempt
+        :type operation: Callable
+        :param deadline: The `time.monotonic()` value after which no attempt is started, e.g. the end
+        of the run
+        :type deadline: float
+        :param description: The name of the call in the logs
+        :type description: str
+        :return: the result of the first successful attempt.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            timeout: Optional[float] = self.call_timeout
+            if deadline is not None:
+                remaining: float = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.exhausted += 1
+                    raise RetryExhaustedError(f"{description}: the run deadline has passed", attempt - 1)
+                timeout = min(timeout, remaining) if timeout else remaining
+
+            try:
+                return await operation(timeout)
+
+            except Exception as e:
+                if not self.is_retryable(e):
+                    raise
+
+                if attempt == self.max_attempts:
+                    self.exhausted += 1
+                    raise RetryExhaustedError(
+                        f"{description} failed after {attempt} attempts: {e!r}", attempt
+                    ) from e
+
+                delay: float = self.backoff(attempt, e)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    # shed the call instead of sleeping past the deadline
+                    self.exhausted += 1
+                    raise RetryExhaustedError(
+                        f"{description}: no time left for a retry after {e!r}", attempt
+                    ) from e
+
+                self.retries += 1
+                logging.warning(
+                    f"{description} failed on attempt {attempt}/{self.max_attempts} ({e!r}), "
+                    f"retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,227 @@
+# The code defines `RequestScheduler`, which shapes the outgoing LLM requests of the whole process:
+# a global concurrency cap that adapts to congestion, and token buckets that keep the request and
+# token rates under the provider limits.
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Tuple, Type
+
+
+# The `TokenBucket` class refills at a constant rate per minute and tells how long a caller has to
+# wait before an amount can be drawn from it.
+class TokenBucket:
+
+    def __init__(self, rate_per_minute: float, capacity: float = None) -> None:
+        self.rate_per_second: float = rate_per_minute / 60
+        self.capacity: float = capacity if capacity else float(rate_per_minute)
+        self.tokens: float = self.capacity
+        self.updated_at: float = time.monotonic()
+
+    def __refill(self) -> None:
+        now: float = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def delay(self, amount: float) -> float:
+        """
+        The function `delay` returns the number of seconds to wait until `amount` can be drawn.
+        Amounts larger than the capacity are clamped, otherwise they would never fit.
+
+        :param amount: The amount that the caller wants to draw from the bucket
+        :type amount: float
+        :return: the waiting time in seconds, 0 when the amount is available right away.
+        """
+        self.__refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount: float) -> None:
+        # the bucket may go into debt, which is paid back by the following refills
+        self.__refill()
+        self.tokens -= amount
+
+    def drain(self) -> None:
+        self.__refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+# The `SchedulerPermit` class is handed to the caller for the duration of one request.
+class SchedulerPermit:
+
+    def __init__(self, estimated_tokens: int, queue_wait: float) -> None:
+        self.estimated_tokens: int = estimated_tokens
+        self.queue_wait: float = queue_wait
+        self.actual_tokens: int = None
+
+    def record_usage(self, total_tokens: int) -> None:
+        """
+        The function `record_usage` records the real token usage reported by the provider, so that
+        the scheduler can correct the estimate it charged to the token bucket.
+
+        :param total_tokens: The total tokens reported in the usage of the response
+        :type total_tokens: int
+        """
+        self.actual_tokens = total_tokens
+
+
+class RequestScheduler:
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        requests_per_minute: int = None,
+        tokens_per_minute: int = None,
+        increase_step: float = 1.0,
+        decrease_factor: float = 0.5,
+        congestion_errors: Tuple[Type[BaseException], ...] = (),
+    ) -> None:
+        """
+        The initializer of `RequestScheduler`.
+
+        :param max_concurrency: The upper bound of requests in flight at the same time
+        :type max_concurrency: int
+        :param min_concurrency: The lower bound that the adaptive limit never goes below
+        :type min_concurrency: int
+        :param requests_per_minute: The request rate limit of the provider, `None` disables it
+        :type requests_per_minute: int
+        :param tokens_per_minute: The token rate limit of the provider, `None` disables it
+        :type tokens_per_minute: int
+        :param increase_step: The additive increase of the limit per window of successful requests
+        :type increase_step: float
+        :param decrease_factor: The multiplicative decrease of the limit on congestion
+        :type decrease_factor: float
+        :param congestion_errors: The exception types that signal congestion, e.g. 429 and timeouts
+        :type congestion_errors: tuple
+        """
+        self.max_concurrency: int = max(1, max_concurrency)
+        self.min_concurrency: int = max(1, min(min_concurrency, self.max_concurrency))
+        self.increase_step: float = increase_step
+        self.decrease_factor: float = decrease_factor
+        self.congestion_errors: Tuple[Type[BaseException], ...] = congestion_errors
+
+        # the adaptive limit starts at the cap and backs off on congestion
+        self.limit: float = float(self.max_concurrency)
+        self.in_flight: int = 0
+        self.congestion_events: int = 0
+
+        self.request_bucket: TokenBucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket: TokenBucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        # asyncio primitives are bound to an event loop, so they are created lazily per loop
+        self.__loop: asyncio.AbstractEventLoop = None
+        self.__condition: asyncio.Condition = None
+        self.__rate_lock: asyncio.Lock = None
+
+    def __primitives(self) -> Tuple[asyncio.Condition, asyncio.Lock]:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if loop is not self.__loop:
+            # requests of a previous loop cannot be in flight anymore
+            self.__loop = loop
+            self.__condition = asyncio.Condition()
+            self.__rate_lock = asyncio.Lock()
+            self.in_flight = 0
+
+        return self.__condition, self.__rate_lock
+
+    async def __wait_for_rate(self, estimated_tokens: int) -> None:
+        while True:
+            delay: float = 0.0
+            if self.request_bucket:
+                delay = max(delay, self.request_bucket.delay(1))
+            if self.token_bucket:
+                delay = max(delay, self.token_bucket.delay(estimated_tokens))
+
+            if delay <= 0:
+                break
+
+            logging.debug(f"Rate limit reached, the request waits for {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        if self.request_bucket:
+            self.request_bucket.consume(1)
+        if self.token_bucket:
+            self.token_bucket.consume(estimated_tokens)
+
+    async def acquire(self, estimated_tokens: int) -> SchedulerPermit:
+        """
+        The function `acquire` waits for a free concurrency slot, then for the rate limits, and
+        returns a permit for one request.
+
+        :param estimated_tokens: The number of tokens that the request is expected to consume
+        :type estimated_tokens: int
+        :return: a `SchedulerPermit` object.
+        """
+        condition, rate_lock = self.__primitives()
+        queued_at: float = time.monotonic()
+
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+        try:
+            # the lock keeps the waiting requests in order, so that the buckets are drained smoothly
+            async with rate_lock:
+                await self.__wait_for_rate(estimated_tokens)
+        except BaseException:
+            await self.__release_slot()
+            raise
+
+        return SchedulerPermit(
+            estimated_tokens=estimated_tokens,
+            queue_wait=time.monotonic() - queued_at
+        )
+
+    async def __release_slot(self) -> None:
+        condition, _ = self.__primitives()
+        async with condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            condition.notify_all()
+
+    async def release(self, permit: SchedulerPermit, congested: bool = False) -> None:
+        """
+        The function `release` returns the slot of a finished request and adapts the concurrency
+        limit: additive increase on success, multiplicative decrease on congestion.
+
+        :param permit: The permit returned by `acquire`
+        :type permit: SchedulerPermit
+        :param congested: Whether the request ended with a rate limit or timeout error
+        :type congested: bool
+        """
+        if self.token_bucket and permit.actual_tokens is not None:
+            # charge the difference between the real usage and the estimate
+            self.token_bucket.consume(permit.actual_tokens - permit.estimated_tokens)
+
+        if congested:
+            self.congestion_events += 1
+            self.limit = max(float(self.min_concurrency), self.limit * self.decrease_factor)
+            # stop admitting new requests until the request bucket refills
+            if self.request_bucket:
+                self.request_bucket.drain()
+            logging.warning(f"Provider congestion detected, concurrency limit lowered to {int(self.limit)}")
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + self.increase_step / self.limit)
+
+        await self.__release_slot()
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int) -> AsyncIterator[SchedulerPermit]:
+        """
+        The function `slot` wraps `acquire` and `release` around one request. Exceptions of the
+        `congestion_errors` types are reported as congestion before they are re-raised.
+
+        :param estimated_tokens: The number of tokens that the request is expected to consume
+        :type estimated_tokens: int
+        """
+        permit: SchedulerPermit = await self.acquire(estimated_tokens=estimated_tokens)
+        try:
+            yield permit
+        except BaseException as e:
+            await self.release(permit, congested=isinstance(e, self.congestion_errors))
+            raise
+        else:
+            await self.release(permit)
@@ -0,0 +1,155 @@
+# The code defines the pydantic models of the structured outputs (`Brief`, `Prediction`, `Suggestion`,
+# `Simulation`), the single routine that parses and validates a response against them, and the
+# per-stage counters of parse failures and retries.
+import json
+import re
+from typing import Any, Dict, List, Type
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+from .Retries import InvalidResponseError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def percentage(value: Any) -> int:
+    # models write "80%", "80" or 80.0 as well
+    if isinstance(value, str):
+        value = value.strip().rstrip("%").strip()
+
+    return int(float(value))
+
+
+class Brief(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    summary: str = Field(..., description="A high level abstraction of the situation")
+
+
+class Scenario(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    scenario: str = Field(..., description="How the situation may develop")
+    probability_in_percentage: int = Field(..., description="The probability of the scenario")
+
+
+class Prediction(BaseModel):
+    # models replying in plain JSON mode name their keys freely, so nothing is required here
+    model_config = ConfigDict(extra="allow")
+
+    scenarios: List[Scenario] = Field(default_factory=list, description="The potential scenarios")
+
+
+class Suggestion(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    move: str = Field(..., description="The suggested next move")
+    rationale: str = Field(..., description="Why the move is suggested")
+    success_rate_in_percentage: int = Field(..., description="The success rate of the move")
+
+    @field_validator("success_rate_in_percentage", mode="before")
+    @classmethod
+    def success_rate(cls, value: Any) -> int:
+        return percentage(value)
+
+
+class SimulationScore(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    id: int = Field(..., description="The id of the simulated move")
+    recommendation_score: int = Field(..., description="How much the move is recommended, in percentage")
+
+    @field_validator("recommendation_score", mode="before")
+    @classmethod
+    def score(cls, value: Any) -> int:
+        return percentage(value)
+
+
+class Simulation(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    scores: List[SimulationScore] = Field(..., description="The score of every simulated move")
+
+
+def response_format(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    The function `response_format` builds the `json_schema` response format of a model, for the
+    backends that support structured outputs.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "schema": model.model_json_schema(),
+            "strict": False
+        }
+    }
+
+
+def loads(content: str) -> Any:
+    # orjson is several times faster than the standard library, but optional
+    if orjson is not None:
+        return orjson.loads(content)
+
+    return json.loads(content)
+
+
+def parse_response(content: str, model: Type[BaseModel] = None) -> Dict[str, Any]:
+    """
+    The function `parse_response` parses the JSON of a response, taking the first ```json block if the
+    model wrapped its answer in markdown, and validates it against `model`.
+
+    :param content: The content of the response
+    :type content: str
+    :param model: The pydantic model the JSON must satisfy, `None` to only parse it
+    :type model: Type[BaseModel]
+    :return: the validated JSON as a dictionary. `InvalidResponseError` is raised if the content is
+    not valid JSON or does not satisfy the model.
+    """
+    if content is None:
+        raise InvalidResponseError("The response has no content")
+
+    if "```" in content:
+        matches = re.findall(r"```(?:json)?\n([\s\S]*?)\n```", content)
+        if matches:
+            content = matches[0]
+
+    try:
+        data: Any = loads(content)
+        if model is None:
+            return data
+
+        return model.model_validate(data).model_dump(exclude_unset=True)
+
+    except (ValueError, ValidationError) as e:
+        # `json.JSONDecodeError` and `orjson.JSONDecodeError` are both `ValueError`s
+        raise InvalidResponseError(f"Invalid {model.__name__ if model else 'JSON'}: {e}") from e
+
+
+# The `ParseStatistics` class counts, per stage, the responses parsed, the parse failures and the
+# extra requests spent on retries.
+class ParseStatistics:
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, Dict[str, int]] = {}
+
+    def __stage(self, stage: str) -> Dict[str, int]:
+        if stage not in self.counters:
+            self.counters[stage] = {"parsed": 0, "failures": 0, "retries": 0}
+
+        return self.counters[stage]
+
+    def parsed(self, stage: str) -> None:
+        self.__stage(stage)["parsed"] += 1
+
+    def failed(self, stage: str) -> None:
+        self.__stage(stage)["failures"] += 1
+
+    def retried(self, stage: str) -> None:
+        self.__stage(stage)["retries"] += 1
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        return {stage: dict(counters) for stage, counters in self.counters.items()}
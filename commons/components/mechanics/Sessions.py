@@ -0,0 +1,148 @@
+# The code defines `SessionStore`, which keeps the state of each user session of the UI apart and
+# evicts the sessions that were not used for a while, and `RunScheduler`, which caps the tree runs in
+# progress in the server and queues the others, telling them their position.
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+class SessionStore:
+
+    def __init__(self, ttl_seconds: float = 1800.0, max_sessions: int = 1000) -> None:
+        """
+        The initializer of `SessionStore`.
+
+        :param ttl_seconds: The seconds a session is kept after its last use
+        :type ttl_seconds: float
+        :param max_sessions: The sessions kept at most, the least recently used are evicted first
+        :type max_sessions: int
+        """
+        self.ttl_seconds: float = ttl_seconds
+        self.max_sessions: int = max_sessions
+
+        # session key -> (last use, value), the least recently used first
+        self.entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.evicted: int = 0
+
+    def __evict(self, now: float) -> None:
+        while self.entries:
+            key, (used_at, _) = next(iter(self.entries.items()))
+            if now - used_at <= self.ttl_seconds and len(self.entries) <= self.max_sessions:
+                break
+            self.entries.popitem(last=False)
+            self.evicted += 1
+            logging.info(f"Session {key} evicted.")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        The function `get` returns the value of a session and renews its lease.
+        :return: the value, or `None` if the session is unknown or expired.
+        """
+        now: float = time.monotonic()
+        with self.lock:
+            self.__evict(now)
+            if key not in self.entries:
+                return None
+            value: Any = self.entries.pop(key)[1]
+            self.entries[key] = (now, value)
+
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        now: float = time.monotonic()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (now, value)
+            self.__evict(now)
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry: Optional[Tuple[float, Any]] = self.entries.pop(key, None)
+
+        return entry[1] if entry else None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class RunScheduler:
+
+    def __init__(self, max_concurrent_runs: int = 8) -> None:
+        """
+        The `RunScheduler` class admits at most `max_concurrent_runs` runs at a time, in the order they
+        arrived. It lives on the event loop of the server.
+
+        :param max_concurrent_runs: The runs in progress at the same time
+        :type max_concurrent_runs: int
+        """
+        self.max_concurrent_runs: int = max(1, max_concurrent_runs)
+        self.running: int = 0
+        # the tickets of the waiting runs, in order of arrival
+        self.waiting: List[object] = []
+        self.admitted: int = 0
+
+        # created on first use, on the loop of the server
+        self.__condition: asyncio.Condition = None
+
+    def __primitives(self) -> asyncio.Condition:
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+
+        return self.__condition
+
+    async def queue(self) -> AsyncIterator[int]:
+        """
+        The function `queue` waits for a free slot. While it waits, it yields the position of the run in
+        the queue whenever it changes, 1 being the next one admitted. Once the iteration is over, the
+        run holds a slot, which it gives back with `release`.
+
+        :return: an async iterator of queue positions, empty if a slot is free right away.
+        """
+        condition: asyncio.Condition = self.__primitives()
+        ticket: object = object()
+        self.waiting.append(ticket)
+        reported: Optional[int] = None
+        try:
+            while True:
+                async with condition:
+                    if self.running < self.max_concurrent_runs and self.waiting[0] is ticket:
+                        self.waiting.pop(0)
+                        self.running += 1
+                        self.admitted += 1
+                        # the next run in the queue may fit as well
+                        condition.notify_all()
+                        return
+
+                    position: int = self.waiting.index(ticket) + 1
+                    if position == reported:
+                        await condition.wait()
+                        continue
+
+                # the position is reported without holding the lock, the consumer may take its time
+                reported = position
+                yield position
+
+        finally:
+            if ticket in self.waiting:
+                # the user left while waiting, the runs behind move up
+                self.waiting.remove(ticket)
+                async with condition:
+                    condition.notify_all()
+
+    async def release(self) -> None:
+        condition: asyncio.Condition = self.__primitives()
+        async with condition:
+            self.running = max(0, self.running - 1)
+            condition.notify_all()
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "admitted": self.admitted,
+            "max_concurrent_runs": self.max_concurrent_runs,
+        }
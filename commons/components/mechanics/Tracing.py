@@ -0,0 +1,402 @@
+# The code defines `RunTracer`, which records the spans of a run: one per stage of `query_process` and
+# one per LLM call, with their queue wait, time to first byte, latency, tokens, retries and parse
+# failures. The spans of a run are summarised per stage and appended to a JSONL trace file, and every
+# span feeds the process-wide `MetricsRegistry`, which `serve_metrics` exports in the Prometheus text
+# format.
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from commons.components.api.settings.tracing_settings import TracingSettings
+
+
+class MetricsRegistry:
+
+    # the registry of the process, fed by every tracer
+    registry: "MetricsRegistry" = None
+
+    # the upper bounds of the histogram buckets, in seconds
+    buckets: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    descriptions: Dict[str, str] = {
+        "thinker_runs_total": "Runs of query_process, by outcome",
+        "thinker_run_seconds": "Duration of a run of query_process",
+        "thinker_stage_seconds": "Duration of a stage of query_process",
+        "thinker_llm_calls_total": "LLM calls, by stage and outcome",
+        "thinker_llm_attempts_total": "Requests sent to the API, retries included",
+        "thinker_llm_retries_total": "Requests sent again after a failed attempt",
+        "thinker_llm_tokens_total": "Tokens consumed, by stage and type",
+        "thinker_llm_latency_seconds": "Latency of an LLM call, retries and queue wait included",
+        "thinker_llm_queue_wait_seconds": "Seconds an LLM call waited in the scheduler",
+        "thinker_llm_first_byte_seconds": "Seconds until the first content of an LLM call arrived",
+        "thinker_parse_failures_total": "Replies that did not satisfy the model of their stage",
+    }
+
+    def __init__(self) -> None:
+        # (name, labels) -> value
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        # (name, labels) -> [count per bucket, sum, count]
+        self.histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], list] = {}
+        # the runs are served from several threads by the UI
+        self.lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> "MetricsRegistry":
+        if MetricsRegistry.registry is None:
+            MetricsRegistry.registry = MetricsRegistry()
+
+        return MetricsRegistry.registry
+
+    @staticmethod
+    def __key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def increment(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = self.__key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self.__key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            histogram: list = self.histograms[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def __labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+        if not labels:
+            return ""
+
+        return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+    def render(self) -> str:
+        """
+        The function `render` exports the counters and the histograms in the Prometheus text format.
+        :return: the exposition text.
+        """
+        lines: List[str] = []
+        with self.lock:
+            names: set = {name for name, _ in self.counters} | {name for name, _ in self.histograms}
+            for name in sorted(names):
+                lines.append(f"# HELP {name} {self.descriptions.get(name, name)}")
+
+                if any(key[0] == name for key in self.counters):
+                    lines.append(f"# TYPE {name} counter")
+                    for (series, labels), value in sorted(self.counters.items()):
+                        if series == name:
+                            lines.append(f"{name}{self.__labels(labels)} {value:g}")
+                    continue
+
+                lines.append(f"# TYPE {name} histogram")
+                for (series, labels), (counts, total, count) in sorted(self.histograms.items()):
+                    if series != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{self.__labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self.__labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self.__labels(labels)} {total:g}")
+                    lines.append(f"{name}_count{self.__labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# The `Span` class times one stage or one LLM call, and holds its attributes.
+class Span:
+
+    def __init__(self, kind: str, name: str, stage: Optional[str] = None) -> None:
+        # "stage" or "llm"
+        self.kind: str = kind
+        self.name: str = name
+        # the stage an LLM call was made in
+        self.stage: Optional[str] = stage
+        self.started_at: float = time.time()
+        self.__started: float = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.attributes: Dict[str, Any] = {}
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.__started
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, name: str, value: float = 1) -> None:
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        self.seconds = self.elapsed()
+        if error is not None:
+            self.error = repr(error)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "stage": self.stage,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class RunTracer:
+
+    # one writer at a time, the runs of the UI finish on several threads
+    file_lock: threading.Lock = threading.Lock()
+
+    def __init__(
+        self,
+        run_id: str = None,
+        trace_path: str = None,
+        metrics: MetricsRegistry = None,
+    ) -> None:
+        """
+        The initializer of `RunTracer`.
+
+        :param run_id: The identifier of the run in the trace file, a random one if not given
+        :type run_id: str
+        :param trace_path: The JSONL file the spans are appended to when the run finishes, the one of
+        the `TracingSettings` if not given, and no file if neither is set
+        :type trace_path: str
+        :param metrics: The `MetricsRegistry` fed with the spans, the shared one if not given
+        :type metrics: MetricsRegistry
+        """
+        self.run_id: str = run_id or str(uuid.uuid4())
+        self.trace_path: Optional[str] = trace_path or TracingSettings().trace_path
+        self.metrics: MetricsRegistry = metrics or MetricsRegistry.shared()
+
+        self.spans: List[Span] = []
+        # the stage the LLM calls are attributed to
+        self.current_stage: Optional[str] = None
+        self.parse_failures: Dict[str, int] = {}
+        # the span of the run, from `start` to `finish`
+        self.__run: Optional[Span] = None
+        self.__summary: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        """
+        The function `start` starts the span of the run, the tracer times nothing before it.
+        """
+        self.__run = Span("run", "query_process")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Span]:
+        """
+        The function `stage` times a stage of the run, and attributes the LLM calls made meanwhile to
+        it.
+        """
+        span: Span = Span("stage", name)
+        previous: Optional[str] = self.current_stage
+        self.current_stage = name
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        else:
+            span.end()
+        finally:
+            self.current_stage = previous
+            self.spans.append(span)
+            self.metrics.observe("thinker_stage_seconds", span.seconds, stage=name)
+
+    @contextmanager
+    def call(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """
+        The function `call` times an LLM call. The caller records the attempts, the queue wait, the
+        first byte and the tokens on the span it is handed.
+        """
+        span: Span = Span("llm", name, stage=self.current_stage or "other")
+        span.set(attempts=0, queue_wait=0.0, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        else:
+            span.end()
+        finally:
+            self.spans.append(span)
+            self.__record_call(span)
+
+    def __record_call(self, span: Span) -> None:
+        labels: Dict[str, str] = {"stage": span.stage}
+        attributes: Dict[str, Any] = span.attributes
+        if span.error:
+            outcome = "error"
+        elif attributes.get("cache_hit"):
+            outcome = "cache_hit"
+        else:
+            outcome = "ok"
+
+        self.metrics.increment("thinker_llm_calls_total", outcome=outcome, **labels)
+        self.metrics.increment("thinker_llm_attempts_total", attributes["attempts"], **labels)
+        self.metrics.increment("thinker_llm_retries_total", max(0, attributes["attempts"] - 1), **labels)
+        for kind in ("prompt", "completion", "cached"):
+            if attributes.get(f"{kind}_tokens"):
+                self.metrics.increment("thinker_llm_tokens_total", attributes[f"{kind}_tokens"], type=kind, **labels)
+        self.metrics.observe("thinker_llm_latency_seconds", span.seconds, **labels)
+        if attributes["attempts"]:
+            self.metrics.observe("thinker_llm_queue_wait_seconds", attributes["queue_wait"], **labels)
+        if attributes.get("first_byte") is not None:
+            self.metrics.observe("thinker_llm_first_byte_seconds", attributes["first_byte"], **labels)
+
+    def parse_failure(self, stage: str) -> None:
+        """
+        The function `parse_failure` counts a reply that did not satisfy the model of its stage.
+        """
+        self.parse_failures[stage] = self.parse_failures.get(stage, 0) + 1
+        self.metrics.increment("thinker_parse_failures_total", stage=stage)
+
+    @staticmethod
+    def __percentile(values: List[float], percentile: float) -> Optional[float]:
+        if not values:
+            return None
+
+        ordered: List[float] = sorted(values)
+        return ordered[max(0, min(len(ordered) - 1, math.ceil(percentile * len(ordered)) - 1))]
+
+    def __aggregate(self, calls: List[Span]) -> Dict[str, Any]:
+        latencies: List[float] = [span.seconds for span in calls]
+        first_bytes: List[float] = [
+            span.attributes["first_byte"] for span in calls if span.attributes.get("first_byte") is not None
+        ]
+
+        return {
+            "llm_calls": len(calls),
+            "errors": sum(1 for span in calls if span.error),
+            "cache_hits": sum(1 for span in calls if span.attributes.get("cache_hit")),
+            "attempts": sum(span.attributes["attempts"] for span in calls),
+            "retries": sum(max(0, span.attributes["attempts"] - 1) for span in calls),
+            "prompt_tokens": sum(span.attributes.get("prompt_tokens", 0) for span in calls),
+            "completion_tokens": sum(span.attributes.get("completion_tokens", 0) for span in calls),
+            "cached_tokens": sum(span.attributes.get("cached_tokens", 0) for span in calls),
+            "queue_wait_seconds": sum(span.attributes["queue_wait"] for span in calls),
+            "latency_p50": self.__percentile(latencies, 0.5),
+            "latency_p95": self.__percentile(latencies, 0.95),
+            "first_byte_p50": self.__percentile(first_bytes, 0.5),
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        The function `summary` aggregates the spans recorded so far per stage.
+        :return: a dictionary of the duration of the run, and the duration, LLM calls, tokens, retries,
+        latency percentiles and parse failures of each stage and of the whole run.
+        """
+        if self.__summary is not None:
+            return self.__summary
+
+        calls: List[Span] = [span for span in self.spans if span.kind == "llm"]
+        stages: Dict[str, Dict[str, Any]] = {}
+        for span in self.spans:
+            if span.kind == "stage":
+                stages[span.name] = {"seconds": span.seconds, "error": span.error}
+        for stage in {span.stage for span in calls} | set(self.parse_failures):
+            stages.setdefault(stage, {"seconds": None, "error": None}).update(
+                self.__aggregate([span for span in calls if span.stage == stage]),
+                parse_failures=self.parse_failures.get(stage, 0)
+            )
+
+        seconds: Optional[float] = None
+        if self.__run is not None:
+            seconds = self.__run.elapsed() if self.__run.seconds is None else self.__run.seconds
+
+        return {
+            "run_id": self.run_id,
+            "seconds": seconds,
+            "stages": stages,
+            "total": {**self.__aggregate(calls), "parse_failures": sum(self.parse_failures.values())},
+        }
+
+    def finish(self, error: Optional[BaseException] = None) -> Dict[str, Any]:
+        """
+        The function `finish` ends the run, feeds its duration to the metrics and appends its spans and
+        its summary to the trace file. Calling it again returns the same summary.
+        :return: the summary of the run.
+        """
+        if self.__summary is not None:
+            return self.__summary
+
+        if self.__run is None:
+            self.start()
+        self.__run.end(error=error)
+        self.__summary = summary = self.summary()
+        self.metrics.increment("thinker_runs_total", outcome="error" if error else "ok")
+        self.metrics.observe("thinker_run_seconds", self.__run.seconds)
+
+        total: Dict[str, Any] = summary["total"]
+        logging.info(
+            f"Run {self.run_id} took {summary['seconds']:.2f}s: {total['llm_calls']} LLM calls, "
+            f"{total['retries']} retries, {total['prompt_tokens'] + total['completion_tokens']} tokens, "
+            f"{total['parse_failures']} parse failures"
+        )
+
+        if self.trace_path:
+            try:
+                self.__write(summary)
+            except OSError as e:
+                logging.error(f"The trace of run {self.run_id} could not be written: {e!r}")
+
+        return summary
+
+    def __write(self, summary: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.trace_path) or ".", exist_ok=True)
+        with RunTracer.file_lock, open(self.trace_path, "a", encoding="utf-8") as trace:
+            for span in self.spans:
+                trace.write(json.dumps({"run_id": self.run_id, **span.to_dict()}, ensure_ascii=False) + "\n")
+            trace.write(json.dumps({"kind": "summary", **summary}, ensure_ascii=False) + "\n")
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = None) -> ThreadingHTTPServer:
+    """
+    The function `serve_metrics` serves the metrics in the Prometheus text format at `/metrics`, from a
+    daemon thread.
+
+    :param port: The port to listen on
+    :type port: int
+    :param host: The interface to listen on
+    :type host: str
+    :param registry: The `MetricsRegistry` to export, the shared one if not given
+    :type registry: MetricsRegistry
+    :return: the running server, which `shutdown` stops.
+    """
+    registry = registry or MetricsRegistry.shared()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            body: bytes = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # the scrapes would flood the log of the application
+            logging.debug(format % args)
+
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Metrics served at http://{host}:{server.server_port}/metrics")
+
+    return server
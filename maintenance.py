@@ -0,0 +1,98 @@
+"""
+The command line of the memory maintenance. Each command prints the index size and the query latency
+of the memory collection before and after it, as JSON.
+
+Usage:
+    python maintenance.py stats
+    python maintenance.py retain --max-age-days 180 [--min-retrievals 1] [--dry-run]
+    python maintenance.py consolidate [--older-than-days 90] [--similarity 0.9] [--no-llm] [--dry-run]
+    python maintenance.py compact
+    python maintenance.py export --output memories.jsonl [--embeddings]
+    python maintenance.py import --input memories.jsonl [--batch-size 256]
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+from commons.components.MaintenanceComponents import MemoryMaintenanceComponent, RetentionPolicy
+from commons.components.mechanics.MemoryStores import MemoryStore
+
+
+async def main(arguments: argparse.Namespace) -> None:
+    maintenance: MemoryMaintenanceComponent = MemoryMaintenanceComponent(
+        collection=arguments.collection, page_size=arguments.page_size
+    )
+
+    match arguments.command:
+        case "stats":
+            report = await maintenance.metrics()
+        case "retain":
+            report = await maintenance.apply_retention(
+                RetentionPolicy(
+                    max_age_days=arguments.max_age_days,
+                    min_retrievals=arguments.min_retrievals,
+                    recently_used_days=arguments.recently_used_days,
+                    keep_outcomes=not arguments.drop_outcomes
+                ),
+                dry_run=arguments.dry_run
+            )
+        case "consolidate":
+            report = await maintenance.consolidate(
+                older_than_days=arguments.older_than_days,
+                similarity=arguments.similarity,
+                min_cluster_size=arguments.min_cluster_size,
+                use_llm=not arguments.no_llm,
+                dry_run=arguments.dry_run
+            )
+        case "compact":
+            report = await maintenance.compact()
+        case "export":
+            exported: int = 0
+            with open(arguments.output, "w", encoding="utf-8") as output:
+                async for line in maintenance.export_memories(embeddings=arguments.embeddings):
+                    output.write(line)
+                    exported += 1
+            report = {"exported": exported, "output": arguments.output}
+        case "import":
+            with open(arguments.input, encoding="utf-8") as lines:
+                report = await maintenance.import_memories(lines, batch_size=arguments.batch_size)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the memory collection of Thinker")
+    parser.add_argument("--collection", default=None, help="The collection, MEMORY_COLLECTION by default")
+    parser.add_argument("--page-size", type=int, default=500, help="The records read at once")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="Report the index size and the query latency")
+
+    retain = commands.add_parser("retain", help="Delete the old memories that are not used")
+    retain.add_argument("--max-age-days", type=float, required=True)
+    retain.add_argument("--min-retrievals", type=int, default=1)
+    retain.add_argument("--recently-used-days", type=float, default=30)
+    retain.add_argument("--drop-outcomes", action="store_true", help="Also delete memories with an outcome")
+    retain.add_argument("--dry-run", action="store_true")
+
+    consolidate = commands.add_parser("consolidate", help="Summarise clusters of old similar memories")
+    consolidate.add_argument("--older-than-days", type=float, default=90)
+    consolidate.add_argument("--similarity", type=float, default=0.9)
+    consolidate.add_argument("--min-cluster-size", type=int, default=3)
+    consolidate.add_argument("--no-llm", action="store_true", help="Join the situations instead")
+    consolidate.add_argument("--dry-run", action="store_true")
+
+    commands.add_parser("compact", help="Rebuild the collection, offline")
+
+    export = commands.add_parser("export", help="Stream the memories to a JSONL file")
+    export.add_argument("--output", required=True)
+    export.add_argument("--embeddings", action="store_true", help="Export the embeddings as well")
+
+    load = commands.add_parser("import", help="Upsert the memories of a JSONL file in batches")
+    load.add_argument("--input", required=True)
+    load.add_argument("--batch-size", type=int, default=256)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(parser.parse_args()))
+    MemoryStore.close_all()
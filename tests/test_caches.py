@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from commons.components.mechanics import Caches
+from commons.components.mechanics.Caches import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(Caches, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_make_key_is_canonical():
+    key = ResponseCache.make_key(model="m", messages=[{"role": "user", "content": "hi"}], seed=1)
+    assert key == ResponseCache.make_key(seed=1, messages=[{"content": "hi", "role": "user"}], model="m")
+    assert key != ResponseCache.make_key(model="m", messages=[{"role": "user", "content": "hi"}], seed=2)
+
+
+def test_entries_expire_after_the_ttl(clock, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    cache.put("key", "payload")
+
+    clock.now += 59
+    assert cache.get("key") == "payload"
+
+    clock.now += 2
+    assert cache.get("key") is None
+    assert cache.statistics()["misses"] == 1
+    # the expired entry is gone from the disk too
+    assert cache.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_memory_keeps_the_most_recently_used_entries(clock):
+    cache = ResponseCache(None, max_memory_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.evictions == 1
+
+
+def test_disk_serves_what_memory_evicted(clock, tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_memory_entries=1, max_disk_entries=10)
+    cache.put("a", "1")
+    cache.put("b", "2")
+
+    assert cache.get("a") == "1"
+    statistics = cache.statistics()
+    assert statistics["disk_hits"] == 1
+    assert statistics["hit_rate"] == 1.0
+
+
+def test_disk_evicts_the_least_recently_accessed(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path, max_memory_entries=1, max_disk_entries=2)
+    for key in "abc":
+        clock.now += 1
+        cache.put(key, key)
+    cache.close()
+
+    reopened = ResponseCache(path)
+    assert reopened.get("a") is None
+    assert reopened.get("b") == "b"
+    assert reopened.get("c") == "c"
+
+
+def test_deleted_entries_are_gone_from_memory_and_disk(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path)
+    cache.put("a", "1")
+    cache.delete("a")
+
+    assert cache.get("a") is None
+    assert ResponseCache(path).get("a") is None
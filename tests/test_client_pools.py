@@ -0,0 +1,29 @@
+import asyncio
+
+from commons.components.api.settings.openai_settings import OpenAISettings
+from commons.components.mechanics.ClientPools import ClientRegistry
+
+
+async def get_client():
+    return ClientRegistry.get_openai_client(
+        settings=OpenAISettings(model="test"), api_key="test", base_url="http://127.0.0.1:9/v1"
+    )
+
+
+def test_the_client_is_shared_within_a_loop():
+    async def scenario():
+        return await get_client(), await get_client()
+
+    first, second = asyncio.run(scenario())
+    assert first is second
+
+
+def test_clients_are_closed_when_their_loop_shuts_down():
+    first = asyncio.run(get_client())
+    assert first.is_closed()
+    assert ClientRegistry.clients == {}
+    assert ClientRegistry.closers == {}
+
+    second = asyncio.run(get_client())
+    assert second is not first
+    assert second.is_closed()
@@ -0,0 +1,53 @@
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+from commons.components.MaintenanceComponents import MemoryMaintenanceComponent
+from commons.components.MemoryComponents import MemoryComponent
+from commons.components.api.settings.memory_settings import MemorySettings
+from commons.components.mechanics.Embeddings import EmbeddingService
+from commons.components.mechanics.MemoryStores import MemoryStore
+
+
+def embed(texts):
+    # a stand-in for the embedding model, the same text always gets the same vector
+    return [[byte / 255 for byte in hashlib.sha256(text.encode("utf-8")).digest()] for text in texts]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MemoryStore(str(tmp_path / "VectorDB"), settings=MemorySettings(max_distance=None))
+    store.embeddings = EmbeddingService(embedding_function=embed)
+    yield store
+    store.close()
+
+
+def test_records_without_metadata_can_be_retrieved_after_an_import(store):
+    lines = [
+        json.dumps({"id": "bare", "document": "I am worn out at work"}),
+        json.dumps({"id": "partial", "document": "I am worn out at home", "metadata": {"eventual_outcome": None}}),
+        json.dumps({"id": "complete", "document": "I am worn out", "metadata": {
+            "timestamp": "2024-01-01 00:00:00", "selected_recommendation": "Rest", "eventual_outcome": "Better"
+        }}),
+        json.dumps({"document": "I am worn out again", "metadata": ["not", "an", "object"]}),
+    ]
+
+    async def scenario():
+        report = await MemoryMaintenanceComponent(store=store).import_memories(lines)
+        assert report == {"imported": 3, "embedded": 3, "skipped": 1}
+
+        memory = MemoryComponent(situation="I am worn out at work", thoughts="", store=store)
+        return await memory.retrieve_memory()
+
+    events = asyncio.run(scenario())
+
+    assert len(events) == 3
+    assert any("event_content: I am worn out at work\neventual_outcome: \n" in event for event in events)
+    assert any("eventual_outcome: Better\nselected_recommendation: Rest" in event for event in events)
+
+    records = store.collection().get(ids=["bare", "partial"], include=["metadatas"])
+    for metadata in records["metadatas"]:
+        assert metadata["selected_recommendation"] == metadata["eventual_outcome"] == ""
+        assert metadata["timestamp"]
@@ -0,0 +1,167 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from commons.components.mechanics.MemoryStores import MemoryStore, WriteBehindQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeCollection:
+
+    def __init__(self) -> None:
+        self.records = {}
+
+    def upsert(self, ids, documents, metadatas, **fields) -> None:
+        if len(set(ids)) != len(ids):
+            raise ValueError("Chroma rejects a batch naming a record twice")
+        for record_id, document, metadata in zip(ids, documents, metadatas):
+            self.records[record_id] = (document, dict(metadata))
+
+    def update(self, ids, metadatas) -> None:
+        for record_id, metadata in zip(ids, metadatas):
+            self.records[record_id][1].update(metadata)
+
+    def get(self, ids, include=None):
+        found = [record_id for record_id in ids if record_id in self.records]
+        return {"ids": found, "metadatas": [dict(self.records[record_id][1]) for record_id in found]}
+
+
+class FakeStore:
+    """
+    A stand-in for `MemoryStore`, the queue only needs its worker and its collections.
+    """
+
+    def __init__(self) -> None:
+        self.memories = FakeCollection()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def collection(self, name):
+        return self.memories
+
+
+@pytest.fixture
+def store():
+    store = FakeStore()
+    yield store
+    store.executor.shutdown()
+
+
+def open_queue(store, journal_path) -> WriteBehindQueue:
+    # no flush unless the test asks for one
+    return WriteBehindQueue(store, "memories", str(journal_path), batch_size=10_000, flush_interval=3600)
+
+
+def crash_after_writes(journal_path, count: int) -> None:
+    """
+    Queues `count` upserts in another process, waits until they are journalled and kills the process
+    before any of them is applied.
+    """
+    script = textwrap.dedent(f"""
+        import os, time
+        from commons.components.mechanics.MemoryStores import WriteBehindQueue
+
+        queue = WriteBehindQueue(None, "memories", {str(journal_path)!r}, batch_size=10_000, flush_interval=3600)
+        for index in range({count}):
+            queue.upsert(f"id{{index}}", f"document {{index}}", {{"index": index}})
+        while len(queue.pending) < {count}:
+            time.sleep(0.01)
+        os._exit(0)
+    """)
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, timeout=60)
+
+
+def test_journalled_writes_are_replayed_after_a_crash(store, tmp_path):
+    journal_path = tmp_path / "memories.journal"
+    crash_after_writes(journal_path, 50)
+    # the process may also die in the middle of a line
+    with open(journal_path, "a", encoding="utf-8") as journal:
+        journal.write('{"kind": "upsert", "id": "torn')
+
+    queue = open_queue(store, journal_path)
+    try:
+        assert len(queue.pending) == 50
+        assert queue.flush() == 50
+    finally:
+        queue.close()
+
+    assert sorted(store.memories.records) == sorted(f"id{index}" for index in range(50))
+    assert store.memories.records["id7"] == ("document 7", {"index": 7})
+    # the journal only keeps what is not applied yet
+    assert journal_path.read_text(encoding="utf-8") == ""
+
+
+def test_replayed_writes_are_idempotent(store, tmp_path):
+    journal_path = tmp_path / "memories.journal"
+    crash_after_writes(journal_path, 5)
+    store.memories.upsert(ids=["id0"], documents=["document 0"], metadatas=[{"index": 0}])
+
+    queue = open_queue(store, journal_path)
+    queue.close()
+
+    assert len(store.memories.records) == 5
+    assert store.memories.records["id0"] == ("document 0", {"index": 0})
+
+
+def test_writes_are_journalled_before_they_are_applied(store, tmp_path):
+    journal_path = tmp_path / "memories.journal"
+    queue = open_queue(store, journal_path)
+    try:
+        queue.upsert("a", "document", {"retrievals": 0})
+        deadline = time.monotonic() + 5
+        while not queue.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        lines = journal_path.read_text(encoding="utf-8").splitlines()
+        assert [json.loads(line)["id"] for line in lines] == ["a"]
+        assert store.memories.records == {}
+    finally:
+        queue.close()
+
+    assert "a" in store.memories.records
+
+
+def test_usage_increments_add_up_across_batches(store, tmp_path):
+    queue = open_queue(store, tmp_path / "memories.journal")
+    try:
+        queue.upsert("a", "document", {"retrievals": 2})
+        queue.upsert("b", "document", {})
+        queue.flush()
+
+        for _ in range(3):
+            queue.record_usage(["a", "b", "deleted"], {"retrievals": 1}, {"last_retrieved": "today"})
+        queue.flush()
+        queue.record_usage(["a"], {"retrievals": 1})
+        # an upsert in the same batch is incremented before it is written
+        queue.upsert("c", "document", {"retrievals": 0})
+        queue.record_usage(["c"], {"retrievals": 1})
+        queue.flush()
+    finally:
+        queue.close()
+
+    records = store.memories.records
+    assert records["a"][1] == {"retrievals": 6, "last_retrieved": "today"}
+    assert records["b"][1] == {"retrievals": 3, "last_retrieved": "today"}
+    assert records["c"][1] == {"retrievals": 1}
+    assert "deleted" not in records
+
+
+def test_a_busy_store_does_not_block_the_others(tmp_path):
+    busy = MemoryStore.shared(str(tmp_path / "busy"))
+    other = None
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor, busy.lock:
+            # the registry and the caches of another store do not wait on the lock of this one
+            other = executor.submit(MemoryStore.shared, str(tmp_path / "other")).result(timeout=30)
+            executor.submit(other.collection, "memories").result(timeout=30)
+    finally:
+        for store in (busy, other):
+            if store is not None:
+                MemoryStore.stores.pop(store.path, None)
+                store.close()
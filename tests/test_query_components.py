@@ -0,0 +1,15 @@
+from commons.components.QueryComponents import QueryComponent
+
+
+def test_simulated_suggestions_rank_first():
+    suggestions = [
+        {"id": "high rate", "success_rate_in_percentage": 90},
+        {"id": "low score", "success_rate_in_percentage": 40, "simulation_score": 3},
+        {"id": "high score", "success_rate_in_percentage": 10, "simulation_score": 8},
+        {"id": "low rate", "success_rate_in_percentage": 20},
+    ]
+
+    ranked = sorted(suggestions, key=QueryComponent.rank, reverse=True)
+
+    # the scores and the rates are on different scales, a rate never outranks a score
+    assert [suggestion["id"] for suggestion in ranked] == ["high score", "low score", "high rate", "low rate"]
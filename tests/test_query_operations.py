@@ -0,0 +1,63 @@
+from commons.components.mechanics.QueryOperations import NearDuplicateIndex, QueryOperation
+
+
+def pair(index: int, shared: int, own: int):
+    """
+    Two texts sharing `shared` words, with `own` words each of their own.
+    """
+    common = [f"common{index}x{word}" for word in range(shared)]
+    first = common + [f"first{index}x{word}" for word in range(own)]
+    second = common + [f"second{index}x{word}" for word in range(own)]
+    return " ".join(first), " ".join(second)
+
+
+def test_recall_at_the_threshold():
+    # 6 shared words out of 10: a Jaccard similarity of exactly 0.6
+    index = NearDuplicateIndex(similarity_threshold=0.6)
+    found = 0
+    for number in range(200):
+        first, second = pair(number, shared=6, own=2)
+        assert index.insert(first)
+        found += not index.insert(second)
+
+    # an LSH of 32 bands of 4 rows finds a pair at 0.6 with a probability of about 0.99
+    assert found / 200 >= 0.95
+
+
+def test_pairs_below_the_threshold_are_kept():
+    # 5 shared words out of 11: a Jaccard similarity of 0.45, the candidates are checked exactly
+    index = NearDuplicateIndex(similarity_threshold=0.6)
+    for number in range(200):
+        first, second = pair(number, shared=5, own=3)
+        assert index.insert(first)
+        assert index.insert(second)
+
+    assert len(index) == 400
+
+
+def test_near_duplicates_ignore_case_and_punctuation():
+    index = NearDuplicateIndex(similarity_threshold=0.6)
+    assert index.insert("Talk it through with the manager")
+    assert not index.insert("talk it through with the manager!")
+    assert index.insert("Go for a run in the park")
+
+
+def test_prune_branches_keeps_the_first_of_each_group():
+    documents = [
+        {"move": "Take a short break and come back to it"},
+        {"move": "Talk it through with the manager"},
+        {"move": "Take a short break and come back to it"},
+        {"move": "take a short break and then come back to it"},
+        {"move": "Sleep on it and decide tomorrow"},
+    ]
+    operation = QueryOperation(documents)
+
+    assert operation.prune_branches(key="move") == [documents[0], documents[1], documents[4]]
+
+
+def test_insert_streams_documents_in():
+    operation = QueryOperation([])
+    assert operation.insert({"move": "Ask a colleague for a second opinion"}, key="move")
+    assert not operation.insert({"move": "Ask a colleague for a second opinion"}, key="move")
+    assert operation.insert({"move": "Delegate the least important tasks"}, key="move")
+    assert len(operation.unique_documents) == 2
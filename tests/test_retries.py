@@ -0,0 +1,115 @@
+import asyncio
+import email.utils
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from commons.components.mechanics.Retries import InvalidResponseError, RetryExhaustedError, RetryPolicy
+
+
+class RateLimitError(Exception):
+
+    def __init__(self, headers=None) -> None:
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class Operation:
+    """
+    A stand-in for an LLM call that fails with the given errors, then succeeds.
+    """
+
+    def __init__(self, *errors: BaseException) -> None:
+        self.errors = list(errors)
+        self.timeouts = []
+
+    async def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retry_after_headers():
+    assert RetryPolicy.retry_after(RateLimitError({"retry-after-ms": "1500"})) == 1.5
+    assert RetryPolicy.retry_after(RateLimitError({"retry-after": "2"})) == 2.0
+    assert RetryPolicy.retry_after(RateLimitError({"retry-after": "0.25"})) == 0.25
+
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert RetryPolicy.retry_after(RateLimitError({"retry-after": http_date})) == pytest.approx(30, abs=2)
+
+    assert RetryPolicy.retry_after(RateLimitError({"retry-after": "soon"})) is None
+    assert RetryPolicy.retry_after(RateLimitError()) is None
+    assert RetryPolicy.retry_after(ValueError()) is None
+
+
+def test_backoff_honours_retry_after_up_to_the_max_delay():
+    policy = RetryPolicy(base_delay=0.5, max_delay=20)
+    assert policy.backoff(1, RateLimitError({"retry-after": "3"})) == 3
+    assert policy.backoff(1, RateLimitError({"retry-after": "60"})) == 20
+
+    # full jitter over an exponentially growing window otherwise
+    for attempt in range(1, 8):
+        assert 0 <= policy.backoff(attempt, ValueError()) <= min(20, 0.5 * 2 ** (attempt - 1))
+
+
+def test_retryable_errors_are_retried_until_success():
+    policy = RetryPolicy(max_attempts=4, base_delay=0, retryable_errors=(RateLimitError,))
+    operation = Operation(InvalidResponseError(), RateLimitError({"retry-after": "0"}))
+
+    assert asyncio.run(policy.run(operation)) == "ok"
+    assert len(operation.timeouts) == 3
+    assert policy.retries == 2
+
+
+def test_other_errors_are_raised_right_away():
+    policy = RetryPolicy(max_attempts=4, base_delay=0)
+    operation = Operation(KeyError("bug"))
+
+    with pytest.raises(KeyError):
+        asyncio.run(policy.run(operation))
+    assert len(operation.timeouts) == 1
+
+
+def test_attempts_are_bounded():
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    operation = Operation(*[InvalidResponseError()] * 5)
+
+    with pytest.raises(RetryExhaustedError) as error:
+        asyncio.run(policy.run(operation))
+    assert error.value.attempts == 3
+    assert isinstance(error.value.__cause__, InvalidResponseError)
+    assert len(operation.timeouts) == 3
+    assert policy.exhausted == 1
+
+
+def test_passed_deadline_starts_no_attempt():
+    policy = RetryPolicy()
+    operation = Operation()
+
+    with pytest.raises(RetryExhaustedError) as error:
+        asyncio.run(policy.run(operation, deadline=time.monotonic() - 1))
+    assert error.value.attempts == 0
+    assert operation.timeouts == []
+
+
+def test_attempt_timeout_is_bounded_by_the_deadline():
+    policy = RetryPolicy(call_timeout=60)
+    operation = Operation()
+
+    asyncio.run(policy.run(operation, deadline=time.monotonic() + 5))
+    assert 4 < operation.timeouts[0] <= 5
+
+
+def test_retry_that_would_end_past_the_deadline_is_shed():
+    policy = RetryPolicy(max_attempts=4, retryable_errors=(RateLimitError,))
+    operation = Operation(RateLimitError({"retry-after": "10"}))
+
+    started_at = time.monotonic()
+    with pytest.raises(RetryExhaustedError) as error:
+        asyncio.run(policy.run(operation, deadline=time.monotonic() + 2))
+    # shed without sleeping for the Retry-After
+    assert time.monotonic() - started_at < 1
+    assert error.value.attempts == 1
+    assert policy.retries == 0
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from commons.components.mechanics.Schedulers import RequestScheduler, TokenBucket
+
+
+class CongestionError(Exception):
+    pass
+
+
+def test_admission_waits_for_a_free_slot():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=2)
+        first = await scheduler.acquire(estimated_tokens=10)
+        await scheduler.acquire(estimated_tokens=10)
+
+        third = asyncio.create_task(scheduler.acquire(estimated_tokens=10))
+        await asyncio.sleep(0.05)
+        assert not third.done()
+        assert scheduler.in_flight == 2
+
+        await scheduler.release(first)
+        permit = await asyncio.wait_for(third, timeout=1)
+        assert permit.queue_wait >= 0.04
+        assert scheduler.in_flight == 2
+
+    asyncio.run(scenario())
+
+
+def test_congestion_halves_the_limit_and_success_raises_it_back():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=8, min_concurrency=2, congestion_errors=(CongestionError,))
+
+        with pytest.raises(CongestionError):
+            async with scheduler.slot(estimated_tokens=10):
+                raise CongestionError()
+        assert scheduler.limit == 4
+        assert scheduler.congestion_events == 1
+
+        for _ in range(3):
+            await scheduler.release(await scheduler.acquire(estimated_tokens=10), congested=True)
+        # never below the floor
+        assert scheduler.limit == 2
+
+        # additive increase: about one slot per window of `limit` successful requests, up to the cap
+        for _ in range(2):
+            async with scheduler.slot(estimated_tokens=10):
+                pass
+        assert scheduler.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+        for _ in range(100):
+            async with scheduler.slot(estimated_tokens=10):
+                pass
+        assert scheduler.limit == 8
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_errors_other_than_congestion_keep_the_limit():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=4, congestion_errors=(CongestionError,))
+        scheduler.limit = 3.0
+
+        with pytest.raises(ValueError):
+            async with scheduler.slot(estimated_tokens=10):
+                raise ValueError()
+        assert scheduler.limit > 3
+        assert scheduler.congestion_events == 0
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_request_gives_its_slot_back():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=1, requests_per_minute=60)
+        scheduler.request_bucket.tokens = 0
+
+        waiting = asyncio.create_task(scheduler.acquire(estimated_tokens=10))
+        await asyncio.sleep(0.05)
+        # admitted, then waiting for the request bucket
+        assert scheduler.in_flight == 1
+
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_delay_and_debt():
+    bucket = TokenBucket(rate_per_minute=60)
+    assert bucket.delay(60) == 0
+
+    bucket.consume(90)
+    # 30 tokens in debt at 1 token per second
+    assert bucket.delay(1) == pytest.approx(31, abs=0.1)
+    # amounts above the capacity are clamped
+    assert bucket.delay(1000) == pytest.approx(90, abs=0.1)
+
+
+def test_congestion_drains_the_request_bucket():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=4, requests_per_minute=600)
+        permit = await scheduler.acquire(estimated_tokens=1)
+        await scheduler.release(permit, congested=True)
+
+        assert scheduler.request_bucket.delay(1) > 0
+
+    asyncio.run(scenario())
+
+
+def test_token_estimate_is_corrected_by_the_actual_usage():
+    async def scenario():
+        scheduler = RequestScheduler(max_concurrency=4, tokens_per_minute=1000)
+        async with scheduler.slot(estimated_tokens=100) as permit:
+            permit.record_usage(400)
+
+        assert scheduler.token_bucket.tokens == pytest.approx(600, abs=1)
+
+    asyncio.run(scenario())
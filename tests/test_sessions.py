@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+
+from commons.components.mechanics import Sessions
+from commons.components.mechanics.Sessions import RunScheduler, SessionStore
+
+
+async def wait(scheduler: RunScheduler, name: str, admitted: list, positions: dict) -> None:
+    positions[name] = []
+    async for position in scheduler.queue():
+        positions[name].append(position)
+    admitted.append(name)
+
+
+async def settle() -> None:
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_runs_are_admitted_in_order_of_arrival():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent_runs=2)
+        admitted, positions = [], {}
+        tasks = []
+        for name in "abcde":
+            tasks.append(asyncio.create_task(wait(scheduler, name, admitted, positions)))
+            await settle()
+
+        assert admitted == ["a", "b"]
+        assert positions == {"a": [], "b": [], "c": [1], "d": [2], "e": [3]}
+
+        for _ in range(3):
+            await scheduler.release()
+            await settle()
+        await asyncio.gather(*tasks)
+
+        assert admitted == list("abcde")
+        assert positions["e"] == [3, 2, 1]
+        assert scheduler.statistics() == {"running": 2, "waiting": 0, "admitted": 5, "max_concurrent_runs": 2}
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_runs_leave_the_queue():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent_runs=1)
+        admitted, positions = [], {}
+        tasks = {}
+        for name in "abc":
+            tasks[name] = asyncio.create_task(wait(scheduler, name, admitted, positions))
+            await settle()
+
+        # the user of "b" leaves, "c" moves up
+        tasks["b"].cancel()
+        await settle()
+        assert tasks["b"].cancelled()
+        assert positions["c"] == [2, 1]
+        assert len(scheduler.waiting) == 1
+
+        await scheduler.release()
+        await tasks["c"]
+        assert admitted == ["a", "c"]
+        assert scheduler.running == 1
+
+    asyncio.run(scenario())
+
+
+def test_closed_queue_iterator_gives_its_place_up():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent_runs=1)
+        async for _ in scheduler.queue():
+            pass
+
+        waiting = scheduler.queue()
+        assert await waiting.__anext__() == 1
+        await waiting.aclose()
+        assert scheduler.waiting == []
+
+        await scheduler.release()
+        async for _ in scheduler.queue():
+            raise AssertionError("a free slot is taken right away")
+        assert scheduler.running == 1
+
+    asyncio.run(scenario())
+
+
+def test_sessions_expire_after_the_ttl(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(Sessions, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    sessions = SessionStore(ttl_seconds=60)
+    sessions.put("a", 1)
+    sessions.put("b", 2)
+
+    clock.now = 50
+    # a read renews the lease
+    assert sessions.get("a") == 1
+
+    clock.now = 100
+    assert sessions.get("a") == 1
+    assert sessions.get("b") is None
+    assert sessions.evicted == 1
+
+
+def test_least_recently_used_sessions_are_evicted_first():
+    sessions = SessionStore(max_sessions=2)
+    sessions.put("a", 1)
+    sessions.put("b", 2)
+    sessions.get("a")
+    sessions.put("c", 3)
+
+    assert sessions.get("b") is None
+    assert sessions.get("a") == 1
+    assert sessions.pop("c") == 3
+    assert len(sessions) == 1
@@ -0,0 +1,17 @@
+import time
+
+from commons.components.mechanics.Tracing import MetricsRegistry, RunTracer
+
+
+def test_the_run_is_timed_from_its_start():
+    tracer = RunTracer(trace_path="", metrics=MetricsRegistry())
+    # the time between building the tracer and starting the run is not part of the run
+    time.sleep(0.2)
+    tracer.start()
+    with tracer.stage("brief"):
+        pass
+
+    summary = tracer.finish()
+
+    assert summary["seconds"] < 0.1
+    assert "brief" in summary["stages"]